@@ -4,24 +4,31 @@ Motor de Limpieza de Datos Históricos con IA y Métodos Estadísticos.
 Detecta outliers (picos irreales) e imputa ceros anómalos (quiebres de stock)
 para generar una demanda "limpia" que alimentará el motor de pronósticos.
 
-Ejecución: py -3 backend/agents/ai_data_cleaner.py
+Por defecto la corrida es incremental: solo se re-limpia la ventana final que los datos
+nuevos pueden afectar (más los SKUs cuyas estadísticas cambiaron) y se reemplaza ese
+rango en la tabla. --full re-limpia los 365 días y reescribe la tabla completa.
+
+Ejecución: py -3 backend/agents/ai_data_cleaner.py [--full] [--workers N] [--fixtures DIR] [--output-dir DIR]
 """
 
 import os
 import sys
 import math
 import logging
-import requests
+import argparse
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Path setup ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 sys.path.insert(0, BACKEND_DIR)
 
-from modules.api_client import get_headers, SUPABASE_URL, post_to_supabase
+from modules import state_store
+from modules.shared_arrays import SharedArrays, attach, detach
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
 from sync_logger import log_sync_result
 
 # --- Logging ---
@@ -36,31 +43,208 @@ logging.basicConfig(
 )
 
 BATCH_SIZE = 1000
+MIN_POINTS = 5              # Series con menos registros se guardan sin limpiar
+OUTLIER_PERCENTILE = 95
+OUTLIER_Z = 2.0
+STOCKOUT_WINDOW = 7         # Días a cada lado del cero evaluado
+STOCKOUT_MIN_ACTIVE = 0.7   # Fracción mínima de días con movimiento en la ventana
+METODO_OUTLIER = 'winsorized_p95'
+METODO_QUIEBRE = 'imputed_rolling_mean'
+
+HISTORY_DAYS = 365
+CLEAN_STATE = 'cleaner_state.pkl'
+RAW_REFRESH_DAYS = 14     # Días previos a la última corrida que se vuelven a descargar (cargas tardías)
+MAX_GAP_DAYS = 7          # Con una última corrida más antigua se hace una corrida completa
+STATS_THRESHOLD = 0.05    # Cambio relativo de P95/media/desvío que obliga a re-limpiar el SKU entero
+SKU_DELETE_CHUNK = 100    # SKUs por request DELETE (límite de longitud de URL)
+
+# Paralelismo: procesos del pool (1 = un solo proceso). Configurable con --workers o CLEANER_WORKERS.
+CLEANER_WORKERS = max(1, int(os.getenv('CLEANER_WORKERS', '1') or 1))
+RANGES_PER_WORKER = 4     # Rangos de filas por proceso (reparte mejor series de largo desigual)
+MIN_ROWS_FOR_POOL = 500   # Por debajo de esto el costo de lanzar procesos no compensa
+
+def fetch_all_paginated(table, params=None, select='*', strict=False):
+    return get_source().fetch(table, params, select, strict=strict)
+
+# =============================================================================
+# LIMPIEZA VECTORIZADA SOBRE MATRIZ SKU × DÍA
+# =============================================================================
+# Cada fila es la serie diaria continua de un SKU (desde su primera hasta su última fecha,
+# días sin registro en 0), alineada a la izquierda y con ceros de relleno después de su largo.
+
+def _row_nonzero_stats(orig, lengths):
+    """
+    P95, media y desviación de los valores positivos de cada fila, con las mismas
+    operaciones que np.percentile / np.mean / np.std sobre cada serie (resultados idénticos).
+    Filas con menos de 3 positivos quedan en NaN (no se evalúan outliers).
+    """
+    n_rows = orig.shape[0]
+    p95 = np.full(n_rows, np.nan)
+    mean = np.full(n_rows, np.nan)
+    std = np.full(n_rows, np.nan)
+
+    positive = orig > 0
+    counts = positive.sum(axis=1)
+    valid = counts >= 3
+    if not valid.any():
+        return p95, mean, std
+
+    rows, cols = np.nonzero(positive & valid[:, np.newaxis])
+    flat = orig[rows, cols]  # orden por fila y luego por día, como la serie original
+    cnt = counts[valid]
+    starts = np.concatenate(([0], np.cumsum(cnt)[:-1]))
+
+    # np.mean / np.std: suma por segmento, división por n, desvío al cuadrado
+    seg_mean = np.add.reduceat(flat, starts) / cnt
+    dev = flat - np.repeat(seg_mean, cnt)
+    seg_std = np.sqrt(np.add.reduceat(dev * dev, starts) / cnt)
+
+    # np.percentile (método lineal): índice virtual (n-1)·q e interpolación entre vecinos
+    ordered = flat[np.lexsort((flat, rows))]
+    virtual = (cnt - 1) * (OUTLIER_PERCENTILE / 100)
+    prev = np.floor(virtual)
+    gamma = virtual - prev
+    prev = prev.astype(np.intp)
+    lower = ordered[starts + prev]
+    upper = ordered[starts + np.minimum(prev + 1, cnt - 1)]
+    diff = upper - lower
+    seg_p95 = np.where(gamma >= 0.5, upper - diff * (1 - gamma), lower + diff * gamma)
+
+    p95[valid] = seg_p95
+    mean[valid] = seg_mean
+    std[valid] = seg_std
+    return p95, mean, std
+
+
+def detect_outliers(orig, lengths, stats=None):
+    """
+    1er paso: valores sobre el P95 de los no-cero con z-score > 2 se winsorizan al P95.
+    stats: (p95, media, desvío) por fila si las estadísticas vienen de la serie completa
+    y `orig` es solo un tramo. Retorna (serie winsorizada, máscara de outliers).
+    """
+    p95, mean, std = stats if stats is not None else _row_nonzero_stats(orig, lengths)
+    p95_col, mean_col, std_col = p95[:, np.newaxis], mean[:, np.newaxis], std[:, np.newaxis]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        es_outlier = (orig > p95_col) & (std_col > 0) & ((orig - mean_col) / std_col > OUTLIER_Z)
+    limpia = np.where(es_outlier, p95_col, orig)
+    return limpia, es_outlier
+
+
+def _window_positive_mean(window, counts):
+    """
+    Media de los positivos de cada ventana (≤ 15 valores) sumando en el mismo orden que
+    np.add.reduce: secuencial con menos de 8 elementos, 8 acumuladores en árbol desde 8.
+    Así el valor imputado coincide bit a bit con np.mean(window_vals[window_vals > 0]).
+    """
+    # Compactar los positivos al inicio de la fila conservando su orden
+    order = np.argsort(~(window > 0), axis=1, kind='stable')
+    vals = np.take_along_axis(window, order, axis=1)
+    vals = np.where(np.arange(window.shape[1]) < counts[:, np.newaxis], vals, 0.0)
+    if vals.shape[1] < 8:
+        vals = np.pad(vals, ((0, 0), (0, 8 - vals.shape[1])))
+
+    sequential = np.zeros(len(vals))
+    for j in range(7):
+        sequential = sequential + vals[:, j]
+    tree = ((vals[:, 0] + vals[:, 1]) + (vals[:, 2] + vals[:, 3])) + \
+           ((vals[:, 4] + vals[:, 5]) + (vals[:, 6] + vals[:, 7]))
+    for j in range(8, vals.shape[1]):
+        tree = tree + vals[:, j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts < 8, sequential, tree) / counts
+
+
+def impute_stockouts(orig, limpia, lengths, start=0):
+    """
+    2do paso: un cero rodeado de actividad (≥ 70% de días con movimiento en ±7 días)
+    se imputa con la media de los positivos de la ventana. Es una recurrencia de izquierda
+    a derecha (un cero imputado cuenta como actividad para los siguientes), así que se
+    avanza día a día pero para todos los SKUs a la vez. Modifica `limpia` en el lugar.
+    Con start > 0 los días anteriores se toman como ya limpios (solo sirven de contexto).
+    Retorna la máscara de quiebres imputados.
+    """
+    n_rows, n_days = orig.shape
+    es_quiebre = np.zeros(orig.shape, dtype=bool)
+    for t in range(start, n_days):
+        rows = np.flatnonzero((orig[:, t] == 0) & (t < lengths))
+        if len(rows) == 0:
+            continue
+        lo = max(0, t - STOCKOUT_WINDOW)
+        hi = t + STOCKOUT_WINDOW + 1
+        window = limpia[rows, lo:hi]  # el relleno después del largo es 0 y no cuenta como actividad
+        window_len = np.minimum(lengths[rows], hi) - lo
+        active = np.count_nonzero(window, axis=1) >= window_len * STOCKOUT_MIN_ACTIVE
+        if not active.any():
+            continue
+        rows, window = rows[active], window[active]
+        limpia[rows, t] = _window_positive_mean(window, np.count_nonzero(window > 0, axis=1))
+        es_quiebre[rows, t] = True
+    return es_quiebre
+
+
+def clean_series_matrix(orig, lengths):
+    """
+    Limpia todas las series de la matriz SKU × día.
+    Retorna (cantidad_limpia, es_outlier, es_quiebre_stock) con la forma de `orig`.
+    """
+    lengths = np.asarray(lengths)
+    limpia, es_outlier = detect_outliers(orig, lengths)
+    es_quiebre = impute_stockouts(orig, limpia, lengths)
+    return limpia, es_outlier, es_quiebre
+
+
+def _clean_rows_shared(spec, start, stop):
+    """
+    Trabajo de un proceso del pool: limpia las filas [start, stop) de la matriz compartida
+    y escribe el resultado en los arreglos de salida compartidos (sin serializar datos).
+    """
+    handles, arrays = attach(spec)
+    try:
+        limpia, es_outlier, es_quiebre = clean_series_matrix(arrays['orig'][start:stop],
+                                                             arrays['lengths'][start:stop])
+        arrays['limpia'][start:stop] = limpia
+        arrays['es_outlier'][start:stop] = es_outlier
+        arrays['es_quiebre'][start:stop] = es_quiebre
+    finally:
+        detach(handles, arrays)
+    return stop - start
+
+
+def clean_series_matrix_parallel(orig, lengths, workers=None):
+    """
+    Igual que clean_series_matrix, repartiendo rangos disjuntos de filas entre un pool de
+    procesos. La matriz y las salidas viven en memoria compartida: cada proceso recibe
+    solo los nombres de los bloques y sus límites de filas. Como cada serie se limpia de
+    forma independiente, el resultado es idéntico al de un solo proceso.
+    """
+    if workers is None:
+        workers = CLEANER_WORKERS
+    lengths = np.asarray(lengths, dtype=np.intp)
+    n_rows = orig.shape[0]
+    if workers <= 1 or n_rows < MIN_ROWS_FOR_POOL:
+        return clean_series_matrix(orig, lengths)
+
+    bounds = np.linspace(0, n_rows, min(n_rows, workers * RANGES_PER_WORKER) + 1).astype(int)
+    ranges = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+    logging.info(f"  Modo paralelo: {workers} procesos, {len(ranges)} rangos de SKUs")
+
+    with SharedArrays() as shared:
+        shared.add('orig', np.asarray(orig, dtype=float))
+        shared.add('lengths', lengths)
+        limpia = shared.add('limpia', shape=orig.shape, dtype=float)
+        es_outlier = shared.add('es_outlier', shape=orig.shape, dtype=bool)
+        es_quiebre = shared.add('es_quiebre', shape=orig.shape, dtype=bool)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_clean_rows_shared, shared.spec, a, b) for a, b in ranges]
+            for future in futures:
+                future.result()
+        # Copiar fuera de la memoria compartida antes de liberarla
+        return limpia.copy(), es_outlier.copy(), es_quiebre.copy()
+
+
+def _metodos(es_outlier, es_quiebre):
+    return np.where(es_quiebre, METODO_QUIEBRE, np.where(es_outlier, METODO_OUTLIER, ''))
 
-def fetch_all_paginated(table, params=None, select='*'):
-    if params is None:
-        params = {}
-    params['select'] = select
-    all_data = []
-    start, batch_size = 0, 1000
-    while True:
-        headers = get_headers()
-        headers["Range"] = f"{start}-{start + batch_size - 1}"
-        url = f"{SUPABASE_URL}/rest/v1/{table}"
-        try:
-            resp = requests.get(url, headers=headers, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-            if not data:
-                break
-            all_data.extend(data)
-            if len(data) < batch_size:
-                break
-            start += batch_size
-        except Exception as e:
-            logging.error(f"Error descargando {table}: {e}")
-            break
-    return pd.DataFrame(all_data) if all_data else pd.DataFrame()
 
 def process_sku_timeseries(df_sku, sku_id):
     """
@@ -73,7 +257,7 @@ def process_sku_timeseries(df_sku, sku_id):
     df_sku = df_sku.sort_index()
 
     # Si no hay datos suficientes, devolvemos tal cual
-    if len(df_sku) < 5:
+    if len(df_sku) < MIN_POINTS:
         df_sku = df_sku.reset_index()
         df_sku['cantidad_limpia'] = df_sku['cantidad_total_tn']
         df_sku['es_outlier'] = False
@@ -87,132 +271,425 @@ def process_sku_timeseries(df_sku, sku_id):
     df_full.rename(columns={'index': 'fecha'}, inplace=True)
     df_full['cantidad_total_tn'] = df_full['cantidad_total_tn'].fillna(0.0)
     df_full['sku_id'] = sku_id
-    
-    # Trabajar con la serie original
-    orig = df_full['cantidad_total_tn'].values
-    limpia = np.copy(orig)
-    n = len(orig)
-
-    es_outlier = np.zeros(n, dtype=bool)
-    es_quiebre = np.zeros(n, dtype=bool)
-    metodos = [''] * n
-
-    # --- 1er PASO: DETECCIÓN DE OUTLIERS ---
-    # Consideramos solo valores no cero para calcular el percentil y mean/std
-    non_zeros = orig[orig > 0]
-    if len(non_zeros) >= 3:
-        p95 = np.percentile(non_zeros, 95)
-        mean_nz = np.mean(non_zeros)
-        std_nz = np.std(non_zeros)
-        
-        for i in range(n):
-            if orig[i] > p95 and std_nz > 0:
-                z_score = (orig[i] - mean_nz) / std_nz
-                if z_score > 2.0:  # Umbral Z-Score
-                    limpia[i] = p95 # Winsorization al P95
-                    es_outlier[i] = True
-                    metodos[i] = 'winsorized_p95'
-
-    # --- 2do PASO: DETECCIÓN DE SILENCIOS / QUIEBRES DE STOCK (Básico) ---
-    # Imputar ceros anómalos en productos de movimiento "denso"
-    # Usamos rolling mean, si hay un '0' rodeado de valores altos, lo imputamos por el avg reciente.
-    rolling_window = 7
-    for i in range(n):
-        if orig[i] == 0:
-            start_i = max(0, i - rolling_window)
-            end_i = min(n, i + rolling_window + 1)
-            window_vals = limpia[start_i:end_i]
-            # Si en la ventana hay más de 50% de ceros, es intermitente (no se imputa)
-            # Si la ventana tiene mucha actividad y de pronto hay un 0, podría ser quiebre.
-            non_zero_count = np.count_nonzero(window_vals)
-            if non_zero_count >= (len(window_vals) * 0.7):
-                imputed_val = np.mean(window_vals[window_vals > 0])
-                limpia[i] = imputed_val
-                es_quiebre[i] = True
-                metodos[i] = 'imputed_rolling_mean'
-
-    df_full['cantidad_limpia'] = limpia
-    df_full['es_outlier'] = es_outlier
-    df_full['es_quiebre_stock'] = es_quiebre
-    df_full['metodo_limpieza'] = metodos
-    
+
+    # Misma limpieza que para el catálogo completo, sobre una matriz de una fila
+    orig = df_full['cantidad_total_tn'].values.astype(float)[np.newaxis, :]
+    limpia, es_outlier, es_quiebre = clean_series_matrix(orig, [orig.shape[1]])
+
+    df_full['cantidad_limpia'] = limpia[0]
+    df_full['es_outlier'] = es_outlier[0]
+    df_full['es_quiebre_stock'] = es_quiebre[0]
+    df_full['metodo_limpieza'] = _metodos(es_outlier[0], es_quiebre[0])
     return df_full
 
-def clean_data():
-    logging.info("Iniciando AI Data Cleaner...")
-    start_time = datetime.now()
 
-    # 1. Obtener la data cruda (últimos 365 días como máximo para reducir carga, o 90 si se desea)
-    one_year_ago = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-    logging.info(f"Descargando sap_consumo_diario_resumen desde {one_year_ago}...")
+def _prepare_raw(df_raw):
+    """
+    Normaliza df_raw y lo ordena por SKU (orden de aparición) y fecha.
+    Retorna (df con columna _code, skus, máscara de series cortas, códigos con fechas duplicadas).
+    """
+    df = df_raw[['sku_id', 'fecha', 'cantidad_total_tn']].copy()
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    codes, skus = pd.factorize(df['sku_id'])
+    df['_code'] = codes
+    df = df[df['_code'] >= 0]
+    df = df.iloc[np.lexsort((df['fecha'].values, df['_code'].values))]
+
+    sizes = df.groupby('_code', sort=False).size()
+    is_short = df['_code'].map(sizes < MIN_POINTS).values.astype(bool)
+    long = df[~is_short]
+    dup_codes = long.loc[long.duplicated(['_code', 'fecha']), '_code'].unique()
+    return df, np.asarray(skus, dtype=object), is_short, dup_codes
+
+
+def _build_matrix(long, origin=None):
+    """
+    Arma la matriz SKU × día de las series de `long` (ordenado por _code y fecha).
+    origin: fecha de la columna 0 para todas las filas; por defecto la primera fecha de cada SKU.
+    Retorna (códigos por fila, fecha de la columna 0 por fila, largos, matriz).
+    """
+    row_codes, row_idx, row_counts = np.unique(long['_code'].values, return_inverse=True, return_counts=True)
+    fechas = long['fecha'].values
+    if origin is None:
+        starts = fechas[np.concatenate(([0], np.cumsum(row_counts)[:-1]))]
+    else:
+        starts = np.full(len(row_codes), np.datetime64(origin, 'ns'))
+    offsets = ((fechas - starts[row_idx]) // np.timedelta64(1, 'D')).astype(np.intp)
+    lengths = np.zeros(len(row_codes), dtype=np.intp)
+    np.maximum.at(lengths, row_idx, offsets + 1)
+    orig = np.zeros((len(row_codes), int(lengths.max()) if len(lengths) else 0))
+    orig[row_idx, offsets] = pd.to_numeric(long['cantidad_total_tn'], errors='coerce').fillna(0.0).values
+    return row_codes, starts, lengths, orig
+
+
+def _matrix_frame(row_codes, starts, lengths, orig, limpia, es_outlier, es_quiebre, first_day=0):
+    """Expande la matriz a formato largo (desde la columna first_day hasta el largo de cada fila)."""
+    cols = np.arange(orig.shape[1])
+    in_range = (cols < lengths[:, np.newaxis]) & (cols >= first_day)
+    out_rows, out_days = np.nonzero(in_range)
+    return pd.DataFrame({
+        '_code': row_codes[out_rows],
+        'fecha': starts[out_rows] + out_days.astype('timedelta64[D]'),
+        'cantidad_total_tn': orig[in_range],
+        'cantidad_limpia': limpia[in_range],
+        'es_outlier': es_outlier[in_range],
+        'es_quiebre_stock': es_quiebre[in_range],
+        'metodo_limpieza': _metodos(es_outlier[in_range], es_quiebre[in_range]),
+    })
+
+
+def _finish_frame(frames, skus):
+    out = pd.concat([f for f in frames if not f.empty] or frames[:1], ignore_index=True)
+    out = out.iloc[np.lexsort((out['fecha'].values, out['_code'].values))]
+    out.insert(0, 'sku_id', skus[out['_code'].values])
+    return out.drop(columns='_code').reset_index(drop=True)
+
+
+def clean_raw_series(df_raw, workers=None):
+    """
+    Limpia todos los SKUs de df_raw (sku_id, fecha, cantidad_total_tn) de una vez.
+    Retorna un DataFrame largo (sku_id, fecha, cantidad_total_tn, cantidad_limpia,
+    es_outlier, es_quiebre_stock, metodo_limpieza) ordenado por SKU (orden de aparición)
+    y fecha, con el mismo contenido que process_sku_timeseries aplicado SKU por SKU.
+    workers: procesos para limpiar la matriz (por defecto CLEANER_WORKERS).
+    """
+    df, skus, is_short, dup_codes = _prepare_raw(df_raw)
+
+    # Series cortas: se guardan tal cual
+    short = df[is_short]
+    frames = [pd.DataFrame({
+        '_code': short['_code'].values,
+        'fecha': short['fecha'].values,
+        'cantidad_total_tn': short['cantidad_total_tn'].values,
+        'cantidad_limpia': short['cantidad_total_tn'].values,
+        'es_outlier': False,
+        'es_quiebre_stock': False,
+        'metodo_limpieza': 'none',
+    })]
+
+    # Series con fechas repetidas no se pueden expandir a diario: se omiten como antes
+    for code in dup_codes:
+        logging.error(f"Error procesando SKU {skus[code]}: fechas duplicadas en la serie")
+    long = df[~is_short]
+    long = long[~long['_code'].isin(dup_codes)]
+
+    if not long.empty:
+        row_codes, starts, lengths, orig = _build_matrix(long)
+        limpia, es_outlier, es_quiebre = clean_series_matrix_parallel(orig, lengths, workers)
+        frames.append(_matrix_frame(row_codes, starts, lengths, orig, limpia, es_outlier, es_quiebre))
+
+    return _finish_frame(frames, skus)
+
+
+def series_stats(df_raw):
+    """
+    Estadísticas de referencia por SKU: P95/media/desvío de los no-cero (NaN si hay
+    menos de 3), primera y última fecha y si la serie se limpia (larga y sin duplicados).
+    """
+    df, skus, is_short, dup_codes = _prepare_raw(df_raw)
+    bounds = df.groupby('_code', sort=True)['fecha'].agg(['min', 'max'])
+    stats = pd.DataFrame({
+        'inicio': bounds['min'].values,
+        'fin': bounds['max'].values,
+        'limpiable': True,
+        'p95': np.nan, 'media': np.nan, 'desvio': np.nan,
+    }, index=pd.Index(skus[bounds.index.values], name='sku_id'))
+
+    not_cleanable = set(df.loc[is_short, '_code']) | set(dup_codes)
+    stats.loc[skus[sorted(not_cleanable)], 'limpiable'] = False
+
+    long = df[~is_short]
+    long = long[~long['_code'].isin(dup_codes)]
+    if not long.empty:
+        row_codes, _, lengths, orig = _build_matrix(long)
+        p95, mean, std = _row_nonzero_stats(orig, lengths)
+        stats.loc[skus[row_codes], ['p95', 'media', 'desvio']] = np.column_stack((p95, mean, std))
+    return stats
+
+
+def stats_moved(current, reference):
+    """SKUs cuyo P95, media o desvío cambió más de STATS_THRESHOLD respecto de la referencia."""
+    cols = ['p95', 'media', 'desvio']
+    ref = reference.reindex(current.index)[cols].to_numpy(dtype=float)
+    cur = current[cols].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel = np.abs(cur - ref) / np.where(np.abs(ref) > 0, np.abs(ref), 1.0)
+    moved = (rel > STATS_THRESHOLD).any(axis=1) | (np.isnan(cur) != np.isnan(ref)).any(axis=1)
+    return set(current.index[moved])
+
+
+def changed_skus(cached_raw, fresh_raw, since):
+    """SKUs con filas nuevas, modificadas o eliminadas desde `since` respecto del caché."""
+    key = ['sku_id', 'fecha']
+    old = cached_raw[cached_raw['fecha'] >= since]
+    merged = old.merge(fresh_raw, on=key, how='outer', suffixes=('_old', '_new'), indicator=True)
+    a, b = merged['cantidad_total_tn_old'], merged['cantidad_total_tn_new']
+    same = (merged['_merge'] == 'both') & ((a == b) | (a.isna() & b.isna()))
+    return set(merged.loc[~same, 'sku_id'])
+
+
+def clean_trailing_window(df_raw, skus_trailing, stats, context, recompute_start):
+    """
+    Re-limpia solo los días >= recompute_start de los SKUs indicados.
+    Los STOCKOUT_WINDOW días previos se toman de `context` (cantidad_limpia ya calculada)
+    para que la recurrencia de imputación continúe exactamente donde quedó; los outliers
+    del tramo usan las estadísticas de referencia de la serie completa.
+    """
+    ctx_start = recompute_start - pd.Timedelta(days=STOCKOUT_WINDOW)
+    part = df_raw[df_raw['sku_id'].isin(skus_trailing) & (df_raw['fecha'] >= ctx_start)]
+    if part.empty:
+        return clean_raw_series(part)
+    df, skus, _, _ = _prepare_raw(part)
+    row_codes, starts, lengths, orig = _build_matrix(df, origin=ctx_start)
+
+    row_stats = stats.loc[skus[row_codes], ['p95', 'media', 'desvio']].to_numpy(dtype=float)
+    limpia, es_outlier = detect_outliers(orig, lengths, (row_stats[:, 0], row_stats[:, 1], row_stats[:, 2]))
+
+    # Contexto: los días previos al tramo conservan el valor limpio guardado
+    ctx = context[context['sku_id'].isin(skus_trailing) & (context['fecha'] >= ctx_start)
+                  & (context['fecha'] < recompute_start)]
+    if not ctx.empty:
+        row_of = pd.Series(np.arange(len(row_codes)), index=skus[row_codes])
+        rows = row_of.reindex(ctx['sku_id'].values).values
+        days = ((ctx['fecha'].values - np.datetime64(ctx_start, 'ns')) // np.timedelta64(1, 'D')).astype(np.intp)
+        ok = ~np.isnan(rows)
+        limpia[rows[ok].astype(np.intp), days[ok]] = ctx['cantidad_limpia'].values[ok]
+
+    es_quiebre = impute_stockouts(orig, limpia, lengths, start=STOCKOUT_WINDOW)
+    frame = _matrix_frame(row_codes, starts, lengths, orig, limpia, es_outlier, es_quiebre,
+                          first_day=STOCKOUT_WINDOW)
+    return _finish_frame([frame], skus)
+
+
+def build_clean_records(df_cleaned):
+    """
+    Convierte las series limpias en registros para inserción, construyendo las
+    columnas de forma vectorizada. Solo se guardan los días con cantidad original
+    o limpia mayor a cero.
+    """
+    df = df_cleaned[(df_cleaned['cantidad_limpia'] > 0) | (df_cleaned['cantidad_total_tn'] > 0)]
+    out = pd.DataFrame({
+        'sku_id': df['sku_id'],
+        'fecha': np.datetime_as_string(pd.to_datetime(df['fecha']).values.astype('datetime64[D]')),
+        'cantidad_original': df['cantidad_total_tn'].astype(float),
+        'cantidad_limpia': df['cantidad_limpia'].astype(float),
+        'es_outlier': df['es_outlier'].astype(bool),
+        'es_quiebre_stock': df['es_quiebre_stock'].astype(bool),
+        'metodo_limpieza': df['metodo_limpieza'].astype(str),
+        'updated_at': datetime.now().isoformat(),
+    })
+    return out.to_dict(orient='records')
+
+def _quoted(skus):
+    return ','.join('"' + str(s).replace('"', '') + '"' for s in skus)
+
+
+def _delete_clean_rows(params, label):
+    try:
+        if not get_source().delete('sap_consumo_diario_clean', params):
+            logging.warning(f"{label} no se completó.")
+            return False
+        return True
+    except Exception as e:
+        logging.error(f"Error en {label}: {e}")
+        return False
+
+
+def _insert_clean_records(records):
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert('sap_consumo_diario_clean', batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch clean: {e}")
+    return total_inserted
+
+
+def _raw_frame(df_raw):
+    """Crudo normalizado para el caché: fecha como datetime y cantidad numérica."""
+    df = df_raw[['sku_id', 'fecha', 'cantidad_total_tn']].copy()
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    df['cantidad_total_tn'] = pd.to_numeric(df['cantidad_total_tn'], errors='coerce')
+    return df.reset_index(drop=True)
+
+
+def _context_rows(df_cleaned, run_date):
+    """Últimos días limpios que la próxima corrida necesita como contexto."""
+    keep_from = pd.Timestamp(run_date) - pd.Timedelta(days=RAW_REFRESH_DAYS + 2 * STOCKOUT_WINDOW)
+    recent = df_cleaned.loc[pd.to_datetime(df_cleaned['fecha']) >= keep_from, ['sku_id', 'fecha', 'cantidad_limpia']]
+    return recent.assign(fecha=pd.to_datetime(recent['fecha'])).reset_index(drop=True)
+
+
+def _save_state(run_date, raw, ref_stats, context):
+    state_store.save_object(CLEAN_STATE, {
+        'run_date': run_date,
+        'raw': raw.astype({'sku_id': 'category'}),
+        'ref_stats': ref_stats,
+        'context': context.astype({'sku_id': 'category'}),
+    })
+
+
+def _usable_state(state, today):
+    if not state or 'run_date' not in state:
+        return False
+    gap = (today - state['run_date']).days
+    return 0 <= gap <= MAX_GAP_DAYS
+
+
+def _clean_full(today, since, workers=None):
+    """Corrida completa: re-limpia los 365 días y reescribe la tabla."""
+    logging.info(f"Descargando sap_consumo_diario_resumen desde {since}...")
     df_raw = fetch_all_paginated(
         'sap_consumo_diario_resumen',
-        {'fecha': f'gte.{one_year_ago}'},
-        'sku_id,fecha,cantidad_total_tn'
+        {'fecha': f'gte.{since}'},
+        'sku_id,fecha,cantidad_total_tn',
+        strict=True
     )
-    
+
     if df_raw.empty:
         logging.warning("No hay datos crudos para limpiar.")
-        return 0
+        return 0, False
 
     logging.info(f"Total registros crudos: {len(df_raw)}")
-    
-    # Limpieza por SKU
-    all_clean_records = []
-    skus = df_raw['sku_id'].unique()
-    logging.info(f"Procesando {len(skus)} SKUs...")
-
-    for count, sku in enumerate(skus):
-        df_sku = df_raw[df_raw['sku_id'] == sku].copy()
-        
-        # Procesar serie temporal entera de ese SKU
-        try:
-            df_cleaned = process_sku_timeseries(df_sku, sku)
-            
-            # Convertir a records
-            for _, row in df_cleaned.iterrows():
-                # No guardar ceros que quedaron como ceros puros para optimizar base de datos
-                # a menos que sean importantes? Mejor seguir la lógica: guardamos todo porque
-                # puede que se consulte la data limpia de forma continua.
-                # Pero en la BD actual solo bajamos lo que hay.
-                # Si cantidad_limpia > 0 o la original era > 0:
-                if row['cantidad_limpia'] > 0 or row['cantidad_total_tn'] > 0:
-                    rec = {
-                        'sku_id': sku,
-                        'fecha': row['fecha'].strftime('%Y-%m-%d'),
-                        'cantidad_original': float(row['cantidad_total_tn']),
-                        'cantidad_limpia': float(row['cantidad_limpia']),
-                        'es_outlier': bool(row['es_outlier']),
-                        'es_quiebre_stock': bool(row['es_quiebre_stock']),
-                        'metodo_limpieza': str(row['metodo_limpieza']),
-                        'updated_at': datetime.now().isoformat()
-                    }
-                    all_clean_records.append(rec)
-        except Exception as e:
-            logging.error(f"Error procesando SKU {sku}: {e}")
 
-        if (count + 1) % 500 == 0:
-            logging.info(f"  Procesados {count + 1} SKUs...")
+    # Limpieza de todos los SKUs a la vez sobre la matriz SKU × día
+    logging.info(f"Procesando {df_raw['sku_id'].nunique()} SKUs...")
+    df_cleaned = clean_raw_series(df_raw, workers)
+    all_clean_records = build_clean_records(df_cleaned)
 
     logging.info(f"Total registros limpios generados: {len(all_clean_records)}")
 
     # Truncar tabla antigua y guardar
-    logging.info("Truncando tabla sap_consumo_diario_clean en Supabase...")
-    try:
-        del_url = f"{SUPABASE_URL}/rest/v1/sap_consumo_diario_clean"
-        requests.delete(del_url, headers=get_headers(), params={"id": "gt.0"})
-    except Exception as e:
-        logging.error(f"Error truncando tabla clean: {e}")
+    logging.info("Truncando tabla sap_consumo_diario_clean...")
+    ok = _delete_clean_rows({"id": "gt.0"}, "Truncate")
 
     logging.info("Insertando registros limpios...")
-    total_inserted = 0
-    for i in range(0, len(all_clean_records), BATCH_SIZE):
-        batch = all_clean_records[i:i + BATCH_SIZE]
-        try:
-            post_to_supabase('sap_consumo_diario_clean', batch)
-            total_inserted += len(batch)
-        except Exception as e:
-            logging.error(f"Error insertando batch clean: {e}")
+    total_inserted = _insert_clean_records(all_clean_records)
+    ok = ok and total_inserted == len(all_clean_records)
+
+    if ok:
+        raw = _raw_frame(df_raw)
+        _save_state(today, raw, series_stats(raw), _context_rows(df_cleaned, today))
+    return total_inserted, ok
+
+
+def _clean_incremental(state, today, since, workers=None):
+    """
+    Corrida incremental: descarga solo los días desde (última corrida - RAW_REFRESH_DAYS),
+    re-limpia el tramo final de los SKUs con cambios y reemplaza solo ese rango.
+    SKUs nuevos, que dejaron de ser limpiables o cuyas estadísticas se movieron más de
+    STATS_THRESHOLD se re-limpian completos.
+    Si la descarga falla, o no trae nada cuando el caché sí tiene días del tramo, se detiene sin
+    escribir (RuntimeError): el tramo faltante se leería como filas borradas.
+    """
+    refresh_start = pd.Timestamp(state['run_date'] - timedelta(days=RAW_REFRESH_DAYS))
+    recompute_start = refresh_start - pd.Timedelta(days=STOCKOUT_WINDOW)
+    ctx_start = recompute_start - pd.Timedelta(days=STOCKOUT_WINDOW)
+    since_ts = pd.Timestamp(since)
+
+    logging.info(f"Descargando sap_consumo_diario_resumen desde {refresh_start.date()} (incremental)...")
+    fresh = fetch_all_paginated(
+        'sap_consumo_diario_resumen',
+        {'fecha': f'gte.{refresh_start.strftime("%Y-%m-%d")}'},
+        'sku_id,fecha,cantidad_total_tn',
+        strict=True
+    )
+    cached = state['raw'].astype({'sku_id': 'object'})
+    if fresh.empty and (cached['fecha'] >= refresh_start).any():
+        raise RuntimeError(f"sap_consumo_diario_resumen no trajo datos desde {refresh_start.date()} "
+                           f"pero el caché sí tiene: se detiene la limpieza incremental sin escribir")
+    fresh = _raw_frame(fresh) if not fresh.empty else _raw_frame(
+        pd.DataFrame(columns=['sku_id', 'fecha', 'cantidad_total_tn']))
+
+    changed = changed_skus(cached, fresh, refresh_start)
+    raw = pd.concat([cached[(cached['fecha'] < refresh_start) & (cached['fecha'] >= since_ts)], fresh],
+                    ignore_index=True)
+    if raw.empty:
+        logging.warning("No hay datos crudos para limpiar.")
+        return 0, False
+
+    stats = series_stats(raw)
+    ref_stats = state['ref_stats']
+    moved = stats_moved(stats, ref_stats)
+
+    # Re-limpieza completa: SKUs nuevos, no limpiables (antes o ahora), con estadísticas movidas,
+    # o cuya serie no cubre el contexto del tramo final
+    previous_ok = ref_stats['limpiable'].reindex(stats.index).fillna(False).astype(bool)
+    full_skus = moved | set(stats.index[~stats['limpiable'] | ~previous_ok])
+    full_skus |= set(stats.index[~stats.index.isin(ref_stats.index)])
+    full_skus |= set(stats.index[(stats['inicio'] > ctx_start) | (stats['fin'] < recompute_start)]) & changed
+    context = state['context'].astype({'sku_id': 'object'})
+    ctx_days = context[(context['fecha'] >= ctx_start) & (context['fecha'] < recompute_start)]
+    ctx_counts = ctx_days.groupby('sku_id').size()
+    full_skus |= {s for s in changed if ctx_counts.get(s, 0) < STOCKOUT_WINDOW}
+    full_skus &= set(stats.index)
+    trailing = (changed & set(stats.index)) - full_skus
+    gone = changed - set(stats.index)
+
+    logging.info(f"  SKUs: {len(stats)} — {len(full_skus)} a re-limpiar completos "
+                 f"({len(moved)} por estadísticas), {len(trailing)} solo desde {recompute_start.date()}, "
+                 f"{len(gone)} sin datos")
+
+    df_full = clean_raw_series(raw[raw['sku_id'].isin(full_skus)], workers)
+    df_trailing = clean_trailing_window(raw, trailing, stats, context, recompute_start)
+    df_cleaned = pd.concat([df_full, df_trailing], ignore_index=True)
+    records = build_clean_records(df_cleaned)
+
+    # Reemplazar solo los rangos afectados
+    ok = _delete_clean_rows({"fecha": f"lt.{since}"}, "Borrado de días fuera de la ventana")
+    full_delete = sorted(full_skus | gone)
+    for i in range(0, len(full_delete), SKU_DELETE_CHUNK):
+        chunk = full_delete[i:i + SKU_DELETE_CHUNK]
+        ok = _delete_clean_rows({"sku_id": f"in.({_quoted(chunk)})"}, "Borrado de SKUs re-limpiados") and ok
+    trailing_delete = sorted(trailing)
+    for i in range(0, len(trailing_delete), SKU_DELETE_CHUNK):
+        chunk = trailing_delete[i:i + SKU_DELETE_CHUNK]
+        ok = _delete_clean_rows({
+            "sku_id": f"in.({_quoted(chunk)})",
+            "fecha": f"gte.{recompute_start.strftime('%Y-%m-%d')}",
+        }, "Borrado del tramo final") and ok
+
+    total_inserted = _insert_clean_records(records)
+    ok = ok and total_inserted == len(records)
+
+    if ok:
+        # Referencia: se renueva solo para los SKUs re-limpiados completos
+        new_ref = pd.concat([ref_stats[~ref_stats.index.isin(full_skus)], stats.loc[sorted(full_skus)]])
+        new_ref = new_ref[new_ref.index.isin(stats.index)]
+        context = context[~context['sku_id'].isin(full_skus)
+                          & ~(context['sku_id'].isin(trailing) & (context['fecha'] >= recompute_start))]
+        context = pd.concat([context, _context_rows(df_cleaned, today)], ignore_index=True)
+        keep_from = pd.Timestamp(today) - pd.Timedelta(days=RAW_REFRESH_DAYS + 2 * STOCKOUT_WINDOW)
+        _save_state(today, raw, new_ref, context[context['fecha'] >= keep_from])
+    return total_inserted, ok
+
+
+def clean_data(full=False, workers=None):
+    """
+    Limpia sap_consumo_diario_resumen hacia sap_consumo_diario_clean.
+    Incremental por defecto (si hay estado de una corrida reciente); full=True reescribe todo.
+    workers: procesos para la limpieza de la matriz (por defecto CLEANER_WORKERS).
+    """
+    logging.info("Iniciando AI Data Cleaner...")
+    start_time = datetime.now()
+    today = datetime.now().date()
+
+    # 1. Ventana de datos crudos: últimos 365 días
+    one_year_ago = (datetime.now() - timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d')
+
+    state = None if full else state_store.load_object(CLEAN_STATE)
+    if _usable_state(state, today):
+        logging.info("  Modo: incremental")
+        total_inserted, ok = _clean_incremental(state, today, one_year_ago, workers)
+    else:
+        logging.info("  Modo: completo")
+        total_inserted, ok = _clean_full(today, one_year_ago, workers)
+
+    if not ok:
+        # La tabla pudo quedar a medias: la próxima corrida será completa
+        state_store.clear(CLEAN_STATE)
 
     elapsed = (datetime.now() - start_time).total_seconds()
     log_sync_result(
@@ -225,4 +702,12 @@ def clean_data():
     return total_inserted
 
 if __name__ == "__main__":
-    clean_data()
+    parser = argparse.ArgumentParser(description="AI Data Cleaner")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-limpiar los 365 días y reescribir la tabla completa")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Procesos para la limpieza de la matriz (por defecto CLEANER_WORKERS o 1)")
+    add_cli_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    clean_data(full=args.full, workers=args.workers)
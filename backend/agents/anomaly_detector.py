@@ -1,130 +1,788 @@
+"""
+anomaly_detector.py
+Auditoría de anomalías con Isolation Forest sobre varios flujos en una sola pasada:
+producción (sap_produccion), consumos (sap_consumo_movimientos) y saltos de stock MB52
+(sap_stock_mb52). Cada flujo etiqueta sus alertas con su movement_type.
+
+Los registros nuevos de todos los flujos se normalizan a un único frame (SKU, tipo,
+cantidad, fecha, referencia de origen) y se puntúan juntos, cada tipo con su modelo.
+El modelo de cada flujo se entrena sobre toda la historia (o los últimos
+ANOMALY_TRAIN_DAYS días), leída por tramos de fechas paginados, y se guarda junto con las
+estadísticas por SKU en backend/state/anomaly_model.pkl. Cada corrida diaria puntúa solo
+los registros posteriores a la marca de agua de su flujo; los modelos se re-entrenan cada
+RETRAIN_DAYS días o con --retrain. MB52 es una foto (truncate + replace): el estado guarda
+el stock total por SKU de cada día y se auditan las variaciones contra la foto anterior.
+
+La auditoría completa respeta un presupuesto diario (ANOMALY_TIME_BUDGET_S): la historia se
+lee de lo más reciente a lo más antiguo y se corta al agotar la parte de entrenamiento, y un
+flujo que ya no entra en el presupuesto se posterga (su marca de agua no avanza).
+
+Prefiltro robusto: antes del bosque, cada registro se compara con la mediana/MAD de su SKU;
+los claramente normales (|z robusto| < ANOMALY_PREFILTER_Z y cantidad bajo el cuantil global)
+no se puntúan. El umbral del 2% del bosque se calibra con los candidatos más una muestra
+de los descartados. --benchmark compara alertas y tiempos contra el bosque completo.
+
+Las alertas tienen clave natural (SKU, tipo de movimiento, fecha y referencia del registro de
+origen): una anomalía ya registrada no se duplica, solo incrementa occurrence_count y
+actualiza last_seen_at (ver backend/sql/003_ai_anomaly_alerts_dedup.sql).
+
+Ejecución: py -3 backend/agents/anomaly_detector.py [--retrain] [--train-days N]
+           [--streams produccion,consumo,stock_mb52] [--time-budget S]
+           [--prefilter-z Z] [--benchmark [--stream NOMBRE]] [--fixtures DIR]
+"""
 import os
-import requests
+import sys
+import time
+import argparse
 import logging
-import json
+from datetime import datetime, timedelta
+
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
 
+# --- Path setup ---
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from modules import state_store
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import canonical_sku, stored_sku
+from modules.validators import generate_signature, generate_production_signature
+
 logger = logging.getLogger(__name__)
 
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+MODEL_STATE = 'anomaly_model.pkl'
+TRAIN_HISTORY_DAYS = int(os.getenv('ANOMALY_TRAIN_DAYS', '0') or 0)  # 0 = toda la historia
+TRAIN_CHUNK_DAYS = 90      # Tramo de fechas por lectura paginada durante el entrenamiento
+MIN_TRAIN_ROWS = 50        # Con menos registros de historia el flujo no se audita
+RETRAIN_DAYS = 7           # Antigüedad máxima del modelo guardado
+AUDIT_OVERLAP_DAYS = 3     # Días previos a la marca de agua que se releen (cargas tardías)
+BOOTSTRAP_AUDIT_DAYS = 30  # Sin marca de agua se audita el último mes
+MAX_ALERTS = 200           # Máximo de alertas por flujo y ejecución
+ALERT_TABLE = 'ai_anomaly_alerts'
+ALERT_KEY_CHUNK = 100      # Claves por consulta in.(...) (límite de longitud de URL)
+
+# Presupuesto diario de la auditoría completa (segundos). El entrenamiento deja libre
+# SCORING_RESERVE del total para la lectura y puntaje de los registros nuevos.
+TIME_BUDGET_S = float(os.getenv('ANOMALY_TIME_BUDGET_S', '600') or 600)
+SCORING_RESERVE = 0.3
 
-SUPABASE_URL = os.getenv("SUPABASE_URL", "")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
+# Prefiltro: más alto = más rápido y menos recall; 0 desactiva el prefiltro (bosque completo)
+PREFILTER_Z = float(os.getenv('ANOMALY_PREFILTER_Z', '2.5') or 0)
+PREFILTER_GLOBAL_QUANTILE = 0.99  # Cantidades sobre este cuantil global siempre van al bosque
+MAD_SCALE = 1.4826                # MAD → desvío equivalente de una normal
+CALIBRATION_FRACTION = 0.05       # Muestra de descartados que se puntúa para calibrar el umbral
+CALIBRATION_MIN = 2000
+
+# Flujos de movimientos con fecha: tabla, columnas y cómo se identifica el registro de origen
+STREAMS = {
+    'produccion': {
+        'table': 'sap_produccion',
+        'select': "orden,material,texto_material,cantidad_tn,fecha_contabilizacion,clase_orden",
+        'sku': 'material', 'name': 'texto_material', 'qty': 'cantidad_tn', 'date': 'fecha_contabilizacion',
+        'ref': ('orden',),
+        'signature': generate_production_signature,
+    },
+    'consumo': {
+        'table': 'sap_consumo_movimientos',
+        'select': "material_clave,material_texto,fecha,cl_movimiento,centro,almacen,cantidad_final_tn",
+        'sku': 'material_clave', 'name': 'material_texto', 'qty': 'cantidad_final_tn', 'date': 'fecha',
+        'ref': ('cl_movimiento', 'centro', 'almacen'),
+        'signature': generate_signature,
+    },
+}
+STOCK_STREAM = 'stock_mb52'
+STOCK_TABLE = 'sap_stock_mb52'
+STOCK_HISTORY_SNAPSHOTS = 120  # Fotos diarias de stock por SKU que se conservan en el estado
+STOCK_MIN_SNAPSHOTS = 8        # Fotos mínimas para auditar variaciones de stock
+ALL_STREAMS = tuple(STREAMS) + (STOCK_STREAM,)
 
 
 def _supabase_get(table: str, select: str = "*", limit: int = 15000, params: dict = None) -> list:
-    """Consulta una tabla de Supabase via API REST usando requests."""
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Prefer": "count=none",
-    }
-    query_params = {"select": select, "limit": limit, "order": "fecha_contabilizacion.desc"}
+    """Consulta una tabla (Supabase o fixtures locales) y retorna la lista de registros."""
+    query_params = {"limit": limit, "order": "fecha_contabilizacion.desc"}
     if params:
         query_params.update(params)
-    
-    response = requests.get(url, headers=headers, params=query_params, timeout=30)
-    response.raise_for_status()
-    return response.json()
+
+    df = get_source().fetch(table, query_params, select, paginate=False, timeout=30)
+    return df.to_dict(orient='records')
 
 
 def _supabase_insert(table: str, data: list) -> bool:
-    """Inserta registros en Supabase via API REST."""
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-    }
-    response = requests.post(url, headers=headers, json=data, timeout=30)
-    return response.status_code in (200, 201)
+    """Inserta registros en la tabla destino."""
+    try:
+        get_source().insert(table, data, timeout=30)
+        return True
+    except Exception as e:
+        logger.error(f"Error insertando en {table}: {e}")
+        return False
+
+
+def _supabase_update(table: str, params: dict, values: dict) -> bool:
+    """Actualiza solo las columnas dadas de las filas que cumplen el filtro (PATCH, nunca inserta)."""
+    try:
+        get_source().update(table, params, values, timeout=30)
+        return True
+    except Exception as e:
+        logger.error(f"Error actualizando {table}: {e}")
+        return False
+
+
+def alert_key(sku_id, movement_type, fecha, source_ref):
+    """Clave natural de una alerta: SKU, tipo de movimiento y registro de origen (fecha, orden)."""
+    return f"{sku_id}|{movement_type}|{fecha}|{source_ref}"
+
+
+def _quoted(values):
+    return ','.join('"' + str(v).replace('"', '') + '"' for v in values)
+
+
+def persist_alerts(alerts):
+    """
+    Guarda alertas de forma idempotente por alert_key. Las nuevas se insertan con
+    occurrence_count = 1; las ya existentes solo suman una ocurrencia y renuevan
+    last_seen_at y las métricas (el estado de revisión y detected_at se conservan).
+    Retorna (nuevas, repetidas) o None si falló la escritura.
+    """
+    # Una sola alerta por clave dentro de la corrida (la primera: la más reciente)
+    unique = list({a['alert_key']: a for a in reversed(alerts)}.values())[::-1]
+    keys = [a['alert_key'] for a in unique]
+
+    existing = {}
+    for i in range(0, len(keys), ALERT_KEY_CHUNK):
+        df = get_source().fetch(ALERT_TABLE, {"alert_key": f"in.({_quoted(keys[i:i + ALERT_KEY_CHUNK])})"},
+                                "alert_key,occurrence_count", timeout=30)
+        if not df.empty:
+            counts = pd.to_numeric(df['occurrence_count'], errors='coerce').fillna(1).astype(int)
+            existing.update(zip(df['alert_key'], counts))
+
+    now = datetime.now().isoformat()
+    new = [dict(a, occurrence_count=1, last_seen_at=now) for a in unique if a['alert_key'] not in existing]
+    seen = [(a['alert_key'], {
+        "anomaly_score": a['anomaly_score'],
+        "severity": a['severity'],
+        "expected_value": a['expected_value'],
+        "actual_value": a['actual_value'],
+        "deviation_pct": a['deviation_pct'],
+        "occurrence_count": existing[a['alert_key']] + 1,
+        "last_seen_at": now,
+    }) for a in unique if a['alert_key'] in existing]
+
+    if new and not _supabase_insert(ALERT_TABLE, new):
+        return None
+    # PATCH por alert_key: solo las columnas que cambian, sin pasar por un insert con columnas faltantes
+    for key, values in seen:
+        if not _supabase_update(ALERT_TABLE, {"alert_key": f"eq.{key}"}, values):
+            return None
+    return len(new), len(seen)
+
+
+class TimeBudget:
+    """Presupuesto de tiempo de una corrida."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def exhausted(self, reserve=0.0):
+        """True si quedan menos de `reserve` (fracción del total) segundos."""
+        return self.seconds - self.elapsed() <= self.seconds * reserve
+
+
+def _quantities(values):
+    return pd.to_numeric(values, errors='coerce').fillna(0).abs()
+
+
+def _fetch_stream(name, start=None, end=None):
+    """Registros del flujo con start <= fecha < end (paginado, orden estable por fecha)."""
+    cfg = STREAMS[name]
+    filters = []
+    if start is not None:
+        filters.append(f"gte.{start.strftime('%Y-%m-%d')}")
+    if end is not None:
+        filters.append(f"lt.{end.strftime('%Y-%m-%d')}")
+    params = {"order": f"{cfg['date']}.asc,{cfg['sku']}.asc"}
+    if filters:
+        params[cfg['date']] = filters
+    return get_source().fetch(cfg['table'], params, cfg['select'], timeout=60)
+
+
+def _oldest_date(name):
+    cfg = STREAMS[name]
+    records = _supabase_get(cfg['table'], select=cfg['date'], limit=1,
+                            params={"order": f"{cfg['date']}.asc"})
+    if not records or not records[0].get(cfg['date']):
+        return None
+    return pd.to_datetime(records[0][cfg['date']]).date()
+
+
+def normalize_stream(name, raw):
+    """
+    Lleva los registros de un flujo al frame común de auditoría: movement_type, sku_id (forma
+    guardada, la que se escribe en las alertas), _sku (canónico, para cruzar con el modelo),
+    sku_name, fecha, cantidad (absoluta), source_ref y _signature (firma del registro).
+    """
+    cfg = STREAMS[name]
+    fecha = pd.to_datetime(raw[cfg['date']], errors='coerce')
+    parts = [raw[c].fillna('').astype(str).str.strip() if c in raw else pd.Series('', index=raw.index)
+             for c in cfg['ref']]
+    source_ref = parts[0]
+    for part in parts[1:]:
+        source_ref = source_ref + '/' + part
+    frame = pd.DataFrame({
+        'movement_type': name,
+        'sku_id': stored_sku(raw[cfg['sku']]),
+        '_sku': canonical_sku(raw[cfg['sku']]),
+        'sku_name': raw[cfg['name']].fillna('').astype(str) if cfg['name'] in raw else '',
+        'fecha': fecha.dt.strftime('%Y-%m-%d'),
+        'cantidad': _quantities(raw[cfg['qty']]),
+        'source_ref': source_ref,
+        '_signature': raw.apply(cfg['signature'], axis=1) if len(raw) else pd.Series(dtype=str),
+    })
+    return frame[fecha.notna()].reset_index(drop=True)
+
+
+def empty_audit_frame():
+    return pd.DataFrame(columns=['movement_type', 'sku_id', '_sku', 'sku_name', 'fecha', 'cantidad',
+                                 'source_ref', '_signature'])
+
+
+def sku_stats(materials, quantities):
+    """Estadísticas por SKU mergeables: n, media y m2 (suma de desvíos al cuadrado)."""
+    g = pd.DataFrame({'material': materials, 'cantidad': quantities}).groupby('material')['cantidad']
+    stats = g.agg(n='count', media='mean')
+    stats['m2'] = g.var(ddof=0).fillna(0) * stats['n']
+    return stats
+
+
+def merge_sku_stats(a, b):
+    """Combina dos tablas de sku_stats (fórmula de Chan para media y varianza)."""
+    idx = a.index.union(b.index)
+    a = a.reindex(idx, fill_value=0)
+    b = b.reindex(idx, fill_value=0)
+    n = a['n'] + b['n']
+    delta = b['media'] - a['media']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = a['media'] + delta * (b['n'] / n)
+        m2 = a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n
+    return pd.DataFrame({'n': n, 'media': media.fillna(0), 'm2': m2.fillna(0)})
+
+
+def build_features(materials, quantities, stats):
+    """Features del modelo: cantidad y z-score contra la media/desvío (muestral) del SKU."""
+    s = stats.reindex(materials)
+    mean = s['media'].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(s['m2'].to_numpy(dtype=float) / (s['n'].to_numpy(dtype=float) - 1))
+    std = np.nan_to_num(std, nan=0.0, posinf=0.0)
+    # SKUs sin historia se comparan contra su propia cantidad (z = 0)
+    mean = np.where(np.isnan(mean), quantities, mean)
+    z_score = (quantities - mean) / (std + 1e-9)
+    features = pd.DataFrame({'cantidad': quantities, 'z_score': z_score}).fillna(0)
+    return features, mean
+
+
+def _segment_median(codes, values, n_groups):
+    """Mediana por grupo (igual a np.median de cada grupo) con un solo ordenamiento."""
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+
+
+def robust_stats(materials, quantities):
+    """Mediana y MAD de la cantidad por SKU, vectorizado sobre todos los SKUs a la vez."""
+    codes, uniques = pd.factorize(pd.Series(materials))
+    median = _segment_median(codes, quantities, len(uniques))
+    mad = _segment_median(codes, np.abs(quantities - median[codes]), len(uniques))
+    return pd.DataFrame({'mediana': median, 'mad': mad}, index=pd.Index(uniques, name='material'))
+
+
+def prefilter_candidates(materials, quantities, robust, global_cut, z=PREFILTER_Z):
+    """
+    Registros que deben pasar por el bosque: z robusto |x - mediana| / (1.4826·MAD) >= z,
+    cantidad >= cuantil global (el bosque también aísla cantidades absolutas altas) o SKU
+    sin estadísticas. El resto se considera normal sin puntuarlo.
+    """
+    if z <= 0:
+        return np.ones(len(quantities), dtype=bool)
+    r = robust.reindex(materials)
+    median = r['mediana'].to_numpy(dtype=float)
+    scale = MAD_SCALE * r['mad'].to_numpy(dtype=float) + 1e-9
+    with np.errstate(invalid='ignore'):
+        robust_z = np.abs(quantities - median) / scale
+    return np.isnan(median) | (robust_z >= z) | (quantities >= global_cut)
+
+
+def _weighted_quantile(values, weights, q):
+    order = np.argsort(values, kind='mergesort')
+    cum = np.cumsum(weights[order])
+    idx = np.searchsorted(cum, q * cum[-1])
+    return values[order][min(idx, len(values) - 1)]
+
+
+def _severity(score):
+    if score < -0.15: return 'critical'
+    if score < -0.05: return 'moderate'
+    return 'low'
+
+
+
+def load_history(name, today, train_days, budget=None):
+    """
+    Lee la historia de entrenamiento de un flujo por tramos de TRAIN_CHUNK_DAYS días,
+    de lo más reciente a lo más antiguo. De cada tramo solo se conservan SKU y cantidad;
+    las estadísticas por SKU se acumulan por tramo. Si se agota la parte de entrenamiento
+    del presupuesto se entrena con lo leído hasta ese momento.
+    Retorna (materiales, cantidades, sku_stats, fecha inicial leída) o None si no hay datos.
+    """
+    cfg = STREAMS[name]
+    end = today + timedelta(days=1)
+    if train_days:
+        start = today - timedelta(days=train_days)
+    else:
+        start = _oldest_date(name)
+        if start is None:
+            return None
+
+    materials, quantities = [], []
+    stats = sku_stats([], [])
+    chunk_end = end
+    while chunk_end > start:
+        if budget is not None and materials and budget.exhausted(SCORING_RESERVE):
+            logger.warning(f"  [{name}] Presupuesto de entrenamiento agotado: historia desde {chunk_end}")
+            break
+        chunk_start = max(chunk_end - timedelta(days=TRAIN_CHUNK_DAYS), start)
+        df = _fetch_stream(name, chunk_start, chunk_end)
+        if not df.empty:
+            mat = canonical_sku(df[cfg['sku']]).to_numpy()
+            qty = _quantities(df[cfg['qty']]).to_numpy()
+            materials.append(mat)
+            quantities.append(qty)
+            stats = merge_sku_stats(stats, sku_stats(mat, qty))
+        chunk_end = chunk_start
+
+    if not materials:
+        return None
+    return np.concatenate(materials), np.concatenate(quantities), stats, chunk_end
+
+
+def stock_snapshot():
+    """
+    Stock libre total por SKU de la foto MB52 vigente (suma de centros y almacenes). sku_id es el
+    código canónico (historia de fotos y modelo); codigo, la forma guardada en MB52 para las alertas.
+    """
+    df = get_source().fetch(STOCK_TABLE, {}, "material,texto_material,libre_utilizacion", timeout=60)
+    if df.empty:
+        return None
+    df = df.assign(sku_id=canonical_sku(df['material']), codigo=stored_sku(df['material']),
+                   stock=pd.to_numeric(df['libre_utilizacion'], errors='coerce').fillna(0.0))
+    snapshot = df.groupby('sku_id', sort=True).agg(stock=('stock', 'sum'), sku_name=('texto_material', 'first'),
+                                                   codigo=('codigo', 'first'))
+    return snapshot.reset_index()
+
+
+def stock_deltas(history):
+    """Variación diaria del stock por SKU entre fotos consecutivas (SKU ausente = stock 0)."""
+    if history.empty or history['fecha'].nunique() < 2:
+        return pd.DataFrame(columns=['sku_id', 'fecha', 'delta'])
+    wide = history.pivot_table(index='sku_id', columns='fecha', values='stock', aggfunc='sum',
+                               fill_value=0.0, observed=True)
+    wide = wide.reindex(sorted(wide.columns), axis=1)
+    deltas = wide.diff(axis=1).iloc[:, 1:].stack().rename('delta').reset_index()
+    deltas['sku_id'] = deltas['sku_id'].astype(str)
+    return deltas[deltas['delta'] != 0].reset_index(drop=True)
 
 
 class AnomalyDetector:
-    def __init__(self, contamination=0.02):
+    """Modelo de un flujo: Isolation Forest + estadísticas por SKU + prefiltro robusto."""
+
+    STATE_FIELDS = ('model', 'stats', 'robust', 'global_cut', 'prefilter_z')
+
+    def __init__(self, contamination=0.02, train_days=None, prefilter_z=None):
+        self.contamination = contamination
+        self.train_days = TRAIN_HISTORY_DAYS if train_days is None else train_days
+        self.prefilter_z = PREFILTER_Z if prefilter_z is None else prefilter_z
         self.model = IsolationForest(contamination=contamination, random_state=42)
+        self.stats = None
+        self.robust = None
+        self.global_cut = np.inf
 
-    def run_audit(self) -> int:
-        """Ejecuta el proceso completo de auditoría. Retorna el número de anomalías."""
-        try:
-            logger.info("Cargando datos de sap_produccion para auditoría...")
-            records = _supabase_get(
-                "sap_produccion",
-                select="material,texto_material,cantidad_tn,fecha_contabilizacion",
-                limit=20000
-            )
+    def fit(self, materials, quantities, stats):
+        """
+        Ajusta el bosque sobre todos los registros. Sin prefiltro el umbral (offset_) es el
+        percentil `contamination` de los scores de todos los registros, como IsolationForest.
+        Con prefiltro solo se puntúan los candidatos más una muestra de los descartados
+        (con peso 1/fracción) y el umbral es el cuantil ponderado de esos scores.
+        """
+        features, _ = build_features(materials, quantities, stats)
+        self.stats = stats
+        self.robust = robust_stats(materials, quantities)
+        self.global_cut = float(np.quantile(quantities, PREFILTER_GLOBAL_QUANTILE))
+
+        if self.prefilter_z <= 0:
+            self.model = IsolationForest(contamination=self.contamination, random_state=42)
+            self.model.fit(features)
+            return
+
+        # Los árboles no dependen de contamination: se construyen igual y solo cambia el umbral
+        self.model = IsolationForest(contamination='auto', random_state=42)
+        self.model.fit(features)
 
-            if not records:
-                logger.warning("No hay datos para analizar.")
-                return 0
+        candidates = prefilter_candidates(materials, quantities, self.robust, self.global_cut, self.prefilter_z)
+        cleared = np.flatnonzero(~candidates)
+        n_sample = min(len(cleared), max(CALIBRATION_MIN, int(len(cleared) * CALIBRATION_FRACTION)))
+        sample = np.random.default_rng(42).choice(cleared, n_sample, replace=False) if n_sample else cleared[:0]
+        rows = np.concatenate((np.flatnonzero(candidates), sample))
+        weights = np.concatenate((np.ones(candidates.sum()),
+                                  np.full(len(sample), len(cleared) / max(len(sample), 1))))
+        scores = self.model.score_samples(features.iloc[rows])
+        self.model.offset_ = _weighted_quantile(scores, weights, self.contamination)
 
-            df = pd.DataFrame(records)
-            df['cantidad'] = pd.to_numeric(df['cantidad_tn'], errors='coerce').fillna(0).abs()
+        # Descartados de la muestra que el bosque habría marcado: estimación de recall perdido
+        missed = (scores[candidates.sum():] < self.model.offset_).sum() * weights[-1] if len(sample) else 0.0
+        flagged = (scores[:candidates.sum()] < self.model.offset_).sum()
+        recall = flagged / (flagged + missed) if flagged + missed else 1.0
+        logger.info(f"  Prefiltro z={self.prefilter_z}: {candidates.sum()} candidatos + {len(sample)} de calibración "
+                    f"de {len(quantities)} registros; recall estimado {recall:.1%}")
 
-            # Feature Engineering
-            df['mean_sku'] = df.groupby('material')['cantidad'].transform('mean')
-            df['std_sku'] = df.groupby('material')['cantidad'].transform('std').fillna(0)
-            df['z_score'] = (df['cantidad'] - df['mean_sku']) / (df['std_sku'] + 1e-9)
+    def train(self, name, today, budget=None):
+        """Entrena con la historia del flujo (ver load_history). Retorna False sin datos suficientes."""
+        history = load_history(name, today, self.train_days, budget)
+        if history is None or len(history[1]) < MIN_TRAIN_ROWS:
+            return False
+        materials, quantities, stats, start = history
+        logger.info(f"  [{name}] Entrenando Isolation Forest sobre {len(quantities)} registros "
+                    f"({start} a {today}, {len(stats)} SKUs)...")
+        self.fit(materials, quantities, stats)
+        return True
 
-            features = df[['cantidad', 'z_score']].fillna(0)
+    def predict(self, materials, quantities):
+        """
+        Retorna (anomaly_score, is_anomaly, media esperada). Los registros que el prefiltro
+        descarta no se puntúan: quedan con score NaN y is_anomaly = 1 (normal).
+        """
+        features, expected = build_features(materials, quantities, self.stats)
+        candidates = prefilter_candidates(materials, quantities, self.robust, self.global_cut, self.prefilter_z)
+        scores = np.full(len(quantities), np.nan)
+        is_anomaly = np.ones(len(quantities), dtype=int)
+        if candidates.any():
+            scores[candidates] = self.model.decision_function(features[candidates])
+            is_anomaly[candidates] = np.where(scores[candidates] < 0, -1, 1)
+        return scores, is_anomaly, expected
 
-            logger.info(f"Entrenando Isolation Forest sobre {len(df)} registros...")
-            preds = self.model.fit_predict(features)
-            scores = self.model.decision_function(features)
+    def to_state(self):
+        return {field: getattr(self, field) for field in self.STATE_FIELDS}
 
-            df['anomaly_score'] = scores
-            df['is_anomaly'] = preds
+    def load_state(self, state):
+        for field in self.STATE_FIELDS:
+            setattr(self, field, state[field])
 
-            anomalies = df[df['is_anomaly'] == -1].copy()
 
-            if anomalies.empty:
-                logger.info("Sin anomalías detectadas.")
-                return 0
+def score_frame(frame, detectors):
+    """
+    Puntúa el frame común de todos los flujos: cada movement_type con su modelo.
+    Agrega mean_sku, anomaly_score e is_anomaly.
+    """
+    out = frame.reset_index(drop=True).copy()
+    out['mean_sku'] = np.nan
+    out['anomaly_score'] = np.nan
+    out['is_anomaly'] = 1
+    quantities = out['cantidad'].to_numpy(dtype=float)
+    materials = out['_sku'].to_numpy()
+    for name, rows in out.groupby('movement_type', sort=False).indices.items():
+        scores, is_anomaly, expected = detectors[name].predict(materials[rows], quantities[rows])
+        out.loc[rows, 'anomaly_score'] = scores
+        out.loc[rows, 'is_anomaly'] = is_anomaly
+        out.loc[rows, 'mean_sku'] = expected
+    return out
 
-            logger.info(f"Detectadas {len(anomalies)} anomalías. Guardando en Supabase...")
 
-            def get_severity(score):
-                if score < -0.15: return 'critical'
-                if score < -0.05: return 'moderate'
-                return 'low'
+def build_alerts(scored):
+    """Alertas de las anomalías del frame puntuado: las más recientes primero, MAX_ALERTS por flujo."""
+    anomalies = scored[scored['is_anomaly'] == -1]
+    # Estable dentro del flujo: los registros vienen en orden de fecha ascendente
+    anomalies = anomalies.iloc[::-1]
+    anomalies = anomalies.groupby('movement_type', sort=False).head(MAX_ALERTS)
+
+    alerts = []
+    for _, row in anomalies.iterrows():
+        alerts.append({
+            "alert_key": alert_key(row['sku_id'], row['movement_type'], row['fecha'], row['source_ref']),
+            "fecha": row['fecha'],
+            "source_ref": row['source_ref'],
+            "sku_id": row['sku_id'],
+            "sku_name": str(row['sku_name'])[:100],
+            "movement_type": row['movement_type'],
+            "anomaly_score": round(float(row['anomaly_score']), 4),
+            "severity": _severity(row['anomaly_score']),
+            "expected_value": round(float(row['mean_sku']), 2),
+            "actual_value": round(float(row['cantidad']), 2),
+            "deviation_pct": round(abs(float(row['cantidad']) - float(row['mean_sku'])) / (float(row['mean_sku']) + 1e-9) * 100, 2),
+            "status": "open"
+        })
+    return alerts
+
+
+class MultiStreamAuditor:
+    """Auditoría diaria de todos los flujos en una pasada, dentro de un presupuesto de tiempo."""
+
+    def __init__(self, contamination=0.02, train_days=None, prefilter_z=None,
+                 streams=ALL_STREAMS, time_budget=None):
+        self.contamination = contamination
+        self.train_days = TRAIN_HISTORY_DAYS if train_days is None else train_days
+        self.prefilter_z = PREFILTER_Z if prefilter_z is None else prefilter_z
+        self.streams = [s for s in ALL_STREAMS if s in streams]
+        self.time_budget = TIME_BUDGET_S if time_budget is None else time_budget
+
+    def _detector(self):
+        return AnomalyDetector(self.contamination, self.train_days, self.prefilter_z)
+
+    def _movement_stream(self, name, stream_state, today, budget, retrain):
+        """Prepara el modelo de un flujo con fecha y lee sus registros nuevos. Retorna (detector, frame, estado)."""
+        detector = self._detector()
+        trained_at = stream_state.get('trained_at')
+        stale = (trained_at is None or (today - trained_at).days >= RETRAIN_DAYS
+                 or stream_state.get('train_days') != self.train_days
+                 or stream_state.get('prefilter_z') != self.prefilter_z)
+
+        if retrain or stale or 'model' not in stream_state:
+            logger.info(f"  [{name}] Cargando historia para entrenamiento...")
+            if detector.train(name, today, budget):
+                trained_at = today
+            elif 'model' in stream_state:
+                logger.warning(f"  [{name}] Sin historia suficiente: se usa el modelo guardado.")
+                detector.load_state(stream_state)
+            else:
+                logger.warning(f"  [{name}] Sin datos para entrenar; el flujo no se audita.")
+                return None, None, stream_state
+        else:
+            detector.load_state(stream_state)
+
+        # Registros posteriores a la marca de agua (con solape para cargas tardías)
+        watermark = stream_state.get('watermark')
+        if watermark is None:
+            since = today - timedelta(days=BOOTSTRAP_AUDIT_DAYS)
+        else:
+            since = watermark - timedelta(days=AUDIT_OVERLAP_DAYS)
+        raw = _fetch_stream(name, since)
+        frame = normalize_stream(name, raw) if not raw.empty else empty_audit_frame()
+        audited = stream_state.get('audited', {})
+        frame = frame[~frame['_signature'].isin(list(audited))]
+        logger.info(f"  [{name}] {len(frame)} registros nuevos desde {since}")
+
+        new_state = dict(detector.to_state(), trained_at=trained_at, train_days=self.train_days,
+                         watermark=watermark, audited=audited)
+        if not frame.empty:
+            last = pd.to_datetime(frame['fecha']).max().date()
+            new_state['watermark'] = max(watermark or last, last)
+            audited = dict(audited)
+            audited.update(zip(frame['_signature'], frame['fecha']))
+        if new_state['watermark'] is not None:
+            keep_from = (new_state['watermark'] - timedelta(days=AUDIT_OVERLAP_DAYS)).strftime('%Y-%m-%d')
+            audited = {sig: fecha for sig, fecha in audited.items() if fecha >= keep_from}
+        new_state['audited'] = audited
+        return detector, frame, new_state
+
+    def _stock_stream(self, history, today):
+        """
+        Agrega la foto MB52 de hoy a la historia y prepara las variaciones del día.
+        El modelo se ajusta en cada corrida sobre las variaciones de días anteriores.
+        Retorna (detector, frame, historia actualizada).
+        """
+        snapshot = stock_snapshot()
+        if snapshot is None:
+            logger.warning(f"  [{STOCK_STREAM}] Sin foto de stock.")
+            return None, None, history
+
+        fecha = today.strftime('%Y-%m-%d')
+        if history is not None and (history['fecha'] == fecha).any():
+            # Re-ejecución del día: solo se vuelve a auditar si la foto cambió
+            audited = history[history['fecha'] == fecha]
+            previous = pd.Series(audited['stock'].values, index=audited['sku_id'].astype(str).values)
+            current = pd.Series(snapshot['stock'].values, index=snapshot['sku_id'].values)
+            if previous.sort_index().equals(current.sort_index()):
+                logger.info(f"  [{STOCK_STREAM}] La foto de hoy ya fue auditada.")
+                return None, None, history
+        history = pd.concat([history[history['fecha'] != fecha] if history is not None else None,
+                             snapshot[['sku_id', 'stock']].assign(fecha=fecha)], ignore_index=True)
+        dates = sorted(history['fecha'].unique())[-STOCK_HISTORY_SNAPSHOTS:]
+        history = history[history['fecha'].isin(dates)].reset_index(drop=True)
+
+        deltas = stock_deltas(history)
+        past = deltas[deltas['fecha'] < fecha]
+        current = deltas[deltas['fecha'] == fecha]
+        if len(dates) < STOCK_MIN_SNAPSHOTS or len(past) < MIN_TRAIN_ROWS:
+            logger.info(f"  [{STOCK_STREAM}] {len(dates)} fotos de stock: historia insuficiente para auditar.")
+            return None, None, history
+
+        detector = self._detector()
+        materials = past['sku_id'].to_numpy()
+        quantities = past['delta'].abs().to_numpy()
+        logger.info(f"  [{STOCK_STREAM}] Ajustando sobre {len(past)} variaciones de {len(dates) - 1} días...")
+        detector.fit(materials, quantities, sku_stats(materials, quantities))
+
+        by_sku = snapshot.set_index('sku_id')
+        frame = pd.DataFrame({
+            'movement_type': STOCK_STREAM,
+            'sku_id': by_sku['codigo'].reindex(current['sku_id']).fillna(current['sku_id']).astype(str).values,
+            '_sku': current['sku_id'].values,
+            'sku_name': by_sku['sku_name'].reindex(current['sku_id']).fillna('').astype(str).values,
+            'fecha': fecha,
+            'cantidad': current['delta'].abs().values,
+            'source_ref': 'mb52',
+            '_signature': None,
+        })
+        logger.info(f"  [{STOCK_STREAM}] {len(frame)} SKUs con variación de stock hoy")
+        return detector, frame, history
+
+    def run_audit(self, retrain=False) -> int:
+        """Ejecuta la auditoría de todos los flujos. Retorna el número de alertas registradas."""
+        try:
+            today = datetime.now().date()
+            budget = TimeBudget(self.time_budget)
+            state = state_store.load_object(MODEL_STATE) or {}
+            streams_state = dict(state.get('streams', {}))
+            stock_history = state.get('stock_history')
+
+            detectors, frames, pending = {}, [], {}
+            for name in self.streams:
+                if budget.exhausted():
+                    logger.warning(f"  [{name}] Presupuesto de {self.time_budget:.0f}s agotado: se posterga.")
+                    continue
+                if name == STOCK_STREAM:
+                    detector, frame, new_history = self._stock_stream(stock_history, today)
+                    pending[name] = new_history
+                else:
+                    detector, frame, pending[name] = self._movement_stream(
+                        name, streams_state.get(name, {}), today, budget, retrain)
+                if detector is not None and not frame.empty:
+                    detectors[name] = detector
+                    frames.append(frame)
 
             alerts = []
-            for _, row in anomalies.head(200).iterrows():  # Máximo 200 por ejecución
-                alerts.append({
-                    "sku_id": str(row.get('material', 'UNKNOWN')),
-                    "sku_name": str(row.get('texto_material', ''))[:100],
-                    "movement_type": "produccion",
-                    "anomaly_score": round(float(row['anomaly_score']), 4),
-                    "severity": get_severity(row['anomaly_score']),
-                    "expected_value": round(float(row['mean_sku']), 2),
-                    "actual_value": round(float(row['cantidad']), 2),
-                    "deviation_pct": round(abs(float(row['cantidad']) - float(row['mean_sku'])) / (float(row['mean_sku']) + 1e-9) * 100, 2),
-                    "status": "open"
-                })
+            if frames:
+                scored = score_frame(pd.concat(frames, ignore_index=True), detectors)
+                counts = scored.groupby('movement_type')['is_anomaly'].apply(lambda s: int((s == -1).sum()))
+                logger.info(f"{len(scored)} registros auditados en {budget.elapsed():.1f}s; anomalías por flujo: "
+                            f"{counts.to_dict()}")
+                alerts = build_alerts(scored)
+            else:
+                logger.info("Sin registros nuevos desde la última auditoría.")
 
             if alerts:
-                _supabase_insert("ai_anomaly_alerts", alerts)
+                logger.info(f"Guardando {len(alerts)} alertas en Supabase...")
+                persisted = persist_alerts(alerts)
+                if persisted is None:
+                    # Sin avanzar marcas de agua ni historia de stock: se reintenta en la próxima corrida
+                    return 0
+                logger.info(f"  {persisted[0]} alertas nuevas, {persisted[1]} ya registradas (ocurrencia sumada).")
 
+            for name, new_state in pending.items():
+                if name == STOCK_STREAM:
+                    stock_history = new_state
+                else:
+                    streams_state[name] = new_state
+            state_store.save_object(MODEL_STATE, {
+                'streams': streams_state,
+                'stock_history': (stock_history.astype({'sku_id': 'category'})
+                                  if stock_history is not None else None),
+            })
             return len(alerts)
 
         except Exception as e:
-            logger.error(f"Error en AnomalyDetector.run_audit: {e}")
+            logger.error(f"Error en la auditoría de anomalías: {e}")
             raise
 
 
-def run_anomaly_audit() -> int:
-    detector = AnomalyDetector()
-    return detector.run_audit()
+def run_anomaly_audit(retrain=False, train_days=None, prefilter_z=None, streams=ALL_STREAMS,
+                      time_budget=None) -> int:
+    auditor = MultiStreamAuditor(train_days=train_days, prefilter_z=prefilter_z,
+                                 streams=streams, time_budget=time_budget)
+    return auditor.run_audit(retrain=retrain)
+
+
+def benchmark_prefilter(train_days=None, prefilter_z=None, contamination=0.02, stream='produccion'):
+    """
+    Compara, sobre la historia de entrenamiento de un flujo, el bosque completo (ajuste +
+    puntaje de todos los registros) contra el camino con prefiltro: tiempos, registros
+    puntuados y coincidencia de los conjuntos de anomalías. No persiste nada.
+    """
+    today = datetime.now().date()
+    train_days = TRAIN_HISTORY_DAYS if train_days is None else train_days
+    history = load_history(stream, today, train_days)
+    if history is None:
+        logger.warning("No hay datos para el benchmark.")
+        return None
+    materials, quantities, stats, _ = history
+
+    results = {}
+    for label, z in (('completo', 0.0), ('prefiltro', PREFILTER_Z if prefilter_z is None else prefilter_z)):
+        detector = AnomalyDetector(contamination=contamination, train_days=train_days, prefilter_z=z)
+        t0 = time.perf_counter()
+        detector.fit(materials, quantities, stats)
+        t1 = time.perf_counter()
+        scores, is_anomaly, _ = detector.predict(materials, quantities)
+        t2 = time.perf_counter()
+        results[label] = {
+            'anomalies': set(np.flatnonzero(is_anomaly == -1)),
+            'scored': int((~np.isnan(scores)).sum()),
+            'fit_s': t1 - t0,
+            'score_s': t2 - t1,
+        }
+
+    full, fast = results['completo'], results['prefiltro']
+    common = len(full['anomalies'] & fast['anomalies'])
+    summary = {
+        'flujo': stream,
+        'registros': len(quantities),
+        'anomalias_completo': len(full['anomalies']),
+        'anomalias_prefiltro': len(fast['anomalies']),
+        'coinciden': common,
+        'recall': common / len(full['anomalies']) if full['anomalies'] else 1.0,
+        'precision': common / len(fast['anomalies']) if fast['anomalies'] else 1.0,
+        'puntuados_prefiltro': fast['scored'],
+        'tiempo_completo_s': round(full['fit_s'] + full['score_s'], 2),
+        'tiempo_prefiltro_s': round(fast['fit_s'] + fast['score_s'], 2),
+    }
+    for label, r in results.items():
+        logger.info(f"  {label:<10} ajuste {r['fit_s']:.2f}s, puntaje {r['score_s']:.2f}s, "
+                    f"{r['scored']} puntuados, {len(r['anomalies'])} anomalías")
+    logger.info(f"  Coinciden {common}: recall {summary['recall']:.1%}, precisión {summary['precision']:.1%}")
+    return summary
 
 
 if __name__ == "__main__":
-    count = run_anomaly_audit()
-    print(f"Auditoría completada. Anomalías registradas: {count}")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Auditoría de anomalías (Isolation Forest)")
+    parser.add_argument('--retrain', action='store_true',
+                        help="Re-entrenar los modelos aunque los guardados estén vigentes")
+    parser.add_argument('--train-days', type=int, default=None,
+                        help="Días de historia para entrenar (0 = toda; por defecto ANOMALY_TRAIN_DAYS)")
+    parser.add_argument('--streams', default=','.join(ALL_STREAMS),
+                        help=f"Flujos a auditar, separados por coma (por defecto {','.join(ALL_STREAMS)})")
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help="Presupuesto de la auditoría en segundos (por defecto ANOMALY_TIME_BUDGET_S o 600)")
+    parser.add_argument('--prefilter-z', type=float, default=None,
+                        help="Umbral del z robusto del prefiltro (0 = bosque completo; por defecto ANOMALY_PREFILTER_Z)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Comparar prefiltro contra bosque completo sobre la historia, sin persistir")
+    parser.add_argument('--stream', default='produccion', choices=sorted(STREAMS),
+                        help="Flujo a usar en --benchmark")
+    add_cli_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.benchmark:
+        print(benchmark_prefilter(train_days=args.train_days, prefilter_z=args.prefilter_z, stream=args.stream))
+    else:
+        streams = tuple(s.strip() for s in args.streams.split(',') if s.strip())
+        count = run_anomaly_audit(retrain=args.retrain, train_days=args.train_days,
+                                  prefilter_z=args.prefilter_z, streams=streams,
+                                  time_budget=args.time_budget)
+        print(f"Auditoría completada. Anomalías registradas: {count}")
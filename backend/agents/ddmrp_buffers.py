@@ -0,0 +1,231 @@
+"""
+ddmrp_buffers.py
+Buffers DDMRP de todo el catálogo en una sola pasada vectorizada.
+
+Arma arreglos alineados por SKU (ADU y desviación del plan híbrido, lead time del maestro,
+MOQ y ciclo de pedido, stock disponible, producción programada pendiente y demanda
+calificada del pronóstico), calcula zonas, flujo neto y orden recomendada con
+modules/ddmrp_engine.py y reemplaza el contenido de sap_ddmrp_buffers.
+
+Ejecución: py -3 backend/agents/ddmrp_buffers.py [--fixtures DIR] [--output-dir DIR] [--benchmark N]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# --- Path setup ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import canonical_sku
+from modules import state_store
+from modules.ddmrp_engine import (calculate_buffers_batch, calculate_ddmrp_buffers,
+                                  net_flow_plan, qualified_demand)
+from modules.scenario_engine import FORECAST_CACHE_STATE, DEMAND_TYPES
+from sync_logger import log_sync_result
+
+BUFFERS_TABLE = 'sap_ddmrp_buffers'
+BATCH_SIZE = 1000
+DEFAULT_LEAD_TIME = 25   # Días; mismo valor que usa el frontend cuando el maestro no trae lead time
+DEFAULT_ORDER_CYCLE = float(os.getenv('DDMRP_ORDER_CYCLE_DAYS', '7'))
+DEFAULT_MOQ = float(os.getenv('DDMRP_DEFAULT_MOQ', '0'))
+# Columnas opcionales del maestro; si no existen se usan los valores por defecto
+MOQ_COLUMN = 'moq'
+ORDER_CYCLE_COLUMN = 'ciclo_pedido_dias'
+ROUND_COLUMNS = ['adu', 'cov', 'red_base', 'red_alert', 'red_total', 'yellow', 'green',
+                 'top_of_red', 'top_of_yellow', 'top_of_green', 'on_hand', 'on_order',
+                 'qualified_demand', 'net_flow', 'order_qty']
+
+
+def _numeric(series, default=0.0):
+    return pd.to_numeric(series, errors='coerce').fillna(default).to_numpy(dtype=float)
+
+
+def _per_sku(df, sku_col, value_col, skus):
+    """Suma `value_col` por SKU canónico, alineada a `skus` (0 donde no hay registros)."""
+    if df.empty:
+        return np.zeros(len(skus))
+    summed = (pd.DataFrame({'sku_id': canonical_sku(df[sku_col]), 'v': _numeric(df[value_col])})
+              .groupby('sku_id')['v'].sum())
+    return summed.reindex(skus, fill_value=0.0).to_numpy(dtype=float)
+
+
+def load_catalog():
+    """Plan híbrido + parámetros del maestro, una fila por SKU con ADU > 0."""
+    hibrido = get_source().fetch('sap_plan_inventario_hibrido', select='*')
+    if hibrido.empty:
+        return pd.DataFrame()
+    catalog = pd.DataFrame({
+        'sku_id': canonical_sku(hibrido['sku_id']),
+        'adu': _numeric(hibrido['adu_hibrido_final']),
+        'desv': _numeric(hibrido['desv_std_diaria']) if 'desv_std_diaria' in hibrido else 0.0,
+        'on_hand': _numeric(hibrido['stock_actual']) if 'stock_actual' in hibrido else 0.0,
+    })
+    if 'desv_std_diaria' not in hibrido:
+        logging.warning("El plan híbrido no trae desv_std_diaria: se asume CoV 0.")
+    catalog = catalog[(catalog['sku_id'] != '') & (catalog['adu'] > 0)].drop_duplicates('sku_id')
+
+    maestro = get_source().fetch('sap_maestro_articulos', select='*')
+    params = pd.DataFrame({'sku_id': pd.Series(dtype=object)})
+    if not maestro.empty:
+        params = pd.DataFrame({'sku_id': canonical_sku(maestro['codigo'])})
+        for col in ('lead_time', MOQ_COLUMN, ORDER_CYCLE_COLUMN):
+            if col in maestro:
+                params[col] = pd.to_numeric(maestro[col], errors='coerce').to_numpy()
+        params = params[params['sku_id'] != ''].drop_duplicates('sku_id')
+    catalog = catalog.merge(params, on='sku_id', how='left')
+
+    def with_default(col, default, positive):
+        values = pd.to_numeric(catalog[col], errors='coerce') if col in catalog else pd.Series(np.nan, index=catalog.index)
+        invalid = values.isna() | ((values <= 0) if positive else (values < 0))
+        return values.mask(invalid, default).to_numpy(dtype=float)
+
+    catalog['lead_time'] = with_default('lead_time', DEFAULT_LEAD_TIME, positive=True)
+    catalog['moq'] = with_default(MOQ_COLUMN, DEFAULT_MOQ, positive=False)
+    catalog['order_cycle'] = with_default(ORDER_CYCLE_COLUMN, DEFAULT_ORDER_CYCLE, positive=False)
+    catalog['cov'] = np.divide(catalog['desv'], catalog['adu'])
+    return catalog.drop(columns=['desv']).reset_index(drop=True)
+
+
+def load_open_orders(skus, today):
+    """Producción programada desde hoy (cantidad en orden) por SKU."""
+    df = get_source().fetch('sap_programa_produccion', {'fecha': f'gte.{today.isoformat()}'},
+                            'sku_produccion,cantidad_programada,fecha')
+    return _per_sku(df, 'sku_produccion', 'cantidad_programada', skus)
+
+
+def load_demand_matrix(skus, today, horizon):
+    """
+    Matriz SKU × día (columna 0 = hoy) con la demanda pronosticada (venta + consumo).
+    Usa el pronóstico en caché del motor; si no existe, lo lee de sap_pronostico_diario.
+    """
+    matrix = np.zeros((len(skus), horizon + 1))
+    df = state_store.load_object(FORECAST_CACHE_STATE)
+    if df is None or df.empty:
+        df = get_source().fetch('sap_pronostico_diario', {
+            'fecha': f"gte.{today.isoformat()}",
+            'tipo': f"in.({','.join(DEMAND_TYPES)})",
+        }, 'sku_id,fecha,tipo,cantidad_pronosticada', timeout=60)
+        if df.empty:
+            logging.warning("Sin pronóstico: la demanda calificada será 0.")
+            return matrix
+        df = df.rename(columns={'cantidad_pronosticada': 'cantidad'})
+    offset = (pd.to_datetime(df['fecha']).dt.normalize() - pd.Timestamp(today)).dt.days.to_numpy()
+    rows = pd.Index(skus).get_indexer(canonical_sku(df['sku_id']))
+    keep = (rows >= 0) & (offset >= 0) & (offset <= horizon) & df['tipo'].astype(str).isin(DEMAND_TYPES).to_numpy()
+    np.add.at(matrix, (rows[keep], offset[keep]), _numeric(df['cantidad'])[keep])
+    return matrix
+
+
+def compute_buffers(catalog, on_order, demand_matrix):
+    """Zonas, flujo neto y orden recomendada para todo el catálogo (una pasada)."""
+    zones = calculate_buffers_batch(catalog['adu'].to_numpy(), catalog['lead_time'].to_numpy(),
+                                    catalog['cov'].to_numpy(), catalog['moq'].to_numpy(),
+                                    catalog['order_cycle'].to_numpy())
+    qualified = qualified_demand(demand_matrix, catalog['lead_time'].to_numpy(), zones['red_total'])
+    plan = net_flow_plan(zones, catalog['on_hand'].to_numpy(), on_order, qualified, catalog['moq'].to_numpy())
+
+    result = catalog.assign(on_order=on_order, qualified_demand=qualified)
+    for key in ('red_base', 'red_alert', 'red_total', 'yellow', 'green', 'top_of_red', 'top_of_yellow', 'top_of_green'):
+        result[key] = zones[key]
+    for key in ('net_flow', 'zone', 'planning_priority', 'order_qty'):
+        result[key] = plan[key]
+    result[ROUND_COLUMNS] = result[ROUND_COLUMNS].round(2)
+    result['planning_priority'] = result['planning_priority'].round(4)
+    return result
+
+
+def persist_buffers(df_buffers):
+    """Reemplaza el contenido de sap_ddmrp_buffers."""
+    try:
+        get_source().delete(BUFFERS_TABLE, {"sku_id": "not.is.null"})
+    except Exception as e:
+        logging.error(f"Error truncando {BUFFERS_TABLE}: {e}")
+
+    records = df_buffers.assign(updated_at=datetime.now().isoformat()).to_dict(orient='records')
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert(BUFFERS_TABLE, batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch de buffers {i}: {e}")
+    return total_inserted
+
+
+def run_ddmrp(now=None):
+    logging.info("Iniciando cálculo de buffers DDMRP...")
+    now = now or datetime.now()
+    today = now.date()
+    start = time.perf_counter()
+
+    catalog = load_catalog()
+    if catalog.empty:
+        logging.warning("Plan híbrido vacío: no hay buffers que calcular.")
+        return 0
+    skus = catalog['sku_id'].to_numpy(dtype=object)
+    on_order = load_open_orders(skus, today)
+    demand = load_demand_matrix(skus, today, int(catalog['lead_time'].max()))
+    load_s = time.perf_counter() - start
+
+    compute_start = time.perf_counter()
+    df_buffers = compute_buffers(catalog, on_order, demand)
+    compute_s = time.perf_counter() - compute_start
+    logging.info(f"  {len(df_buffers)} SKUs: carga {load_s:.1f}s, cálculo {compute_s * 1000:.1f} ms; "
+                 f"zonas {df_buffers['zone'].value_counts().to_dict()}")
+
+    total = persist_buffers(df_buffers)
+    log_sync_result(table_name=BUFFERS_TABLE, rows_upserted=total, status="success")
+    logging.info(f"Buffers DDMRP completados: {total} SKUs.")
+    return total
+
+
+def benchmark(n_skus, seed=0):
+    """Compara el cálculo escalar (un SKU a la vez) con el vectorizado sobre un catálogo sintético."""
+    rng = np.random.default_rng(seed)
+    adu = rng.gamma(2.0, 5.0, n_skus)
+    lead_time = rng.integers(5, 60, n_skus).astype(float)
+    cov = rng.uniform(0.1, 1.5, n_skus)
+
+    start = time.perf_counter()
+    for a, lt, c in zip(adu, lead_time, cov):
+        calculate_ddmrp_buffers(a, lt, c)
+    scalar_s = time.perf_counter() - start
+
+    catalog = pd.DataFrame({'sku_id': np.arange(n_skus).astype(str), 'adu': adu, 'lead_time': lead_time,
+                            'cov': cov, 'moq': 0.0, 'order_cycle': DEFAULT_ORDER_CYCLE,
+                            'on_hand': adu * rng.uniform(0, 60, n_skus)})
+    demand = rng.poisson(adu[:, np.newaxis], (n_skus, int(lead_time.max()) + 1)).astype(float)
+    on_order = rng.uniform(0, 1, n_skus) * adu * 10
+    start = time.perf_counter()
+    compute_buffers(catalog, on_order, demand)
+    batch_s = time.perf_counter() - start
+
+    logging.info(f"Benchmark {n_skus} SKUs: escalar (solo zonas) {scalar_s * 1000:.1f} ms, "
+                 f"vectorizado (zonas + flujo neto + órdenes) {batch_s * 1000:.1f} ms")
+    return scalar_s, batch_s
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Buffers DDMRP de todo el catálogo")
+    add_cli_arguments(parser)
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help="Solo mide el tiempo de cálculo sobre N SKUs sintéticos (no persiste)")
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        run_ddmrp()
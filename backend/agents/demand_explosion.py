@@ -0,0 +1,145 @@
+"""
+demand_explosion.py
+Demanda explosionada de componentes materializada en sap_demanda_explosionada.
+
+Reemplaza el cálculo de view_exploded_demand en cada consulta: toma todos los meses de
+sap_demanda_proyectada y la venta pronosticada agregada por mes, y los explota por el BOM
+multinivel (modules/bom_explosion.py) con un solo producto de matrices dispersas.
+Origen 'demanda_proyectada' equivale a la vista; 'pronostico' es la misma explosión sobre el pronóstico.
+
+Ejecución: py -3 backend/agents/demand_explosion.py [--fixtures DIR] [--output-dir DIR] [--refresh-bom] [--benchmark N]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# --- Path setup ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.bom_explosion import BomMatrix, load_bom_matrix
+from modules import state_store
+from sync_logger import log_sync_result
+
+EXPLODED_TABLE = 'sap_demanda_explosionada'
+FORECAST_CACHE_STATE = 'forecast_cache.pkl'  # Pronóstico vigente en columnas (agents/forecast_engine.py)
+BATCH_SIZE = 1000
+ORIGINS = ('demanda_proyectada', 'pronostico')
+
+
+def _month_start(values):
+    return pd.to_datetime(pd.Series(values).astype(str).str[:10]).dt.to_period('M').dt.start_time.dt.strftime('%Y-%m-%d')
+
+
+def load_pt_demand():
+    """Demanda de PT por origen y mes: sap_demanda_proyectada completa + venta pronosticada por mes."""
+    parts = []
+    proyectada = get_source().fetch('sap_demanda_proyectada', select='sku_id,mes,cantidad')
+    if not proyectada.empty:
+        parts.append(pd.DataFrame({'origen': 'demanda_proyectada', 'mes': _month_start(proyectada['mes']).to_numpy(),
+                                   'sku_id': proyectada['sku_id'].to_numpy(), 'cantidad': proyectada['cantidad'].to_numpy()}))
+
+    forecast = state_store.load_object(FORECAST_CACHE_STATE)
+    if forecast is None or forecast.empty:
+        forecast = get_source().fetch('sap_pronostico_diario', {'tipo': 'eq.venta'},
+                                      'sku_id,fecha,tipo,cantidad_pronosticada', timeout=60)
+        forecast = forecast.rename(columns={'cantidad_pronosticada': 'cantidad'})
+    if not forecast.empty:
+        forecast = forecast[forecast['tipo'].astype(str) == 'venta']
+        parts.append(pd.DataFrame({'origen': 'pronostico', 'mes': _month_start(forecast['fecha']).to_numpy(),
+                                   'sku_id': forecast['sku_id'].to_numpy(), 'cantidad': forecast['cantidad'].to_numpy()}))
+    if not parts:
+        return pd.DataFrame(columns=['origen', 'mes', 'sku_id', 'cantidad'])
+    return pd.concat(parts, ignore_index=True)
+
+
+def persist_exploded(df_exploded):
+    """Reemplaza el contenido de sap_demanda_explosionada."""
+    try:
+        get_source().delete(EXPLODED_TABLE, {"sku_id": "not.is.null"})
+    except Exception as e:
+        logging.error(f"Error truncando {EXPLODED_TABLE}: {e}")
+
+    records = df_exploded.assign(
+        cantidad_exploded=df_exploded['cantidad_exploded'].round(4),
+        updated_at=datetime.now().isoformat(),
+    ).to_dict(orient='records')
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert(EXPLODED_TABLE, batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch de demanda explosionada {i}: {e}")
+    return total_inserted
+
+
+def run_explosion(refresh_bom=False):
+    logging.info("Iniciando explosión de demanda por BOM...")
+    bom = load_bom_matrix(refresh=refresh_bom)
+    if len(bom) == 0:
+        logging.warning("BOM vacío: no hay demanda que explotar.")
+        return 0
+
+    demand = load_pt_demand()
+    start = time.perf_counter()
+    df_exploded = bom.explode(demand, keys=('origen', 'mes'))
+    explode_ms = (time.perf_counter() - start) * 1000
+    logging.info(f"  BOM {bom.info()}; {len(demand)} registros de demanda → {len(df_exploded)} filas "
+                 f"en {explode_ms:.1f} ms")
+
+    total = persist_exploded(df_exploded)
+    log_sync_result(table_name=EXPLODED_TABLE, rows_upserted=total, status="success")
+    logging.info(f"Explosión completada: {total} filas.")
+    return total
+
+
+def benchmark(n_pts, components_per_pt=25, n_components=None, months=12, seed=0):
+    """Tiempo de explosión sobre un BOM y una demanda sintéticos del tamaño del catálogo."""
+    rng = np.random.default_rng(seed)
+    n_components = n_components or n_pts * 2
+    rows = np.repeat(np.arange(n_pts), components_per_pt)
+    cols = rng.integers(0, n_components, len(rows))
+    matrix = sparse.csr_matrix((rng.uniform(0.01, 1.5, len(rows)), (rows, cols)), shape=(n_pts, n_components))
+    bom = BomMatrix(np.arange(n_pts).astype(str), (np.arange(n_components) + n_pts).astype(str), matrix)
+
+    demand = pd.DataFrame({
+        'origen': np.repeat(list(ORIGINS), n_pts * months),
+        'mes': np.tile(np.repeat(pd.period_range('2026-01', periods=months, freq='M').astype(str), n_pts), len(ORIGINS)),
+        'sku_id': np.tile(np.arange(n_pts).astype(str), months * len(ORIGINS)),
+        'cantidad': rng.gamma(2.0, 50.0, n_pts * months * len(ORIGINS)),
+    })
+    start = time.perf_counter()
+    out = bom.explode(demand, keys=('origen', 'mes'))
+    elapsed = time.perf_counter() - start
+    logging.info(f"Benchmark: {n_pts} PT × {components_per_pt} componentes ({bom.matrix.nnz} pares), "
+                 f"{len(demand)} registros de demanda → {len(out)} filas en {elapsed * 1000:.1f} ms")
+    return elapsed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Explosión de demanda por BOM multinivel")
+    add_cli_arguments(parser)
+    parser.add_argument('--refresh-bom', action='store_true',
+                        help="Rearma la matriz desde sap_bom_multinivel aunque exista en backend/state/")
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help="Solo mide la explosión sobre N PTs sintéticos (no persiste)")
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        run_explosion(refresh_bom=args.refresh_bom)
@@ -0,0 +1,409 @@
+"""
+forecast_backtest.py
+Backtesting con origen móvil y benchmark del Motor de Pronósticos.
+En N fechas de corte recorta el snapshot como lo descargaría fetch_source_data ese día y corre el
+pipeline real del motor (build_forecast_inputs → iter_forecast_blocks → forecast_sku, con alphas por
+SKU, plan y programa). Reporta WAPE y sesgo por celda ABC/XYZ del motor y de WMA / SES / Croston
+puros como referencia, junto con tiempo, memoria y SKUs/segundo por fase. Corre 100% offline desde
+un snapshot guardado, y su reporte JSON sirve como compuerta de regresión entre commits.
+
+Ejecución:
+  py -3 backend/agents/forecast_backtest.py --save-snapshot DIR   (descarga, requiere red)
+  py -3 backend/agents/forecast_backtest.py --snapshot DIR [--cutoffs 6] [--horizon 30]
+        [--output reporte.json] [--baseline reporte_anterior.json] [--tolerance 0.01]
+        [--max-slowdown 1.2] [--workers N] [--no-memory]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import subprocess
+import tracemalloc
+import calendar
+from datetime import datetime, date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- Path setup ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+import forecast_engine as fe
+from modules.sku_codes import canonical_sku
+
+# Tablas del snapshot (historia completa): nombre de archivo → (tabla Supabase, columnas).
+# Son las mismas fuentes y columnas que fetch_source_data; cada corte las recorta como las vería el motor.
+SNAPSHOT_TABLES = {
+    'consumo_mensual': ('sap_consumo_sku_mensual', 'sku_id,mes,tipo2,cantidad_total_tn'),
+    'consumo_diario': ('sap_consumo_diario_clean', 'sku_id,fecha,cantidad_limpia'),
+    'produccion': ('sap_produccion', 'material,cantidad_tn,fecha_contabilizacion'),
+    'demanda': ('sap_demanda_proyectada', 'sku_id,mes,cantidad'),
+    'programa': ('sap_programa_produccion', 'fecha,sku_produccion,sku_consumo,cantidad_programada'),
+    'segmentos': ('sap_plan_inventario_hibrido', 'sku_id,abc_segment,xyz_segment,factor_fin_mes,adu_hibrido_final'),
+    'parametros': ('sap_parametros_pronostico', 'sku_id,ses_alpha,croston_alpha'),
+}
+REQUIRED_TABLES = ('consumo_diario',)   # Da también la demanda real de cada corte
+ID_COLUMNS = ('sku_id', 'material', 'sku_produccion', 'sku_consumo')
+# Columna de fecha de cada tabla con historia
+DATE_COLUMNS = {'consumo_mensual': 'mes', 'consumo_diario': 'fecha', 'produccion': 'fecha_contabilizacion',
+                'demanda': 'mes', 'programa': 'fecha'}
+
+REFERENCE_METHODS = ('WMA', 'SES', 'CROSTON')
+ENGINE_METHOD = 'MOTOR'    # Salida de iter_forecast_blocks (segmento, alphas por SKU, plan y programa)
+METHODS = REFERENCE_METHODS + (ENGINE_METHOD,)
+DEMAND_TYPES = ('venta', 'consumo')
+DEFAULT_CUTOFFS = 6
+DEFAULT_HORIZON = 30
+
+
+# =============================================================================
+# SNAPSHOT
+# =============================================================================
+
+def save_snapshot(snapshot_dir):
+    """Descarga de Supabase las tablas necesarias (historia completa) y las guarda como CSV."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    manifest = {'created_at': datetime.now().isoformat(), 'tables': {}}
+    for name, (table, select) in SNAPSHOT_TABLES.items():
+        df = fe.fetch_all_paginated(table, {}, select)
+        df.to_csv(os.path.join(snapshot_dir, f"{name}.csv"), index=False)
+        manifest['tables'][name] = {'table': table, 'rows': len(df)}
+        logging.info(f"  Snapshot {name}: {len(df)} registros")
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_snapshot(snapshot_dir):
+    """Carga el snapshot y retorna (data, hash del contenido). Las tablas opcionales que falten quedan vacías."""
+    data = {}
+    digest = hashlib.sha1()
+    for name, (_, select) in SNAPSHOT_TABLES.items():
+        path = os.path.join(snapshot_dir, f"{name}.csv")
+        if not os.path.exists(path):
+            if name in REQUIRED_TABLES:
+                raise FileNotFoundError(f"Falta {path} en el snapshot")
+            logging.warning(f"  Snapshot sin {name}.csv: se usa vacía (snapshot anterior a esta versión)")
+            data[name] = pd.DataFrame(columns=select.split(','))
+            continue
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        data[name] = pd.read_csv(path, dtype={c: str for c in ID_COLUMNS})
+    return data, digest.hexdigest()
+
+
+# =============================================================================
+# PREPARACIÓN
+# =============================================================================
+
+def _month_start(d):
+    return d.replace(day=1)
+
+
+def _add_months(d, n):
+    month_index = d.year * 12 + d.month - 1 + n
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _dates(values):
+    """Fechas como datetime64 sin zona (las de sap_produccion vienen con zona)."""
+    parsed = pd.to_datetime(values.astype(str).str[:10], errors='coerce')
+    return parsed.to_numpy(dtype='datetime64[D]')
+
+
+def index_snapshot(data):
+    """Fechas de cada tabla parseadas una vez, para recortar cualquier corte con máscaras."""
+    dates = {name: _dates(data[name][col]) for name, col in DATE_COLUMNS.items()}
+    daily = data['consumo_diario']
+    actual = pd.DataFrame({
+        'sku_id': canonical_sku(daily['sku_id']).to_numpy(),
+        'fecha': dates['consumo_diario'],
+        'cantidad': pd.to_numeric(daily['cantidad_limpia'], errors='coerce').fillna(0.0).to_numpy(),
+    })
+    max_date = pd.Timestamp(np.nanmax(dates['consumo_diario'])).date() if len(actual) else date.today()
+    return {'data': data, 'dates': dates, 'actual': actual, 'max_date': max_date}
+
+
+def truncate_snapshot(snapshot, cutoff):
+    """
+    Fuentes tal como las descargaría fetch_source_data corriendo el día `cutoff`: misma ventana de cada
+    tabla y, en las de historia, nada desde el corte en adelante. Segmentos y alphas son los del snapshot.
+    """
+    c = np.datetime64(cutoff, 'D')
+    month_end = np.datetime64(date(cutoff.year, cutoff.month, calendar.monthrange(cutoff.year, cutoff.month)[1]), 'D')
+    windows = {
+        'consumo_mensual': (np.datetime64(_month_start(cutoff - timedelta(days=365)), 'D'), c),
+        'consumo_diario': (c - np.timedelta64(90, 'D'), c),
+        'produccion': (c - np.timedelta64(180, 'D'), c),
+        'demanda': (np.datetime64(_month_start(cutoff), 'D'), None),
+        'programa': (np.datetime64(_month_start(cutoff), 'D'), month_end + np.timedelta64(1, 'D')),
+    }
+    data = dict(snapshot['data'])
+    for name, (lo, hi) in windows.items():
+        d = snapshot['dates'][name]
+        mask = d >= lo
+        if hi is not None:
+            mask &= d < hi
+        data[name] = data[name][mask]
+    return data
+
+
+def prepare_cutoffs(snapshot, cutoffs):
+    """Entradas del motor (build_forecast_inputs) para cada fecha de corte."""
+    return [(cutoff, fe.build_forecast_inputs(truncate_snapshot(snapshot, cutoff))) for cutoff in cutoffs]
+
+
+def select_cutoffs(max_date, n_cutoffs, horizon):
+    """Inicios de mes cuyo horizonte completo cae dentro de la historia disponible (más reciente al final)."""
+    last = _month_start(max_date - timedelta(days=horizon - 1))
+    if last + timedelta(days=horizon - 1) > max_date:
+        last = _add_months(last, -1)
+    return [_add_months(last, -k) for k in range(n_cutoffs - 1, -1, -1)]
+
+
+# =============================================================================
+# EJECUCIÓN Y MÉTRICAS
+# =============================================================================
+
+class PhaseTimer:
+    """
+    Mide tiempo y throughput de cada fase sin instrumentación; la memoria pico (tracemalloc) se
+    mide en una segunda pasada de la misma fase, porque tracemalloc multiplica el tiempo de ejecución.
+    """
+
+    def __init__(self, measure_memory=True):
+        self.phases = {}
+        self.measure_memory = measure_memory
+
+    def run(self, name, units, fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t0
+        peak = None
+        if self.measure_memory:
+            tracemalloc.start()
+            fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        n = int(units(result) if callable(units) else units)
+        self.phases[name] = {
+            'seconds': round(elapsed, 4),
+            'peak_mb': round(peak / 1e6, 2) if peak is not None else None,
+            'units': n,
+            'units_per_sec': round(n / elapsed, 1) if elapsed > 0 else None,
+        }
+        peak_txt = f", pico {peak / 1e6:.1f} MB" if peak is not None else ""
+        logging.info(f"  Fase {name}: {elapsed:.2f}s{peak_txt}, {n} unidades")
+        return result
+
+
+def _segment_cell(seg):
+    abc = str(seg['abc']).strip().upper() if seg['abc'] else '-'
+    xyz = str(seg['xyz']).strip().upper() if seg['xyz'] else '-'
+    return f"{abc}-{xyz}"
+
+
+def run_engine(prepared, horizon, workers=None):
+    """
+    Corre el motor (iter_forecast_blocks → forecast_sku) desde cada corte por `horizon` días.
+    Retorna [(cutoff, inputs, {sku: demanda pronosticada venta + consumo del horizonte})].
+    """
+    out = []
+    for cutoff, inputs in prepared:
+        plan = {sku: range(horizon) for sku in inputs['skus']}
+        totals = {}
+        for block in fe.iter_forecast_blocks(inputs, plan, workers, today=cutoff, run_ts=cutoff.isoformat()):
+            for rec in block:
+                if rec['tipo'] in DEMAND_TYPES:
+                    totals[rec['sku_id']] = totals.get(rec['sku_id'], 0.0) + rec['cantidad_pronosticada']
+        out.append((cutoff, inputs, totals))
+    return out
+
+
+def _reference_forecast(method, sku, inputs, horizon):
+    """Demanda del horizonte con un solo método histórico, con las entradas y alphas del motor (como forecast_sku sin plan)."""
+    params = inputs['param_map'].get(sku)
+    monthly = inputs['consumo_mensual_map'].get(sku, {})
+    daily = inputs['consumo_diario_map'].get(sku, [])
+    adu = sum(fe.calculate_historical_adu(method, [v for _, v in monthly.get(tipo, [])], daily, params)
+              for tipo in DEMAND_TYPES)
+    return adu * horizon
+
+
+def assemble_results(snapshot, engine_runs, horizon):
+    """Una fila por SKU × corte × método (pronóstico y real); los SKUs con demanda real sin pronóstico cuentan con 0."""
+    default_seg = {'abc': None, 'xyz': None, 'factor': 1.0, 'adu_actual': 0}
+    actual_all = snapshot['actual']
+    rows = []
+    for cutoff, inputs, totals in engine_runs:
+        c = np.datetime64(cutoff, 'D')
+        window = actual_all[(actual_all['fecha'] >= c) & (actual_all['fecha'] < c + np.timedelta64(horizon, 'D'))]
+        actual = window.groupby('sku_id')['cantidad'].sum()
+        actual = actual[actual.index != '']
+        # El motor usa la forma guardada del código; el real se cruza por código canónico
+        stored = dict(zip(canonical_sku(list(inputs['skus'])), inputs['skus']))
+        for sku in sorted(set(stored) | set(actual.index)):
+            key = stored.get(sku, sku)
+            real = float(actual.get(sku, 0.0))
+            forecasts = {m: _reference_forecast(m, key, inputs, horizon) for m in REFERENCE_METHODS}
+            forecasts[ENGINE_METHOD] = totals.get(key, 0.0)
+            if real == 0 and not any(forecasts.values()):
+                continue
+            seg = inputs['seg_map'].get(key, default_seg)
+            seg_method = fe.get_segment_config(seg['abc'], seg['xyz'])[2]
+            cell = _segment_cell(seg)
+            for method, value in forecasts.items():
+                rows.append((cutoff.isoformat(), sku, cell, seg_method, method, value, real))
+    return pd.DataFrame(rows, columns=['cutoff', 'sku_id', 'cell', 'segment_method', 'method', 'forecast', 'actual'])
+
+
+def score(results):
+    """WAPE y sesgo por celda ABC/XYZ × método, más el total por método."""
+    def _agg(df):
+        actual = df['actual'].sum()
+        abs_err = (df['forecast'] - df['actual']).abs().sum()
+        err = (df['forecast'] - df['actual']).sum()
+        return {
+            'wape': round(abs_err / actual, 6) if actual > 0 else None,
+            'bias': round(err / actual, 6) if actual > 0 else None,
+            'actual': round(float(actual), 3),
+            'n': int(len(df)),
+        }
+
+    by_cell = {}
+    for (cell, method), grp in results.groupby(['cell', 'method'], sort=True):
+        by_cell.setdefault(cell, {})[method] = _agg(grp)
+    overall = {method: _agg(grp) for method, grp in results.groupby('method', sort=True)}
+    return {'by_cell': by_cell, 'overall': overall}
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_backtest(snapshot_dir, n_cutoffs=DEFAULT_CUTOFFS, horizon=DEFAULT_HORIZON, workers=None, measure_memory=True):
+    timer = PhaseTimer(measure_memory)
+    data, snapshot_hash = timer.run('load', lambda r: sum(len(df) for df in r[0].values()), load_snapshot, snapshot_dir)
+    snapshot = index_snapshot(data)
+    cutoffs = select_cutoffs(snapshot['max_date'], n_cutoffs, horizon)
+    logging.info(f"  Cortes: {[c.isoformat() for c in cutoffs]}")
+    prepared = timer.run('prepare', lambda r: sum(len(inp['skus']) for _, inp in r), prepare_cutoffs, snapshot, cutoffs)
+    engine_runs = timer.run('forecast', lambda r: sum(len(inp['skus']) for _, inp, _ in r),
+                            run_engine, prepared, horizon, workers)
+    results = assemble_results(snapshot, engine_runs, horizon)
+    metrics = timer.run('score', len(results), score, results)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'run_at': datetime.now().isoformat(),
+            'snapshot': os.path.abspath(snapshot_dir),
+            'snapshot_hash': snapshot_hash,
+            'cutoffs': [c.isoformat() for c in cutoffs],
+            'horizon_days': horizon,
+            'segment_config': {f"{a}-{x}": list(v) for (a, x), v in fe.SEGMENT_CONFIG.items()},
+        },
+        'accuracy': metrics,
+        'performance': timer.phases,
+    }
+
+
+def compare_reports(report, baseline, tolerance, max_slowdown=None):
+    """
+    Compuerta de regresión: falla si el WAPE de cualquier método/celda empeora más que
+    `tolerance` (absoluto) respecto a la línea base, o si la fase forecast es más lenta
+    que `max_slowdown` veces. Retorna la lista de regresiones encontradas.
+    """
+    problems = []
+    if report['meta']['snapshot_hash'] != baseline['meta'].get('snapshot_hash'):
+        problems.append("El snapshot difiere de la línea base: los reportes no son comparables.")
+        return problems
+
+    def _check(label, new, old):
+        if new.get('wape') is None or old.get('wape') is None:
+            return
+        if new['wape'] > old['wape'] + tolerance:
+            problems.append(f"{label}: WAPE {old['wape']:.4f} → {new['wape']:.4f}")
+
+    for method, old in baseline['accuracy']['overall'].items():
+        _check(f"total/{method}", report['accuracy']['overall'].get(method, {}), old)
+    for cell, methods in baseline['accuracy']['by_cell'].items():
+        for method, old in methods.items():
+            _check(f"{cell}/{method}", report['accuracy']['by_cell'].get(cell, {}).get(method, {}), old)
+
+    if max_slowdown:
+        old_s = baseline['performance'].get('forecast', {}).get('seconds')
+        new_s = report['performance'].get('forecast', {}).get('seconds')
+        if old_s and new_s and new_s > old_s * max_slowdown:
+            problems.append(f"forecast: {old_s:.2f}s → {new_s:.2f}s (> x{max_slowdown})")
+    return problems
+
+
+def _print_summary(report):
+    print(f"\nBacktest — commit {report['meta']['commit']} — cortes {report['meta']['cutoffs']}")
+    print(f"{'Celda':<8}{'Método':<10}{'WAPE':>10}{'Sesgo':>10}{'N':>8}")
+    for cell, methods in report['accuracy']['by_cell'].items():
+        for method, m in methods.items():
+            wape = f"{m['wape']:.3f}" if m['wape'] is not None else '-'
+            bias = f"{m['bias']:+.3f}" if m['bias'] is not None else '-'
+            print(f"{cell:<8}{method:<10}{wape:>10}{bias:>10}{m['n']:>8}")
+    for method, m in report['accuracy']['overall'].items():
+        wape = f"{m['wape']:.3f}" if m['wape'] is not None else '-'
+        print(f"{'TOTAL':<8}{method:<10}{wape:>10}")
+    print("\nRendimiento:")
+    for phase, p in report['performance'].items():
+        peak = f"{p['peak_mb']:>9.1f} MB" if p['peak_mb'] is not None else f"{'-':>12}"
+        print(f"  {phase:<10}{p['seconds']:>9.2f}s {peak} {p['units_per_sec'] or 0:>12.1f} u/s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Backtesting y benchmark del Motor de Pronósticos")
+    parser.add_argument('--snapshot', help="Directorio del snapshot (CSV) para correr offline")
+    parser.add_argument('--save-snapshot', help="Descarga las tablas de Supabase a este directorio y termina")
+    parser.add_argument('--cutoffs', type=int, default=DEFAULT_CUTOFFS, help="Número de fechas de corte")
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help="Días evaluados tras cada corte")
+    parser.add_argument('--output', help="Ruta del reporte JSON")
+    parser.add_argument('--baseline', help="Reporte JSON previo contra el cual comparar")
+    parser.add_argument('--tolerance', type=float, default=0.01, help="Aumento de WAPE tolerado (absoluto)")
+    parser.add_argument('--max-slowdown', type=float, default=None, help="Factor de lentitud tolerado en la fase forecast")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos del motor (por defecto FORECAST_WORKERS)")
+    parser.add_argument('--no-memory', action='store_true', help="Omite la pasada con tracemalloc (memoria pico)")
+    args = parser.parse_args()
+
+    if args.save_snapshot:
+        save_snapshot(args.save_snapshot)
+        sys.exit(0)
+    if not args.snapshot:
+        parser.error("--snapshot es obligatorio (o --save-snapshot para crearlo)")
+
+    report = run_backtest(args.snapshot, args.cutoffs, args.horizon, args.workers, not args.no_memory)
+    _print_summary(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nReporte guardado en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        problems = compare_reports(report, baseline, args.tolerance, args.max_slowdown)
+        if problems:
+            print("\nREGRESIONES DETECTADAS:")
+            for p in problems:
+                print(f"  - {p}")
+            sys.exit(1)
+        print("\nSin regresiones respecto a la línea base.")
@@ -5,37 +5,51 @@ Genera pronósticos diarios a 90 días por SKU combinando datos históricos
 con planes comerciales/producción, seleccionando automáticamente el método
 según la segmentación ABC/XYZ.
 
-Ejecución: py -3 backend/agents/forecast_engine.py
+Ejecución: py -3 backend/agents/forecast_engine.py [--full] [--workers N] [--fixtures DIR]
 """
 
 import os
 import sys
 import math
+import hashlib
 import logging
-import requests
+import argparse
 import numpy as np
 import pandas as pd
 from datetime import datetime, date, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import queue
+import threading
 import calendar
 
 # --- Path setup ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
 
-from modules.api_client import get_headers, SUPABASE_URL, post_to_supabase
+from modules import state_store
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import canonical_sku, stored_sku
 from sync_logger import log_sync_result
+import forecast_rollups
 
 # --- Logging ---
 LOG_FILE = os.path.join(SCRIPT_DIR, 'forecast_engine_log.txt')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+
+
+def configure_logging():
+    """Log a archivo y consola; solo al correr el motor como script (importarlo no escribe el log)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
 
 # =============================================================================
 # CONFIGURACIÓN DE SEGMENTOS ABC/XYZ
@@ -58,8 +72,25 @@ DEFAULT_SEGMENT = (0.5, 0.5, 'WMA')
 
 HORIZON_DAYS = 90
 SES_ALPHA = 0.2
+CROSTON_ALPHA = 0.15
 WMA_WEIGHTS = [3, 2, 1]  # Último mes, penúltimo, antepenúltimo
 BATCH_SIZE = 500
+STREAM_QUEUE_BLOCKS = 64  # Bloques en cola entre el cálculo y el uploader
+SKU_DELETE_CHUNK = 100  # SKUs por request DELETE (límite de longitud de URL)
+FINGERPRINT_STATE = 'forecast_fingerprints.json'
+FORECAST_CACHE_STATE = 'forecast_cache.pkl'  # Pronóstico vigente en columnas, base de los rollups
+FORECAST_SPOOL_STATE = 'forecast_cache.spool'  # Bloques generados en la corrida, antes de armar la caché
+
+# Paralelismo: procesos del pool (1 = un solo proceso). Configurable con --workers o FORECAST_WORKERS.
+FORECAST_WORKERS = max(1, int(os.getenv('FORECAST_WORKERS', '1') or 1))
+SHARD_SKUS = 250  # SKUs por bloque enviado a un proceso
+MIN_SKUS_FOR_POOL = 200  # Por debajo de esto el costo de lanzar procesos no compensa
+
+# Mapas por SKU que produce build_forecast_inputs (se reparten por bloque entre procesos)
+INPUT_MAP_KEYS = (
+    'seg_map', 'consumo_mensual_map', 'consumo_diario_map', 'produccion_mensual_map',
+    'demanda_map', 'programa_prod_map', 'programa_cons_map', 'param_map',
+)
 
 
 def safe_float(val, default=0.0):
@@ -79,34 +110,12 @@ def safe_float(val, default=0.0):
 
 def fetch_all_paginated(table, params=None, select='*'):
     """Descarga todos los registros de una tabla con paginación automática."""
-    if params is None:
-        params = {}
-    params['select'] = select
-    all_data = []
-    start, batch_size = 0, 1000
-    while True:
-        headers = get_headers()
-        headers["Range"] = f"{start}-{start + batch_size - 1}"
-        url = f"{SUPABASE_URL}/rest/v1/{table}"
-        try:
-            resp = requests.get(url, headers=headers, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-            if not data:
-                break
-            all_data.extend(data)
-            if len(data) < batch_size:
-                break
-            start += batch_size
-        except Exception as e:
-            logging.error(f"Error descargando {table}: {e}")
-            break
-    return pd.DataFrame(all_data) if all_data else pd.DataFrame()
+    return get_source().fetch(table, params, select)
 
 
 def fetch_source_data():
     """Descarga todas las fuentes de datos necesarias para el pronóstico."""
-    logging.info("Descargando datos fuente de Supabase...")
+    logging.info("Descargando datos fuente...")
 
     now = datetime.now()
     today_str = now.strftime('%Y-%m-01')
@@ -150,21 +159,12 @@ def fetch_source_data():
     first_day = now.replace(day=1).strftime('%Y-%m-%d')
     last_day_num = calendar.monthrange(now.year, now.month)[1]
     last_day = now.replace(day=last_day_num).strftime('%Y-%m-%d')
+    # PostgREST admite el mismo filtro repetido: fecha=gte.X&fecha=lte.Y
     df_programa = fetch_all_paginated(
         'sap_programa_produccion',
-        {'fecha': f'gte.{first_day}', 'fecha': f'lte.{last_day}'},
+        {'fecha': [f'gte.{first_day}', f'lte.{last_day}']},
         'fecha,sku_produccion,sku_consumo,cantidad_programada'
     )
-    # Re-fetch con rango correcto (PostgREST no soporta doble param igual)
-    prog_params = {'select': 'fecha,sku_produccion,sku_consumo,cantidad_programada'}
-    prog_url = f"{SUPABASE_URL}/rest/v1/sap_programa_produccion?fecha=gte.{first_day}&fecha=lte.{last_day}"
-    try:
-        resp = requests.get(prog_url, headers=get_headers())
-        resp.raise_for_status()
-        df_programa = pd.DataFrame(resp.json()) if resp.json() else pd.DataFrame()
-    except Exception as e:
-        logging.warning(f"Error descargando programa: {e}")
-        df_programa = pd.DataFrame()
     logging.info(f"  Programa producción: {len(df_programa)} registros")
 
     # 6. Segmentación ABC/XYZ y factor estacionalidad
@@ -175,6 +175,14 @@ def fetch_source_data():
     )
     logging.info(f"  Segmentos ABC/XYZ: {len(df_segmentos)} registros")
 
+    # 7. Parámetros de suavización ajustados por SKU (forecast_tuner.py)
+    df_parametros = fetch_all_paginated(
+        'sap_parametros_pronostico',
+        {},
+        'sku_id,ses_alpha,croston_alpha'
+    )
+    logging.info(f"  Parámetros por SKU: {len(df_parametros)} registros")
+
     return {
         'consumo_mensual': df_consumo_mensual,
         'consumo_diario': df_consumo_diario,
@@ -182,6 +190,7 @@ def fetch_source_data():
         'demanda': df_demanda,
         'programa': df_programa,
         'segmentos': df_segmentos,
+        'parametros': df_parametros,
     }
 
 
@@ -233,7 +242,7 @@ def calculate_ses(daily_values, alpha=SES_ALPHA):
     return max(0.0, forecast)
 
 
-def calculate_croston(daily_values):
+def calculate_croston(daily_values, alpha=CROSTON_ALPHA):
     """
     Método de Croston para demanda intermitente.
     Separa tamaño de demanda de frecuencia de aparición.
@@ -260,7 +269,6 @@ def calculate_croston(daily_values):
         return total / len(daily_values) if len(daily_values) > 0 else 0.0
 
     # Suavización exponencial para tamaño e intervalo
-    alpha = 0.15
     avg_demand = demands[0]
     avg_interval = intervals[0] if intervals else 1
 
@@ -331,14 +339,18 @@ def get_segment_config(abc, xyz):
     return DEFAULT_SEGMENT
 
 
-def calculate_historical_adu(method, monthly_values, daily_values):
-    """Calcula ADU histórico usando el método indicado."""
+def calculate_historical_adu(method, monthly_values, daily_values, params=None):
+    """
+    Calcula ADU histórico usando el método indicado.
+    params: dict opcional con 'ses_alpha' / 'croston_alpha' ajustados para el SKU.
+    """
+    params = params or {}
     if method == 'WMA':
         return calculate_wma(monthly_values)
     elif method == 'SES':
-        return calculate_ses(daily_values)
+        return calculate_ses(daily_values, params.get('ses_alpha', SES_ALPHA))
     elif method == 'CROSTON':
-        return calculate_croston(daily_values)
+        return calculate_croston(daily_values, params.get('croston_alpha', CROSTON_ALPHA))
     else:
         return calculate_wma(monthly_values)
 
@@ -347,23 +359,57 @@ def calculate_historical_adu(method, monthly_values, daily_values):
 # GENERADOR PRINCIPAL DE PRONÓSTICOS
 # =============================================================================
 
-def generate_forecasts(data):
+# Columnas de SKU por fuente, en orden de preferencia de la forma guardada (el de los candidatos)
+ID_SOURCES = (
+    ('consumo_mensual', ('sku_id',)), ('demanda', ('sku_id',)), ('programa', ('sku_produccion', 'sku_consumo')),
+    ('produccion', ('material',)), ('consumo_diario', ('sku_id',)), ('segmentos', ('sku_id',)),
+    ('parametros', ('sku_id',)),
+)
+
+
+def _unify_ids(data):
     """
-    Genera pronósticos diarios para todos los SKUs.
-    Retorna una lista de registros listos para insertar en sap_pronostico_diario.
+    Cruza las fuentes por código canónico pero deja en las columnas de SKU la forma guardada
+    (stored_sku): para cada código canónico, la primera forma vista según ID_SOURCES. Así
+    '000040001234' y '40001234' son el mismo SKU y sap_pronostico_diario conserva el código
+    de la base. El código '0' (sin SKU en el programa) queda vacío.
     """
-    logging.info("Generando pronósticos...")
-
-    now = datetime.now()
-    today = now.date()
-    horizon_end = today + timedelta(days=HORIZON_DAYS)
+    pairs = []
+    for key, columns in ID_SOURCES:
+        df = data.get(key)
+        if df is None or df.empty:
+            continue
+        for col in columns:
+            if col in df.columns:
+                pairs.append(pd.DataFrame({'canon': canonical_sku(df[col]), 'stored': stored_sku(df[col])}))
+    if not pairs:
+        return data
+    pairs = pd.concat(pairs, ignore_index=True)
+    pairs = pairs[~pairs['canon'].isin(['', '0'])].drop_duplicates('canon')
+    representative = pd.Series(pairs['stored'].to_numpy(), index=pairs['canon'].to_numpy())
+
+    data = dict(data)
+    for key, columns in ID_SOURCES:
+        df = data.get(key)
+        if df is None or df.empty:
+            continue
+        present = [c for c in columns if c in df.columns]
+        data[key] = df.assign(**{c: canonical_sku(df[c]).map(representative).fillna('') for c in present})
+    return data
+
+
+def build_forecast_inputs(data):
+    """
+    Pre-procesa los DataFrames fuente en mapas por SKU.
+    Retorna un dict con los mapas y la lista ordenada de SKUs candidatos.
+    """
+    data = _unify_ids(data)
 
-    # --- Pre-procesar datos ---
     # Segmentos como dict: sku_id → {abc, xyz, factor, adu_actual}
     seg_map = {}
     if not data['segmentos'].empty:
         for _, row in data['segmentos'].iterrows():
-            sku = str(row.get('sku_id', '')).strip()
+            sku = row.get('sku_id', '')
             if sku:
                 seg_map[sku] = {
                     'abc': row.get('abc_segment'),
@@ -376,7 +422,7 @@ def generate_forecasts(data):
     consumo_mensual_map = {}
     if not data['consumo_mensual'].empty:
         for _, row in data['consumo_mensual'].iterrows():
-            sku = str(row.get('sku_id', '')).strip()
+            sku = row.get('sku_id', '')
             tipo = str(row.get('tipo2', '')).lower().strip()
             mes = str(row.get('mes', ''))
             qty = safe_float(row.get('cantidad_total_tn', 0))
@@ -397,7 +443,7 @@ def generate_forecasts(data):
     if not data['consumo_diario'].empty:
         sorted_df = data['consumo_diario'].sort_values('fecha')
         for _, row in sorted_df.iterrows():
-            sku = str(row.get('sku_id', '')).strip()
+            sku = row.get('sku_id', '')
             qty = safe_float(row.get('cantidad_limpia', 0))
             if sku:
                 if sku not in consumo_diario_map:
@@ -408,7 +454,6 @@ def generate_forecasts(data):
     produccion_mensual_map = {}
     if not data['produccion'].empty:
         df_p = data['produccion'].copy()
-        df_p['material'] = df_p['material'].astype(str).str.strip()
         df_p['fecha_contabilizacion'] = pd.to_datetime(df_p['fecha_contabilizacion'], utc=True)
         df_p['month_key'] = df_p['fecha_contabilizacion'].dt.tz_localize(None).dt.to_period('M')
         grouped = df_p.groupby(['material', 'month_key'])['cantidad_tn'].sum().reset_index()
@@ -423,7 +468,7 @@ def generate_forecasts(data):
     demanda_map = {}
     if not data['demanda'].empty:
         for _, row in data['demanda'].iterrows():
-            sku = str(row.get('sku_id', '')).strip()
+            sku = row.get('sku_id', '')
             mes_str = str(row.get('mes', ''))
             qty = safe_float(row.get('cantidad', 0))
             if sku and qty > 0:
@@ -441,8 +486,8 @@ def generate_forecasts(data):
     if not data['programa'].empty:
         for _, row in data['programa'].iterrows():
             fecha_str = str(row.get('fecha', ''))
-            sku_prod = str(row.get('sku_produccion', '')).strip()
-            sku_cons = str(row.get('sku_consumo', '')).strip()
+            sku_prod = row.get('sku_produccion', '')
+            sku_cons = row.get('sku_consumo', '')
             qty = safe_float(row.get('cantidad_programada', 0))
 
             if sku_prod and sku_prod != '0' and qty > 0:
@@ -455,6 +500,21 @@ def generate_forecasts(data):
                     programa_cons_map[sku_cons] = []
                 programa_cons_map[sku_cons].append((fecha_str, qty))
 
+    # Parámetros de suavización por SKU: sku_id → {ses_alpha, croston_alpha}
+    param_map = {}
+    if not data.get('parametros', pd.DataFrame()).empty:
+        for _, row in data['parametros'].iterrows():
+            sku = row.get('sku_id', '')
+            if not sku:
+                continue
+            params = {}
+            for key in ('ses_alpha', 'croston_alpha'):
+                val = safe_float(row.get(key), default=-1.0)
+                if 0 < val <= 1:
+                    params[key] = val
+            if params:
+                param_map[sku] = params
+
     # --- Recopilar todos los SKUs candidatos ---
     all_skus = set()
     all_skus.update(consumo_mensual_map.keys())
@@ -465,130 +525,273 @@ def generate_forecasts(data):
     # Filtrar SKUs vacíos
     all_skus = {s for s in all_skus if s and s != 'nan'}
 
-    logging.info(f"  SKUs candidatos: {len(all_skus)}")
+    return {
+        'seg_map': seg_map,
+        'consumo_mensual_map': consumo_mensual_map,
+        'consumo_diario_map': consumo_diario_map,
+        'produccion_mensual_map': produccion_mensual_map,
+        'demanda_map': demanda_map,
+        'programa_prod_map': programa_prod_map,
+        'programa_cons_map': programa_cons_map,
+        'param_map': param_map,
+        'skus': sorted(all_skus),
+    }
+
+
+def sku_fingerprint(sku, inputs):
+    """
+    Huella de todas las entradas que determinan el pronóstico de un SKU:
+    ventana histórica (mensual, diaria y producción), segmento, factor_fin_mes,
+    demanda proyectada, programa de producción y parámetros de suavización.
+    Si no cambia, el pronóstico tampoco.
+    """
+    seg = inputs['seg_map'].get(sku, {})
+    payload = (
+        seg.get('abc'), seg.get('xyz'), seg.get('factor'),
+        inputs['consumo_mensual_map'].get(sku, {}).get('consumo', []),
+        inputs['consumo_mensual_map'].get(sku, {}).get('venta', []),
+        inputs['consumo_diario_map'].get(sku, []),
+        inputs['produccion_mensual_map'].get(sku, []),
+        sorted(inputs['demanda_map'].get(sku, [])),
+        sorted(inputs['programa_prod_map'].get(sku, [])),
+        sorted(inputs['programa_cons_map'].get(sku, [])),
+        sorted(inputs.get('param_map', {}).get(sku, {}).items()),
+    )
+    return hashlib.sha1(repr(payload).encode('utf-8')).hexdigest()
+
+
+def forecast_sku(sku, inputs, today, stats, day_offsets=None, run_ts=None):
+    """
+    Genera los registros de pronóstico de un SKU para los días indicados
+    (desplazamientos desde hoy; por defecto todo el horizonte).
+    Acumula la distribución por método en `stats`.
+    """
+    if day_offsets is None:
+        day_offsets = range(HORIZON_DAYS)
+    if run_ts is None:
+        run_ts = datetime.now().isoformat()
+
+    records = []
+    seg = inputs['seg_map'].get(sku, {'abc': None, 'xyz': None, 'factor': 1.0, 'adu_actual': 0})
+    abc = seg['abc']
+    xyz = seg['xyz']
+    factor = seg['factor']
+    peso_plan, peso_hist, method = get_segment_config(abc, xyz)
+    params = inputs.get('param_map', {}).get(sku)
+
+    # --- PRONÓSTICO DE CONSUMO ---
+    hist_consumo = inputs['consumo_mensual_map'].get(sku, {}).get('consumo', [])
+    hist_consumo_vals = [v for _, v in hist_consumo]
+    diario_consumo = inputs['consumo_diario_map'].get(sku, [])
+    programa_consumo = inputs['programa_cons_map'].get(sku, [])
+
+    adu_hist_consumo = calculate_historical_adu(method, hist_consumo_vals, diario_consumo, params)
+    has_hist_consumo = adu_hist_consumo > 0
+
+    # Plan como consumo del programa de producción
+    has_programa_consumo = len(programa_consumo) > 0
+
+    if has_hist_consumo or has_programa_consumo:
+        for day_offset in day_offsets:
+            target_date = today + timedelta(days=day_offset)
+            target_str = target_date.strftime('%Y-%m-%d')
+
+            # ¿Hay programa de producción para esta fecha?
+            prog_qty = sum(q for f, q in programa_consumo if f == target_str)
+            if prog_qty > 0:
+                # Programa directo para el mes vigente
+                records.append(_make_record(
+                    sku, target_date, 'consumo', prog_qty,
+                    'PROGRAMA', 'programa', 0, 0, abc, xyz, run_ts
+                ))
+                stats['PROGRAMA'] += 1
+            elif has_hist_consumo:
+                # Pronóstico basado en histórico (no hay plan de consumo más allá del programa)
+                records.append(_make_record(
+                    sku, target_date, 'consumo', adu_hist_consumo,
+                    method, 'historico', 0, 1.0, abc, xyz, run_ts
+                ))
+                stats[method] += 1
+
+    # --- PRONÓSTICO DE VENTA ---
+    hist_venta = inputs['consumo_mensual_map'].get(sku, {}).get('venta', [])
+    hist_venta_vals = [v for _, v in hist_venta]
+    plan_venta = inputs['demanda_map'].get(sku, [])
+
+    adu_hist_venta = calculate_historical_adu(method, hist_venta_vals, diario_consumo, params)
+    has_hist_venta = adu_hist_venta > 0
+    has_plan_venta = len(plan_venta) > 0
+
+    if has_hist_venta or has_plan_venta:
+        for day_offset in day_offsets:
+            target_date = today + timedelta(days=day_offset)
+            target_month_start = target_date.replace(day=1)
+
+            # Buscar plan mensual para este mes
+            plan_qty = sum(q for m, q in plan_venta if m == target_month_start)
+            adu_plan = calculate_plan_daily(plan_qty, target_month_start, factor) if plan_qty > 0 else 0
+
+            # Determinar pesos reales
+            if has_hist_venta and has_plan_venta and adu_plan > 0:
+                # Mezcla híbrida
+                final_adu = (adu_plan * peso_plan) + (adu_hist_venta * peso_hist)
+                metodo = f'{method}+PLAN'
+                fuente = 'hibrido'
+                w_plan = peso_plan
+                w_hist = peso_hist
+                stats['HIBRIDO'] += 1
+            elif has_plan_venta and adu_plan > 0:
+                # Solo plan (sin histórico)
+                final_adu = adu_plan
+                metodo = 'PLAN_DIRECTO'
+                fuente = 'plan'
+                w_plan = 1.0
+                w_hist = 0.0
+                stats['PLAN_DIRECTO'] += 1
+            else:
+                # Solo histórico (sin plan)
+                final_adu = adu_hist_venta
+                metodo = method
+                fuente = 'historico'
+                w_plan = 0.0
+                w_hist = 1.0
+                stats[method] += 1
+
+            if final_adu > 0:
+                records.append(_make_record(
+                    sku, target_date, 'venta', final_adu,
+                    metodo, fuente, w_plan, w_hist, abc, xyz, run_ts
+                ))
+
+    # --- PRONÓSTICO DE PRODUCCIÓN ---
+    programa_produccion = inputs['programa_prod_map'].get(sku, [])
+    hist_prod_vals = inputs['produccion_mensual_map'].get(sku, [])
+
+    adu_hist_prod = calculate_wma(hist_prod_vals) if hist_prod_vals else 0
+    has_hist_prod = adu_hist_prod > 0
+    has_programa_prod = len(programa_produccion) > 0
+
+    if has_hist_prod or has_programa_prod:
+        for day_offset in day_offsets:
+            target_date = today + timedelta(days=day_offset)
+            target_str = target_date.strftime('%Y-%m-%d')
+
+            # ¿Hay programa de producción para esta fecha?
+            prog_qty = sum(q for f, q in programa_produccion if f == target_str)
+            if prog_qty > 0:
+                records.append(_make_record(
+                    sku, target_date, 'produccion', prog_qty,
+                    'PROGRAMA', 'programa', 0, 0, abc, xyz, run_ts
+                ))
+                stats['PROGRAMA'] += 1
+            elif has_hist_prod:
+                records.append(_make_record(
+                    sku, target_date, 'produccion', adu_hist_prod,
+                    'WMA', 'historico', 0, 1.0, abc, xyz, run_ts
+                ))
+                stats['WMA'] += 1
+
+    return records
+
+
+def _empty_stats():
+    return {'WMA': 0, 'SES': 0, 'CROSTON': 0, 'PLAN_DIRECTO': 0, 'PROGRAMA': 0, 'HIBRIDO': 0}
+
+
+def _slice_inputs(inputs, skus):
+    """Extrae de los mapas de entrada solo las claves de los SKUs indicados."""
+    sliced = {}
+    for key in INPUT_MAP_KEYS:
+        source = inputs[key]
+        sliced[key] = {sku: source[sku] for sku in skus if sku in source}
+    sliced['skus'] = list(skus)
+    return sliced
+
+
+def _forecast_shard(shard_inputs, shard_plan, today, run_ts):
+    """
+    Trabajo de un proceso del pool: pronostica un bloque contiguo de SKUs.
+    Recibe solo la porción de mapas de su bloque, nunca los mapas completos.
+    """
+    stats = _empty_stats()
+    records = []
+    for sku, day_offsets in shard_plan:
+        records.extend(forecast_sku(sku, shard_inputs, today, stats, day_offsets, run_ts))
+    return records, stats
+
+
+def _shard_plan(plan_items):
+    """Divide la lista ordenada de SKUs en bloques contiguos de tamaño fijo."""
+    return [plan_items[i:i + SHARD_SKUS] for i in range(0, len(plan_items), SHARD_SKUS)]
+
+
+def iter_forecast_blocks(inputs, plan=None, workers=None, stats=None, today=None, run_ts=None):
+    """
+    Generador de pronósticos: produce bloques de registros en orden de SKU
+    (un bloque por SKU en modo de un proceso, uno por bloque de SKUs en modo paralelo).
+    plan: dict opcional sku → desplazamientos de día a calcular (ejecución incremental);
+          si es None se calcula el horizonte completo de todos los SKUs.
+    workers: número de procesos (por defecto FORECAST_WORKERS). Con más de uno, los SKUs
+             se reparten en bloques entre un pool de procesos con a lo sumo 2 bloques en
+             vuelo por proceso; el resultado es idéntico al modo de un solo proceso.
+    stats: dict donde se acumula la distribución por método.
+    """
+    today = today or datetime.now().date()
+    run_ts = run_ts or datetime.now().isoformat()
+    if workers is None:
+        workers = FORECAST_WORKERS
+    if stats is None:
+        stats = _empty_stats()
+    if plan is None:
+        plan = {sku: None for sku in inputs['skus']}
+
+    plan_items = [(sku, plan[sku]) for sku in sorted(plan)]
+
+    if workers > 1 and len(plan_items) >= MIN_SKUS_FOR_POOL:
+        shards = _shard_plan(plan_items)
+        logging.info(f"  Modo paralelo: {workers} procesos, {len(shards)} bloques")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for shard in shards:
+                pending.append(executor.submit(
+                    _forecast_shard, _slice_inputs(inputs, [sku for sku, _ in shard]), shard, today, run_ts
+                ))
+                if len(pending) < workers * 2:
+                    continue
+                # Entregar en el orden de envío = orden de SKU (determinista)
+                shard_records, shard_stats = pending.popleft().result()
+                for k, v in shard_stats.items():
+                    stats[k] += v
+                yield shard_records
+            while pending:
+                shard_records, shard_stats = pending.popleft().result()
+                for k, v in shard_stats.items():
+                    stats[k] += v
+                yield shard_records
+    else:
+        for sku, day_offsets in plan_items:
+            yield forecast_sku(sku, inputs, today, stats, day_offsets, run_ts)
+
+
+def generate_forecasts(data, plan=None, inputs=None, workers=None):
+    """
+    Genera pronósticos diarios para todos los SKUs (ver iter_forecast_blocks).
+    Retorna una lista de registros listos para insertar en sap_pronostico_diario.
+    """
+    logging.info("Generando pronósticos...")
+
+    if inputs is None:
+        inputs = build_forecast_inputs(data)
+
+    logging.info(f"  SKUs candidatos: {len(inputs['skus'])}")
+    if plan is not None:
+        logging.info(f"  SKUs a recalcular: {len(plan)}")
 
     # --- Generar pronósticos por SKU ---
     forecast_records = []
-    stats = {'WMA': 0, 'SES': 0, 'CROSTON': 0, 'PLAN_DIRECTO': 0, 'PROGRAMA': 0, 'HIBRIDO': 0}
-
-    for sku in all_skus:
-        seg = seg_map.get(sku, {'abc': None, 'xyz': None, 'factor': 1.0, 'adu_actual': 0})
-        abc = seg['abc']
-        xyz = seg['xyz']
-        factor = seg['factor']
-        peso_plan, peso_hist, method = get_segment_config(abc, xyz)
-
-        # --- PRONÓSTICO DE CONSUMO ---
-        hist_consumo = consumo_mensual_map.get(sku, {}).get('consumo', [])
-        hist_consumo_vals = [v for _, v in hist_consumo]
-        diario_consumo = consumo_diario_map.get(sku, [])
-        programa_consumo = programa_cons_map.get(sku, [])
-
-        adu_hist_consumo = calculate_historical_adu(method, hist_consumo_vals, diario_consumo)
-        has_hist_consumo = adu_hist_consumo > 0
-
-        # Plan como consumo del programa de producción
-        has_programa_consumo = len(programa_consumo) > 0
-
-        if has_hist_consumo or has_programa_consumo:
-            for day_offset in range(HORIZON_DAYS):
-                target_date = today + timedelta(days=day_offset)
-                target_str = target_date.strftime('%Y-%m-%d')
-
-                # ¿Hay programa de producción para esta fecha?
-                prog_qty = sum(q for f, q in programa_consumo if f == target_str)
-                if prog_qty > 0:
-                    # Programa directo para el mes vigente
-                    forecast_records.append(_make_record(
-                        sku, target_date, 'consumo', prog_qty,
-                        'PROGRAMA', 'programa', 0, 0, abc, xyz
-                    ))
-                    stats['PROGRAMA'] += 1
-                elif has_hist_consumo:
-                    # Pronóstico basado en histórico (no hay plan de consumo más allá del programa)
-                    forecast_records.append(_make_record(
-                        sku, target_date, 'consumo', adu_hist_consumo,
-                        method, 'historico', 0, 1.0, abc, xyz
-                    ))
-                    stats[method] += 1
-
-        # --- PRONÓSTICO DE VENTA ---
-        hist_venta = consumo_mensual_map.get(sku, {}).get('venta', [])
-        hist_venta_vals = [v for _, v in hist_venta]
-        plan_venta = demanda_map.get(sku, [])
-
-        adu_hist_venta = calculate_historical_adu(method, hist_venta_vals, diario_consumo)
-        has_hist_venta = adu_hist_venta > 0
-        has_plan_venta = len(plan_venta) > 0
-
-        if has_hist_venta or has_plan_venta:
-            for day_offset in range(HORIZON_DAYS):
-                target_date = today + timedelta(days=day_offset)
-                target_month_start = target_date.replace(day=1)
-
-                # Buscar plan mensual para este mes
-                plan_qty = sum(q for m, q in plan_venta if m == target_month_start)
-                adu_plan = calculate_plan_daily(plan_qty, target_month_start, factor) if plan_qty > 0 else 0
-
-                # Determinar pesos reales
-                if has_hist_venta and has_plan_venta and adu_plan > 0:
-                    # Mezcla híbrida
-                    final_adu = (adu_plan * peso_plan) + (adu_hist_venta * peso_hist)
-                    metodo = f'{method}+PLAN'
-                    fuente = 'hibrido'
-                    w_plan = peso_plan
-                    w_hist = peso_hist
-                    stats['HIBRIDO'] += 1
-                elif has_plan_venta and adu_plan > 0:
-                    # Solo plan (sin histórico)
-                    final_adu = adu_plan
-                    metodo = 'PLAN_DIRECTO'
-                    fuente = 'plan'
-                    w_plan = 1.0
-                    w_hist = 0.0
-                    stats['PLAN_DIRECTO'] += 1
-                else:
-                    # Solo histórico (sin plan)
-                    final_adu = adu_hist_venta
-                    metodo = method
-                    fuente = 'historico'
-                    w_plan = 0.0
-                    w_hist = 1.0
-                    stats[method] += 1
-
-                if final_adu > 0:
-                    forecast_records.append(_make_record(
-                        sku, target_date, 'venta', final_adu,
-                        metodo, fuente, w_plan, w_hist, abc, xyz
-                    ))
-
-        # --- PRONÓSTICO DE PRODUCCIÓN ---
-        programa_produccion = programa_prod_map.get(sku, [])
-        hist_prod_vals = produccion_mensual_map.get(sku, [])
-
-        adu_hist_prod = calculate_wma(hist_prod_vals) if hist_prod_vals else 0
-        has_hist_prod = adu_hist_prod > 0
-        has_programa_prod = len(programa_produccion) > 0
-
-        if has_hist_prod or has_programa_prod:
-            for day_offset in range(HORIZON_DAYS):
-                target_date = today + timedelta(days=day_offset)
-                target_str = target_date.strftime('%Y-%m-%d')
-
-                # ¿Hay programa de producción para esta fecha?
-                prog_qty = sum(q for f, q in programa_produccion if f == target_str)
-                if prog_qty > 0:
-                    forecast_records.append(_make_record(
-                        sku, target_date, 'produccion', prog_qty,
-                        'PROGRAMA', 'programa', 0, 0, abc, xyz
-                    ))
-                    stats['PROGRAMA'] += 1
-                elif has_hist_prod:
-                    forecast_records.append(_make_record(
-                        sku, target_date, 'produccion', adu_hist_prod,
-                        'WMA', 'historico', 0, 1.0, abc, xyz
-                    ))
-                    stats['WMA'] += 1
+    stats = _empty_stats()
+    for block in iter_forecast_blocks(inputs, plan, workers, stats):
+        forecast_records.extend(block)
 
     logging.info(f"  Total registros generados: {len(forecast_records)}")
     logging.info(f"  Distribución por método: {stats}")
@@ -596,7 +799,7 @@ def generate_forecasts(data):
     return forecast_records
 
 
-def _make_record(sku_id, fecha, tipo, cantidad, metodo, fuente, w_plan, w_hist, abc, xyz):
+def _make_record(sku_id, fecha, tipo, cantidad, metodo, fuente, w_plan, w_hist, abc, xyz, updated_at=None):
     """Crea un diccionario de registro listo para inserción."""
     return {
         'sku_id': sku_id,
@@ -609,7 +812,7 @@ def _make_record(sku_id, fecha, tipo, cantidad, metodo, fuente, w_plan, w_hist,
         'peso_historico': round(safe_float(w_hist), 2),
         'abc_segment': str(abc) if abc and str(abc) != 'None' else None,
         'xyz_segment': str(xyz) if xyz and str(xyz) != 'None' else None,
-        'updated_at': datetime.now().isoformat(),
+        'updated_at': updated_at or datetime.now().isoformat(),
     }
 
 
@@ -617,6 +820,46 @@ def _make_record(sku_id, fecha, tipo, cantidad, metodo, fuente, w_plan, w_hist,
 # PERSISTENCIA EN SUPABASE
 # =============================================================================
 
+def _delete_forecast_rows(params, label):
+    """Borra filas de sap_pronostico_diario que cumplan el filtro PostgREST indicado."""
+    try:
+        if not get_source().delete('sap_pronostico_diario', params):
+            logging.warning(f"{label} no se completó.")
+            return False
+        return True
+    except Exception as e:
+        logging.error(f"Error en {label}: {e}")
+        return False
+
+
+def _post_batch(batch, offset):
+    """Sanitiza e inserta un lote. Retorna el número de filas insertadas (0 si falla)."""
+    # Sanitizar batch: reemplazar cualquier NaN/Inf residual
+    for rec in batch:
+        for k, v in rec.items():
+            if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
+                rec[k] = 0.0
+    try:
+        get_source().insert('sap_pronostico_diario', batch)
+        return len(batch)
+    except Exception as e:
+        err_msg = str(e)
+        if hasattr(e, 'response') and e.response is not None:
+            err_msg += f" Response: {e.response.text[:300]}"
+        logging.error(f"Error insertando batch {offset}: {err_msg}")
+        return 0
+
+
+def _insert_batches(records):
+    """Inserta los registros por lotes. Retorna el número de filas insertadas."""
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        total_inserted += _post_batch(records[i:i + BATCH_SIZE], i)
+        if (i // BATCH_SIZE) % 10 == 0:
+            logging.info(f"  Insertado batch {i // BATCH_SIZE + 1} ({total_inserted}/{len(records)})")
+    return total_inserted
+
+
 def persist_forecasts(records):
     """Trunca la tabla sap_pronostico_diario e inserta los nuevos pronósticos."""
     if not records:
@@ -626,47 +869,120 @@ def persist_forecasts(records):
     logging.info(f"Persistiendo {len(records)} pronósticos en Supabase...")
 
     # 1. Truncar tabla existente
-    try:
-        headers = get_headers()
-        del_url = f"{SUPABASE_URL}/rest/v1/sap_pronostico_diario"
-        resp = requests.delete(del_url, headers=headers, params={"sku_id": "not.is.null"})
-        if resp.status_code not in (200, 204):
-            logging.warning(f"Truncate retornó {resp.status_code}: {resp.text[:200]}")
-        else:
-            logging.info("  Tabla truncada exitosamente.")
-    except Exception as e:
-        logging.error(f"Error truncando tabla: {e}")
+    if _delete_forecast_rows({"sku_id": "not.is.null"}, "Truncate"):
+        logging.info("  Tabla truncada exitosamente.")
 
     # 2. Insertar por lotes
-    total_inserted = 0
-    for i in range(0, len(records), BATCH_SIZE):
-        batch = records[i:i + BATCH_SIZE]
-        # Sanitizar batch: reemplazar cualquier NaN/Inf residual
-        for rec in batch:
-            for k, v in rec.items():
-                if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
-                    rec[k] = 0.0
-        try:
-            post_to_supabase('sap_pronostico_diario', batch)
-            total_inserted += len(batch)
-            if (i // BATCH_SIZE) % 10 == 0:
-                logging.info(f"  Insertado batch {i // BATCH_SIZE + 1} ({total_inserted}/{len(records)})")
-        except Exception as e:
-            err_msg = str(e)
-            if hasattr(e, 'response') and e.response is not None:
-                err_msg += f" Response: {e.response.text[:300]}"
-            logging.error(f"Error insertando batch {i}: {err_msg}")
+    total_inserted = _insert_batches(records)
 
     logging.info(f"  Persistencia completada: {total_inserted}/{len(records)} registros.")
     return total_inserted
 
 
+def delete_stale_forecasts(replace_skus, today):
+    """
+    Prepara la tabla para una corrida incremental: elimina los días ya vencidos
+    y las filas de los SKUs recalculados (o retirados). Retorna True si todo salió bien.
+    """
+    logging.info(f"Persistencia incremental: {len(replace_skus)} SKUs a reemplazar...")
+    ok = _delete_forecast_rows({"fecha": f"lt.{today.strftime('%Y-%m-%d')}"}, "Borrado de días vencidos")
+
+    replace_skus = sorted(replace_skus)
+    for i in range(0, len(replace_skus), SKU_DELETE_CHUNK):
+        chunk = replace_skus[i:i + SKU_DELETE_CHUNK]
+        quoted = ','.join('"' + s.replace('"', '') + '"' for s in chunk)
+        ok = _delete_forecast_rows({"sku_id": f"in.({quoted})"}, "Borrado de SKUs recalculados") and ok
+    return ok
+
+
+def stream_persist_forecasts(blocks):
+    """
+    Consume un generador de bloques de registros y los sube mientras se siguen calculando.
+    Los bloques pasan por una cola acotada (STREAM_QUEUE_BLOCKS): si la red va más lenta
+    que el cálculo, el generador se detiene hasta que el uploader libere espacio, así que
+    la memoria no depende del tamaño del catálogo.
+    Retorna (registros generados, registros insertados).
+    """
+    block_queue = queue.Queue(maxsize=STREAM_QUEUE_BLOCKS)
+    totals = {'generated': 0, 'inserted': 0}
+
+    def uploader():
+        pending = []
+        offset = 0
+        while True:
+            block = block_queue.get()
+            if block is None:
+                break
+            pending.extend(block)
+            while len(pending) >= BATCH_SIZE:
+                totals['inserted'] += _post_batch(pending[:BATCH_SIZE], offset)
+                pending = pending[BATCH_SIZE:]
+                offset += BATCH_SIZE
+                if (offset // BATCH_SIZE) % 10 == 0:
+                    logging.info(f"  Insertados {totals['inserted']} registros...")
+        if pending:
+            totals['inserted'] += _post_batch(pending, offset)
+
+    thread = threading.Thread(target=uploader, name='forecast-uploader', daemon=True)
+    thread.start()
+    try:
+        for block in blocks:
+            if block:
+                totals['generated'] += len(block)
+                block_queue.put(block)
+    finally:
+        # Siempre cerrar la cola para que el uploader termine aunque el cálculo falle
+        block_queue.put(None)
+        thread.join()
+
+    logging.info(f"  Persistencia completada: {totals['inserted']}/{totals['generated']} registros.")
+    return totals['generated'], totals['inserted']
+
+
+# =============================================================================
+# EJECUCIÓN INCREMENTAL (HUELLAS POR SKU)
+# =============================================================================
+
+def plan_incremental_run(fingerprints, previous, today):
+    """
+    Compara las huellas actuales con las de la última ejecución.
+    Retorna (plan, replace_skus):
+      plan: sku → None (horizonte completo) o range de días nuevos del horizonte
+      replace_skus: SKUs cuyas filas existentes deben eliminarse antes de insertar
+    """
+    plan = {}
+    replace_skus = set()
+    for sku, fp in fingerprints.items():
+        prev = previous.get(sku)
+        if prev is None or prev[0] != fp:
+            plan[sku] = None
+            replace_skus.add(sku)
+            continue
+        elapsed = (today - date.fromisoformat(prev[1])).days
+        if elapsed < 0:
+            plan[sku] = None
+            replace_skus.add(sku)
+        elif elapsed > 0:
+            # Entradas iguales: las filas ya guardadas siguen siendo válidas,
+            # solo faltan los días que se sumaron al final del horizonte.
+            plan[sku] = range(max(0, HORIZON_DAYS - elapsed), HORIZON_DAYS)
+
+    # SKUs que dejaron de ser candidatos: sus filas deben desaparecer
+    replace_skus.update(s for s in previous if s not in fingerprints)
+    return plan, replace_skus
+
+
 # =============================================================================
 # PUNTO DE ENTRADA
 # =============================================================================
 
-def run_forecast():
-    """Función principal: descarga datos, genera pronósticos y persiste."""
+def run_forecast(full=False, workers=None):
+    """
+    Función principal: descarga datos, genera pronósticos y persiste.
+    Por defecto solo recalcula los SKUs cuyas entradas cambiaron desde la última
+    ejecución (o cuyo horizonte avanzó); full=True regenera todo el catálogo.
+    workers: procesos para el cálculo por SKU (por defecto FORECAST_WORKERS).
+    """
     logging.info("=" * 60)
     logging.info("  MOTOR DE PRONÓSTICOS HÍBRIDO — Inicio")
     logging.info("=" * 60)
@@ -676,14 +992,70 @@ def run_forecast():
     try:
         # 1. Descargar datos fuente
         data = fetch_source_data()
+        inputs = build_forecast_inputs(data)
+        today = datetime.now().date()
+        fingerprints = {sku: sku_fingerprint(sku, inputs) for sku in inputs['skus']}
+
+        previous = {} if full else (state_store.load_json(FINGERPRINT_STATE, {}) or {}).get('skus', {})
+        cached = None if full else state_store.load_object(FORECAST_CACHE_STATE)
+        if previous and cached is None:
+            # Sin el pronóstico vigente en caché no se pueden recalcular los rollups
+            logging.info("  Sin caché de pronóstico: se fuerza corrida completa.")
+            previous = {}
+
+        stats = _empty_stats()
+        replace_skus = set()
+        if not previous:
+            # 2. Ejecución completa: vaciar la tabla y regenerar todo
+            logging.info("  Modo: completo")
+            plan = None
+            ok = _delete_forecast_rows({"sku_id": "not.is.null"}, "Truncate")
+        else:
+            # 2. Ejecución incremental: quitar solo lo que se va a reemplazar
+            plan, replace_skus = plan_incremental_run(fingerprints, previous, today)
+            logging.info(
+                f"  Modo: incremental — {sum(1 for v in plan.values() if v is None)} SKUs con cambios, "
+                f"{sum(1 for v in plan.values() if v is not None)} con horizonte desplazado, "
+                f"{len(fingerprints) - len(plan)} sin cambios"
+            )
+            ok = delete_stale_forecasts(replace_skus, today)
+
+        # 3. Generar y persistir en paralelo (cálculo y subida se solapan)
+        logging.info(f"Generando y persistiendo pronósticos ({len(inputs['skus'])} SKUs candidatos)...")
+        # Cada bloque suma a los rollups y se escribe al spool de la caché; no queda en memoria
+        collector = forecast_rollups.ForecastCollector(state_store.state_path(FORECAST_SPOOL_STATE))
+        try:
+            blocks = collector.wrap(iter_forecast_blocks(inputs, plan, workers, stats, today))
+            generated, total = stream_persist_forecasts(blocks)
+        finally:
+            collector.close()
+        logging.info(f"  Distribución por método: {stats}")
+        ok = ok and total == generated
+
+        # 4. Rollups semana/mes × jerarquía/grupo/país: sumas del streaming + lo vigente de la caché
+        kept = forecast_rollups.kept_forecast(cached if plan is not None else None, replace_skus, today)
+        per_sku = forecast_rollups.combine_sums([forecast_rollups.sku_period_sums(kept), collector.sums()])
+        try:
+            rollup_rows = forecast_rollups.publish_rollups(per_sku)
+            log_sync_result(table_name=forecast_rollups.ROLLUP_TABLE, rows_upserted=rollup_rows, status="success")
+        except Exception as e:
+            logging.error(f"Error publicando rollups: {e}")
+            log_sync_result(table_name=forecast_rollups.ROLLUP_TABLE, rows_upserted=0, status="error", error_msg=str(e))
+
+        # Guardar huellas solo si la tabla quedó consistente; si no, la próxima corrida será completa
+        if ok:
+            state_store.save_json(FINGERPRINT_STATE, {
+                'skus': {sku: [fp, today.isoformat()] for sku, fp in fingerprints.items()},
+            })
+            forecast_df = forecast_rollups.merge_forecast(kept, collector.frame(), (), today)
+            state_store.save_object(FORECAST_CACHE_STATE, forecast_rollups.compact_for_cache(forecast_df))
+        else:
+            logging.warning("  Persistencia parcial: se descartan las huellas para forzar una corrida completa.")
+            state_store.clear(FINGERPRINT_STATE)
+            state_store.clear(FORECAST_CACHE_STATE)
+        state_store.clear(FORECAST_SPOOL_STATE)
 
-        # 2. Generar pronósticos
-        records = generate_forecasts(data)
-
-        # 3. Persistir en Supabase
-        total = persist_forecasts(records)
-
-        # 4. Registrar en sync_status_log
+        # 5. Registrar en sync_status_log
         elapsed = (datetime.now() - start_time).total_seconds()
         log_sync_result(
             table_name="sap_pronostico_diario",
@@ -709,4 +1081,13 @@ def run_forecast():
 
 
 if __name__ == "__main__":
-    run_forecast()
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Motor de Pronósticos Híbrido")
+    parser.add_argument('--full', action='store_true',
+                        help="Regenera todos los SKUs ignorando las huellas de la última ejecución")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Procesos para el cálculo por SKU (por defecto FORECAST_WORKERS o 1)")
+    add_cli_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    run_forecast(full=args.full, workers=args.workers)
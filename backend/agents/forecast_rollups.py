@@ -0,0 +1,274 @@
+"""
+forecast_rollups.py
+Agregados del pronóstico diario para los tableros: semana/mes × (jerarquía nivel 1,
+grupo de artículos, país) × tipo. Se arman durante el streaming del Motor de
+Pronósticos con sumas corrientes por SKU × tipo × semana × mes (cada bloque se suma
+y se suelta) y se publican en sap_pronostico_rollup, así los gráficos agregados leen
+unos cientos de filas en lugar de recorrer sap_pronostico_diario.
+"""
+
+import os
+import sys
+import pickle
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from modules.data_source import get_source
+from modules.sku_codes import get_code_table
+
+ROLLUP_TABLE = 'sap_pronostico_rollup'
+ROLLUP_PERIODS = ('semana', 'mes')
+# dimensión publicada → columna de sap_maestro_articulos
+ROLLUP_DIMENSIONS = {
+    'jerarquia_nivel_1': 'jerarquia_nivel_1',
+    'grupo_articulos': 'grupo_articulos_descripcion',
+    'pais': 'pais',
+}
+UNCLASSIFIED = 'Sin clasificar'
+BATCH_SIZE = 1000
+SUM_KEYS = ['sku_id', 'tipo', 'semana', 'mes']
+CONSOLIDATE_BLOCKS = 20  # Bloques sumados antes de consolidar las sumas corrientes
+
+
+class ForecastCollector:
+    """
+    Recorre los bloques del streaming del motor sin retener el pronóstico: cada bloque
+    se colapsa a sumas por SKU × tipo × semana × mes que se consolidan con las anteriores
+    y, si se da `spool_path`, se escribe compacto a disco para armar la caché al final.
+    """
+
+    def __init__(self, spool_path=None):
+        self._sums = empty_sums_frame()
+        self._pending = []
+        self.rows = 0
+        self.spool_path = spool_path
+        self._spool = open(spool_path, 'wb') if spool_path else None
+
+    def _consolidate(self):
+        if self._pending:
+            self._sums = combine_sums([self._sums] + self._pending)
+            self._pending = []
+
+    def add(self, block):
+        frame = block_frame(block)
+        self.rows += len(frame)
+        self._pending.append(sku_period_sums(frame))
+        if self._spool is not None:
+            pickle.dump(compact_for_cache(frame), self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(self._pending) >= CONSOLIDATE_BLOCKS:
+            self._consolidate()
+
+    def wrap(self, blocks):
+        """Deja pasar los bloques del generador sumando cada uno."""
+        for block in blocks:
+            if block:
+                self.add(block)
+            yield block
+
+    def sums(self):
+        self._consolidate()
+        return self._sums
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def frame(self):
+        """Pronóstico generado, leído del spool (vacío si no hubo spool)."""
+        self.close()
+        return read_spool(self.spool_path) if self.spool_path else empty_forecast_frame()
+
+
+def block_frame(block):
+    """Registros de un bloque (sku_id, fecha, tipo, cantidad_pronosticada) en columnas tipadas."""
+    if not block:
+        return empty_forecast_frame()
+    return pd.DataFrame({
+        'sku_id': [r['sku_id'] for r in block],
+        'fecha': pd.to_datetime([r['fecha'] for r in block], format='%Y-%m-%d'),
+        'tipo': [r['tipo'] for r in block],
+        'cantidad': pd.Series([r['cantidad_pronosticada'] for r in block], dtype='float64'),
+    })
+
+
+def read_spool(path):
+    """Concatena los bloques escritos por ForecastCollector."""
+    frames = []
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))
+                except EOFError:
+                    break
+    if not frames:
+        return empty_forecast_frame()
+    return pd.concat(frames, ignore_index=True).astype({'sku_id': 'object', 'tipo': 'object'})
+
+
+def empty_forecast_frame():
+    return pd.DataFrame({
+        'sku_id': pd.Series(dtype='object'),
+        'fecha': pd.Series(dtype='datetime64[ns]'),
+        'tipo': pd.Series(dtype='object'),
+        'cantidad': pd.Series(dtype='float64'),
+    })
+
+
+def empty_sums_frame():
+    return pd.DataFrame({
+        'sku_id': pd.Series(dtype='object'),
+        'tipo': pd.Series(dtype='object'),
+        'semana': pd.Series(dtype='datetime64[ns]'),
+        'mes': pd.Series(dtype='datetime64[ns]'),
+        'cantidad': pd.Series(dtype='float64'),
+    })
+
+
+def sku_period_sums(df_forecast):
+    """Colapsa los días del pronóstico a SKU × tipo × semana (lunes) × mes."""
+    if df_forecast.empty:
+        return empty_sums_frame()
+    fecha = df_forecast['fecha']
+    return (
+        df_forecast.assign(
+            semana=fecha - pd.to_timedelta(fecha.dt.weekday, unit='D'),
+            mes=fecha.dt.to_period('M').dt.to_timestamp(),
+        )
+        .astype({'sku_id': 'object', 'tipo': 'object'})
+        .groupby(SUM_KEYS, sort=False)['cantidad']
+        .sum()
+        .reset_index()
+    )
+
+
+def combine_sums(parts):
+    """Suma por clave varias tablas de sku_period_sums."""
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return empty_sums_frame()
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts, ignore_index=True).groupby(SUM_KEYS, sort=False)['cantidad'].sum().reset_index()
+
+
+def kept_forecast(cached, replace_skus, today):
+    """
+    Parte del pronóstico en caché que sigue vigente tras una corrida incremental: sin los
+    días vencidos ni los SKUs reemplazados. Sin caché (corrida completa) es vacía.
+    """
+    if cached is None or cached.empty:
+        return empty_forecast_frame()
+    keep = (cached['fecha'] >= pd.Timestamp(today)) & ~cached['sku_id'].isin(list(replace_skus))
+    return cached[keep].astype({'sku_id': 'object', 'tipo': 'object'}).reset_index(drop=True)
+
+
+def merge_forecast(cached, generated, replace_skus, today):
+    """
+    Reproduce sobre el pronóstico en memoria lo que la corrida incremental hizo en la tabla:
+    quita los días vencidos y los SKUs reemplazados, y agrega lo recién generado.
+    Sin caché (corrida completa) el resultado es lo generado.
+    """
+    kept = kept_forecast(cached, replace_skus, today)
+    if kept.empty:
+        return generated.reset_index(drop=True)
+    return pd.concat([kept, generated], ignore_index=True)
+
+
+def compact_for_cache(df_forecast):
+    """Categorías en las columnas repetitivas: el pickle del pronóstico ocupa ~4x menos."""
+    return df_forecast.astype({'sku_id': 'category', 'tipo': 'category'})
+
+
+def build_rollups(per_sku, df_maestro, updated_at=None):
+    """
+    Retorna el DataFrame de sap_pronostico_rollup a partir de las sumas por SKU × tipo ×
+    semana × mes (sku_period_sums / ForecastCollector.sums). Apila las seis vistas
+    (2 periodos × 3 dimensiones) y resuelve todas con un único groupby.
+    """
+    columns = ['periodo', 'periodo_inicio', 'dimension', 'valor', 'tipo',
+               'cantidad_pronosticada', 'skus', 'updated_at']
+    if per_sku.empty:
+        return pd.DataFrame(columns=columns)
+
+    per_sku = per_sku.copy()
+    # Cruce con el maestro por código entero de SKU (tabla compartida), no por texto
+    codes = get_code_table()
+    per_sku['sku_code'] = codes.encode(per_sku['sku_id'])
+    per_sku['tipo'] = per_sku['tipo'].astype(str)
+
+    attrs = pd.DataFrame({'sku_code': pd.Series(dtype='int32')})
+    if df_maestro is not None and not df_maestro.empty:
+        attrs = df_maestro.assign(sku_code=codes.encode(df_maestro['codigo']))
+        attrs = attrs[attrs['sku_code'] >= 0].drop_duplicates('sku_code')
+    codes.save()
+    source_cols = [c for c in ROLLUP_DIMENSIONS.values() if c in attrs.columns]
+    per_sku = per_sku.merge(attrs[['sku_code'] + source_cols], on='sku_code', how='left')
+    for col in ROLLUP_DIMENSIONS.values():
+        if col not in per_sku.columns:
+            per_sku[col] = UNCLASSIFIED
+        values = per_sku[col].astype('object').where(per_sku[col].notna(), '').astype(str).str.strip()
+        per_sku[col] = values.mask(values == '', UNCLASSIFIED)
+
+    views = [
+        pd.DataFrame({
+            'periodo': periodo,
+            'periodo_inicio': per_sku[periodo],
+            'dimension': dimension,
+            'valor': per_sku[col],
+            'tipo': per_sku['tipo'],
+            'sku_code': per_sku['sku_code'],
+            'cantidad': per_sku['cantidad'],
+        })
+        for periodo in ROLLUP_PERIODS
+        for dimension, col in ROLLUP_DIMENSIONS.items()
+    ]
+    rollup = (
+        pd.concat(views, ignore_index=True)
+        .groupby(['periodo', 'periodo_inicio', 'dimension', 'valor', 'tipo'], sort=True)
+        .agg(cantidad_pronosticada=('cantidad', 'sum'), skus=('sku_code', 'nunique'))
+        .reset_index()
+    )
+    rollup['periodo_inicio'] = rollup['periodo_inicio'].dt.strftime('%Y-%m-%d')
+    rollup['cantidad_pronosticada'] = rollup['cantidad_pronosticada'].round(6)
+    rollup['skus'] = rollup['skus'].astype(int)
+    rollup['updated_at'] = updated_at or datetime.now().isoformat()
+    return rollup[columns]
+
+
+def persist_rollups(rollup):
+    """Reemplaza el contenido de sap_pronostico_rollup. Retorna las filas insertadas."""
+    try:
+        get_source().delete(ROLLUP_TABLE, {"periodo": "not.is.null"})
+    except Exception as e:
+        logging.error(f"Error truncando {ROLLUP_TABLE}: {e}")
+
+    records = rollup.to_dict(orient='records')
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert(ROLLUP_TABLE, batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch de rollups {i}: {e}")
+    return total_inserted
+
+
+def publish_rollups(per_sku, updated_at=None):
+    """Descarga los atributos del maestro, calcula los agregados y los publica."""
+    df_maestro = get_source().fetch(
+        'sap_maestro_articulos', select='codigo,' + ','.join(ROLLUP_DIMENSIONS.values())
+    )
+    rollup = build_rollups(per_sku, df_maestro, updated_at)
+    total = persist_rollups(rollup)
+    logging.info(f"  Rollups publicados: {total}/{len(rollup)} filas "
+                 f"(desde {len(per_sku)} sumas SKU × tipo × semana × mes)")
+    return total
@@ -0,0 +1,196 @@
+"""
+forecast_tuner.py
+Ajuste nocturno de los parámetros de suavización por SKU.
+Evalúa una grilla de alphas para SES y Croston sobre todos los SKUs a la vez
+(matriz SKU × paso × alpha) con el error cuadrático de un paso adelante, y guarda
+el mejor alpha de cada SKU en sap_parametros_pronostico, de donde lo toma el
+Motor de Pronósticos (calculate_ses / calculate_croston).
+
+Ejecución: py -3 backend/agents/forecast_tuner.py [--fixtures DIR] [--output-dir DIR]
+"""
+
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- Path setup ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import canonical_sku, stored_sku
+from sync_logger import log_sync_result
+import forecast_engine as fe
+
+ALPHA_GRID = np.round(np.arange(0.05, 0.55, 0.05), 2)
+MIN_OBSERVATIONS = 10   # SKUs con menos observaciones conservan los alphas globales
+HISTORY_DAYS = 90       # Misma ventana diaria que usa el motor
+BATCH_SIZE = 1000
+
+
+def build_sequence_matrix(df):
+    """
+    Arma la matriz SKU × posición con la misma secuencia que ve el motor
+    (registros de sap_consumo_diario_clean ordenados por fecha), alineada a la izquierda.
+    Retorna (skus, valores, longitudes).
+    """
+    df = df.copy()
+    # Forma guardada: sap_parametros_pronostico conserva el código como viene (el motor cruza por canónico)
+    df['sku_id'] = stored_sku(df['sku_id']).mask(canonical_sku(df['sku_id']) == '', '')
+    df['cantidad_limpia'] = pd.to_numeric(df['cantidad_limpia'], errors='coerce').fillna(0.0)
+    df = df[df['sku_id'] != ''].sort_values(['sku_id', 'fecha'], kind='mergesort')
+
+    codes, skus = pd.factorize(df['sku_id'], sort=True)
+    lengths = np.bincount(codes, minlength=len(skus))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    positions = np.arange(len(df)) - starts[codes]
+
+    values = np.zeros((len(skus), lengths.max() if len(skus) else 0))
+    values[codes, positions] = df['cantidad_limpia'].values
+    return np.asarray(skus), values, lengths
+
+
+def tune_ses(values, lengths, alphas=ALPHA_GRID):
+    """
+    SES vectorizado: una sola recursión sobre las posiciones para todos los SKUs × alphas.
+    Retorna (mse, pronóstico final) con forma (SKUs, alphas).
+    """
+    n_skus, n_steps = values.shape
+    a = alphas[np.newaxis, :]
+    forecast = np.repeat(values[:, :1], len(alphas), axis=1)
+    sse = np.zeros((n_skus, len(alphas)))
+    for t in range(1, n_steps):
+        active = (t < lengths)[:, np.newaxis]
+        actual = values[:, t:t + 1]
+        sse += np.where(active, (actual - forecast) ** 2, 0.0)
+        forecast = np.where(active, a * actual + (1 - a) * forecast, forecast)
+    n_errors = np.maximum(lengths - 1, 1)[:, np.newaxis]
+    return sse / n_errors, np.maximum(forecast, 0.0)
+
+
+def tune_croston(values, lengths, alphas=ALPHA_GRID):
+    """
+    Croston vectorizado (mismas reglas que calculate_croston: tamaño e intervalo
+    inicializados con la primera observación y suavizados con el mismo alpha).
+    El pronóstico de un paso es tamaño/intervalo; antes de tener ambos, el promedio acumulado.
+    Retorna el MSE con forma (SKUs, alphas).
+    """
+    n_skus, n_steps = values.shape
+    n_alphas = len(alphas)
+    a = alphas[np.newaxis, :]
+    size = np.zeros((n_skus, n_alphas))
+    interval = np.ones((n_skus, n_alphas))
+    has_size = np.zeros(n_skus, dtype=bool)
+    has_interval = np.zeros(n_skus, dtype=bool)
+    last_idx = np.full(n_skus, -1)
+    running_sum = np.zeros(n_skus)
+    sse = np.zeros((n_skus, n_alphas))
+
+    for t in range(n_steps):
+        active = t < lengths
+        actual = values[:, t]
+        if t > 0:
+            fallback = (running_sum / t)[:, np.newaxis]
+            ready = (has_size & has_interval)[:, np.newaxis]
+            pred = np.where(ready, size / interval, fallback)
+            sse += np.where(active[:, np.newaxis], (actual[:, np.newaxis] - pred) ** 2, 0.0)
+
+        demand = active & (actual > 0)
+        new_interval = (t - last_idx)[:, np.newaxis].astype(float)
+        upd_interval = (demand & has_size)[:, np.newaxis]
+        interval = np.where(upd_interval & has_interval[:, np.newaxis], a * new_interval + (1 - a) * interval,
+                            np.where(upd_interval, new_interval, interval))
+        has_interval |= demand & has_size
+        size = np.where((demand & has_size)[:, np.newaxis], a * actual[:, np.newaxis] + (1 - a) * size,
+                        np.where(demand[:, np.newaxis], actual[:, np.newaxis], size))
+        has_size |= demand
+        last_idx = np.where(demand, t, last_idx)
+        running_sum += np.where(active, actual, 0.0)
+
+    n_errors = np.maximum(lengths - 1, 1)[:, np.newaxis]
+    return sse / n_errors
+
+
+def tune_parameters(df_diario, alphas=ALPHA_GRID):
+    """Retorna un DataFrame con el mejor alpha SES/Croston por SKU."""
+    skus, values, lengths = build_sequence_matrix(df_diario)
+    if len(skus) == 0:
+        return pd.DataFrame(columns=['sku_id', 'ses_alpha', 'croston_alpha', 'ses_mse', 'croston_mse', 'n_obs'])
+
+    ses_mse, _ = tune_ses(values, lengths, alphas)
+    croston_mse = tune_croston(values, lengths, alphas)
+    best_ses = ses_mse.argmin(axis=1)
+    best_croston = croston_mse.argmin(axis=1)
+    rows = np.arange(len(skus))
+
+    result = pd.DataFrame({
+        'sku_id': skus,
+        'ses_alpha': alphas[best_ses],
+        'croston_alpha': alphas[best_croston],
+        'ses_mse': np.round(ses_mse[rows, best_ses], 6),
+        'croston_mse': np.round(croston_mse[rows, best_croston], 6),
+        'n_obs': lengths,
+    })
+    return result[result['n_obs'] >= MIN_OBSERVATIONS].reset_index(drop=True)
+
+
+def persist_parameters(df_params):
+    """Reemplaza el contenido de sap_parametros_pronostico."""
+    try:
+        get_source().delete('sap_parametros_pronostico', {"sku_id": "not.is.null"})
+    except Exception as e:
+        logging.error(f"Error truncando sap_parametros_pronostico: {e}")
+
+    records = df_params.assign(
+        n_obs=df_params['n_obs'].astype(int),
+        updated_at=datetime.now().isoformat(),
+    ).to_dict(orient='records')
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert('sap_parametros_pronostico', batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch de parámetros {i}: {e}")
+    return total_inserted
+
+
+def run_tuning():
+    logging.info("Iniciando ajuste de parámetros de suavización...")
+    start_time = datetime.now()
+
+    since = (datetime.now() - timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d')
+    df_diario = fe.fetch_all_paginated(
+        'sap_consumo_diario_clean',
+        {'fecha': f'gte.{since}'},
+        'sku_id,fecha,cantidad_limpia'
+    )
+    if df_diario.empty:
+        logging.warning("No hay consumo diario para ajustar parámetros.")
+        return 0
+
+    df_params = tune_parameters(df_diario)
+    tuning_s = (datetime.now() - start_time).total_seconds()
+    logging.info(f"  {len(df_params)} SKUs ajustados en {tuning_s:.1f}s "
+                 f"(grilla de {len(ALPHA_GRID)} alphas)")
+
+    total = persist_parameters(df_params)
+    log_sync_result(table_name="sap_parametros_pronostico", rows_upserted=total, status="success")
+    logging.info(f"Ajuste completado: {total} SKUs con parámetros propios.")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Ajuste de parámetros de suavización por SKU")
+    add_cli_arguments(parser)
+    configure_from_args(parser.parse_args())
+    run_tuning()
@@ -1,8 +1,9 @@
 import os
-import requests
+import argparse
 import pandas as pd
 import numpy as np
 import logging
+import requests
 from datetime import datetime, date
 import calendar
 import sys
@@ -10,7 +11,10 @@ import sys
 # Añadir directorio raíz al path para importar módulos locales
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from modules.api_client import get_headers, SUPABASE_URL, post_to_supabase
+from modules import state_store
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import get_code_table
+from modules.scenario_engine import report_projection
 
 # Configuración de Logging
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,172 +28,297 @@ logging.basicConfig(
     ]
 )
 
+# Sumas por SKU del mes en curso que se calculan en la base (RPC) en lugar de en pandas
+MONTH_AGGREGATES_RPC = 'report_month_aggregates'
+MONTH_AGGREGATE_ORIGINS = ('real_venta', 'real_fabricado', 'programado')
+VALID_SALE_TYPES = ['VENTA', 'CONSUMO', 'TRASPASO']
+
+# Publicación incremental: huellas por SKU de la última corrida en backend/state/
+REPORT_TABLE = 'sap_reporte_maestro'
+REPORT_STATE = 'report_fingerprints.json'
+# Columnas que cambian cada día aunque no cambien los datos (dependen de los días restantes del mes)
+TIME_COLUMNS = ['projected_venta_consumo', 'stock_fin_mes', 'coverage_final']
+BATCH_SIZE = 500
+REPORT_COLUMNS = [
+    'sku_id', 'descripcion', 'po_mes_actual', 'coverage_initial',
+    'stock_inicio_mes', 'real_venta_consumo', 'real_fabricado', 'stock_hoy',
+    'coverage_actual', 'projected_venta_consumo', 'projected_fabricado',
+    'stock_fin_mes', 'po_prox_mes', 'coverage_final',
+]
+
+def report_sku(values):
+    """
+    Código de sap_reporte_maestro.sku_id (regla histórica de clean_sku, vectorizada): texto antes del
+    primer '.' y sin ceros a la izquierda, también en códigos alfanuméricos; nulos = ''. No es
+    canonical_sku ('0AB1' → 'AB1', '123.5' → '123'): así el reporte conserva sus claves.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    text = series.map(str, na_action='ignore').fillna('').astype(object)
+    return text.str.split('.', n=1).str[0].str.lstrip('0')
+
 def fetch_all_paginated(table, params={}):
-    all_data = []
-    start, batch_size = 0, 1000
-    while True:
-        headers = get_headers()
-        headers["Range"] = f"{start}-{start + batch_size - 1}"
-        # Construir URL con parámetros
-        url = f"{SUPABASE_URL}/rest/v1/{table}"
-        try:
-            resp = requests.get(url, headers=headers, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-            if not data:
-                break
-            all_data.extend(data)
-            if len(data) < batch_size:
-                break
-            start += batch_size
-        except Exception as e:
-            logging.error(f"Error fetching {table}: {e}")
-            break
-    return pd.DataFrame(all_data)
-
-def run_report_persistence():
+    params = dict(params)
+    return get_source().fetch(table, params, params.pop('select', '*'))
+
+def fetch_month_aggregates(desde):
+    """
+    Sumas por SKU desde `desde` calculadas en la base (sql/004_report_month_aggregates.sql).
+    Retorna {origen: DataFrame(sku_id, cantidad)} o None si la RPC no está disponible.
+    """
+    try:
+        df = get_source().rpc(MONTH_AGGREGATES_RPC, {'p_desde': desde}, timeout=120)
+    except requests.RequestException as e:
+        logging.warning(f"RPC {MONTH_AGGREGATES_RPC} falló ({e}); se agregará localmente.")
+        return None
+    if df is None:
+        return None
+    if df.empty:
+        df = pd.DataFrame(columns=['origen', 'sku_id', 'cantidad'])
+    df['cantidad'] = pd.to_numeric(df['cantidad'], errors='coerce').fillna(0.0)
+    logging.info(f"Agregados del mes desde la base: {len(df)} filas")
+    return {origen: df.loc[df['origen'] == origen, ['sku_id', 'cantidad']] for origen in MONTH_AGGREGATE_ORIGINS}
+
+def aggregate_month_locally(desde):
+    """Respaldo de fetch_month_aggregates: descarga los registros del mes y los suma por SKU."""
+    df_movs = fetch_all_paginated('sap_consumo_movimientos', {
+        'select': 'material_clave,cantidad_final_tn,tipo2',
+        'fecha': f'gte.{desde}'
+    })
+    df_prod_real = fetch_all_paginated('sap_produccion', {
+        'select': 'material,cantidad_tn',
+        'fecha_contabilizacion': f'gte.{desde}'
+    })
+    df_programa = fetch_all_paginated('sap_programa_produccion', {
+        'select': 'sku_produccion,cantidad_programada',
+        'fecha': f'gte.{desde}'
+    })
+    logging.info(f"Agregados del mes locales: {len(df_movs) + len(df_prod_real) + len(df_programa)} registros descargados")
+
+    if not df_movs.empty:
+        df_movs = df_movs[df_movs['tipo2'].str.contains('|'.join(VALID_SALE_TYPES), case=False, na=False)]
+
+    def summed(df, sku_col, value_col):
+        if df.empty:
+            return pd.DataFrame(columns=['sku_id', 'cantidad'])
+        out = df.groupby(sku_col)[value_col].sum().reset_index()
+        return out.rename(columns={sku_col: 'sku_id', value_col: 'cantidad'})
+
+    return {
+        'real_venta': summed(df_movs, 'material_clave', 'cantidad_final_tn'),
+        'real_fabricado': summed(df_prod_real, 'material', 'cantidad_tn'),
+        'programado': summed(df_programa, 'sku_produccion', 'cantidad_programada'),
+    }
+
+def row_hashes(df, columns):
+    """Hash por fila de las columnas dadas (como texto, para guardarlo en JSON)."""
+    return pd.util.hash_pandas_object(df[columns], index=False).astype(str)
+
+def _upsert_batches(records, label):
+    for i in range(0, len(records), BATCH_SIZE):
+        get_source().upsert(REPORT_TABLE, records[i:i + BATCH_SIZE], on_conflict='sku_id')
+        logging.info(f"{label}: batch {i // BATCH_SIZE + 1} ({min(i + BATCH_SIZE, len(records))}/{len(records)})")
+
+def publish_report(final_df, full=False):
+    """
+    Publica el reporte comparando dos huellas por SKU con las de la corrida anterior:
+    la de las columnas de datos y la de las columnas que dependen de los días restantes.
+      - SKU nuevo o con datos distintos → upsert de la fila completa.
+      - Solo cambió el día → upsert de la fila completa (lo que cambia son TIME_COLUMNS).
+      - SKU que ya no está en el maestro → se borra.
+    Una nueva corrida el mismo día sin cambios de entrada no escribe nada.
+    """
+    static_cols = [c for c in final_df.columns if c not in TIME_COLUMNS + ['sku_id', 'updated_at']]
+    hashes = pd.DataFrame({
+        'sku_id': final_df['sku_id'],
+        'static': row_hashes(final_df, static_cols),
+        'time': row_hashes(final_df, TIME_COLUMNS),
+    })
+    previous = {} if full else (state_store.load_json(REPORT_STATE, {}) or {}).get('skus', {})
+    written = 0
+    try:
+        if not previous:
+            logging.info("Modo completo: limpiando tabla sap_reporte_maestro...")
+            get_source().delete(REPORT_TABLE, {"sku_id": "neq.0"})
+            logging.info("Insertando nuevos datos consolidado...")
+            records = final_df.to_dict(orient='records')
+            for i in range(0, len(records), BATCH_SIZE):
+                get_source().insert(REPORT_TABLE, records[i:i + BATCH_SIZE])
+                logging.info(f"Subido batch {i // BATCH_SIZE + 1} ({min(i + BATCH_SIZE, len(records))}/{len(records)})")
+            written = len(records)
+        else:
+            prev = pd.DataFrame.from_dict(previous, orient='index', columns=['static', 'time'])
+            joined = hashes.join(prev, on='sku_id', rsuffix='_prev')
+            changed = (joined['static'] != joined['static_prev']).to_numpy()
+            time_only = ~changed & (joined['time'] != joined['time_prev']).to_numpy()
+            removed = sorted(set(previous) - set(hashes['sku_id']))
+            logging.info(f"Modo incremental: {int(changed.sum())} SKUs con cambios, {int(time_only.sum())} solo "
+                         f"con días restantes, {len(removed)} retirados, {int((~changed & ~time_only).sum())} sin cambios")
+
+            _upsert_batches(final_df[changed].to_dict(orient='records'), "Filas actualizadas")
+            # Filas completas también acá: un upsert con columnas parciales inserta la fila si el SKU
+            # falta en la tabla y choca con los NOT NULL del resto de las columnas
+            _upsert_batches(final_df[time_only].to_dict(orient='records'), "Columnas por días restantes")
+            for i in range(0, len(removed), BATCH_SIZE):
+                chunk = ','.join(f'"{sku}"' for sku in removed[i:i + BATCH_SIZE])
+                get_source().delete(REPORT_TABLE, {"sku_id": f"in.({chunk})"})
+            written = int(changed.sum() + time_only.sum())
+    except Exception:
+        # La tabla puede haber quedado a medias: sin huellas, la próxima corrida es completa
+        state_store.clear(REPORT_STATE)
+        raise
+
+    state_store.save_json(REPORT_STATE, {
+        'skus': dict(zip(hashes['sku_id'], zip(hashes['static'], hashes['time']))),
+    })
+    return written
+
+def report_dates(now):
+    """Mes en curso, mes siguiente (YYYY-MM-01) y días que le quedan al mes en curso."""
+    current_month_str = now.strftime('%Y-%m-01')
+    if now.month == 12:
+        next_month = date(now.year + 1, 1, 1)
+    else:
+        next_month = date(now.year, now.month + 1, 1)
+    next_month_str = next_month.strftime('%Y-%m-01')
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+    remaining_days = max(0, days_in_month - now.day)
+    return current_month_str, next_month_str, remaining_days
+
+def load_report_inputs(now):
+    """
+    Descarga y cruza por SKU las entradas del reporte (maestro, plan híbrido, demanda y sumas
+    del mes). Retorna un DataFrame por SKU del maestro, con ceros/defectos ya aplicados,
+    o None si no se pudo obtener el maestro. También lo usa modules/scenario_engine.py.
+    """
+    current_month_str, next_month_str, _ = report_dates(now)
+
+    logging.info("Descargando datos...")
+    df_maestro = fetch_all_paginated('sap_maestro_articulos', {'select': 'codigo,descripcion_material'})
+    df_hibrido = fetch_all_paginated('sap_plan_inventario_hibrido', {'select': 'sku_id,adu_hibrido_final,factor_fin_mes,stock_actual'})
+
+    df_demanda = fetch_all_paginated('sap_demanda_proyectada', {
+        'select': 'sku_id,mes,cantidad',
+        'mes': f'in.({current_month_str},{next_month_str})'
+    })
+
+    # Sumas del mes por SKU: calculadas en la base (una fila por SKU y origen) o, si la
+    # función no está desplegada, descargando los registros del mes
+    monthly = fetch_month_aggregates(current_month_str)
+    if monthly is None:
+        monthly = aggregate_month_locally(current_month_str)
+
+    if df_maestro.empty:
+        logging.error("No se pudo obtener el maestro de artículos.")
+        return None
+
+    # Normalizar IDs: código del reporte (report_sku) + código entero de la tabla compartida; los
+    # cruces van por entero
+    codes = get_code_table()
+    df_maestro['codigo'] = report_sku(df_maestro['codigo'])
+    df_maestro['sku_code'] = codes.encode(df_maestro['codigo'])
+
+    def by_code(df, sku_col, value_col, out_col=None):
+        if df.empty:
+            return pd.DataFrame(columns=['sku_code', out_col or value_col])
+        keyed = df.assign(sku_code=codes.encode(report_sku(df[sku_col])))
+        keyed = keyed[keyed['sku_code'] >= 0]
+        summed = keyed.groupby('sku_code', sort=False)[value_col].sum().reset_index()
+        return summed.rename(columns={value_col: out_col or value_col})
+
+    # Agregaciones
+    real_venta = by_code(monthly['real_venta'], 'sku_id', 'cantidad', 'cantidad_final_tn')
+    real_fab = by_code(monthly['real_fabricado'], 'sku_id', 'cantidad', 'cantidad_tn')
+    prog_fab = by_code(monthly['programado'], 'sku_id', 'cantidad', 'cantidad_programada')
+
+    if not df_demanda.empty:
+        po_actual = by_code(df_demanda[df_demanda['mes'] == current_month_str], 'sku_id', 'cantidad')
+        po_prox = by_code(df_demanda[df_demanda['mes'] == next_month_str], 'sku_id', 'cantidad', 'cantidad_po_prox')
+    else:
+        po_actual = pd.DataFrame(columns=['sku_code', 'cantidad'])
+        po_prox = pd.DataFrame(columns=['sku_code', 'cantidad_po_prox'])
+
+    if not df_hibrido.empty:
+        df_hibrido = df_hibrido.assign(sku_code=codes.encode(report_sku(df_hibrido['sku_id']))).drop(columns=['sku_id'])
+        df_hibrido = df_hibrido[df_hibrido['sku_code'] >= 0]
+    else:
+        df_hibrido = pd.DataFrame(columns=['sku_code', 'adu_hibrido_final', 'factor_fin_mes', 'stock_actual'])
+    codes.save()
+
+    # Merge Final del Reporte
+    report = df_maestro
+    for part in (df_hibrido, po_actual, po_prox, real_venta, real_fab, prog_fab):
+        report = report.merge(part.astype({'sku_code': 'int32'}), on='sku_code', how='left')
+
+    # Llenar ceros y valores por defecto
+    cols_to_zero = ['adu_hibrido_final', 'cantidad', 'cantidad_po_prox', 'cantidad_final_tn', 'cantidad_tn', 'cantidad_programada', 'stock_actual']
+    for c in cols_to_zero:
+        report[c] = pd.to_numeric(report[c], errors='coerce').fillna(0)
+    report['factor_fin_mes'] = pd.to_numeric(report['factor_fin_mes'], errors='coerce').fillna(1.0)
+    return report
+
+def compute_report(report, remaining_days):
+    """Aplica las fórmulas del Reporte Maestro (modules/scenario_engine.report_projection)."""
+    projection = report_projection(
+        stock=report['stock_actual'].to_numpy(float),
+        adu=report['adu_hibrido_final'].to_numpy(float),
+        factor=report['factor_fin_mes'].to_numpy(float),
+        po_actual=report['cantidad'].to_numpy(float),
+        po_prox=report['cantidad_po_prox'].to_numpy(float),
+        real_venta=report['cantidad_final_tn'].to_numpy(float),
+        real_fabricado=report['cantidad_tn'].to_numpy(float),
+        programado=report['cantidad_programada'].to_numpy(float),
+        remaining_days=remaining_days,
+    )
+    final_df = pd.DataFrame({
+        'sku_id': report['codigo'].to_numpy(),
+        'descripcion': report['descripcion_material'].to_numpy(),
+        'real_venta_consumo': report['cantidad_final_tn'].to_numpy(float),
+        'real_fabricado': report['cantidad_tn'].to_numpy(float),
+        'stock_hoy': report['stock_actual'].to_numpy(float),
+        **projection,
+    })
+    final_df = final_df[REPORT_COLUMNS]
+
+    # Sanitizar valores antes de subir (JSON no acepta NaN/Inf)
+    final_df = final_df.replace([np.inf, -np.inf], 0).fillna(0)
+    return final_df.drop_duplicates('sku_id').reset_index(drop=True)
+
+def run_report_persistence(full=False):
+    """
+    Recalcula el Reporte Maestro y lo publica. Retorna las filas escritas (None si falla).
+    Con full=True (o sin huellas guardadas) la tabla se vacía y se recarga completa.
+    """
     logging.info("--- Iniciando persistencia de Reporte Maestro ---")
     
     try:
         # 1. Configuración de Fechas
         now = datetime.now()
-        current_month_str = now.strftime('%Y-%m-01')
-        
-        # Próximo mes
-        if now.month == 12:
-            next_month = date(now.year + 1, 1, 1)
-        else:
-            next_month = date(now.year, now.month + 1, 1)
-        next_month_str = next_month.strftime('%Y-%m-01')
-        
-        days_in_month = calendar.monthrange(now.year, now.month)[1]
-        remaining_days = max(0, days_in_month - now.day)
-        
+        _, _, remaining_days = report_dates(now)
         logging.info(f"Reporte para {now.strftime('%Y-%m')}. Días restantes en mes: {remaining_days}")
 
-        # 2. Fetch Data de Supabase
-        logging.info("Descargando datos de Supabase...")
-        df_maestro = fetch_all_paginated('sap_maestro_articulos', {'select': 'codigo,descripcion_material'})
-        df_hibrido = fetch_all_paginated('sap_plan_inventario_hibrido', {'select': 'sku_id,adu_hibrido_final,factor_fin_mes,stock_actual'})
-        
-        df_demanda = fetch_all_paginated('sap_demanda_proyectada', {
-            'select': 'sku_id,mes,cantidad',
-            'mes': f'in.({current_month_str},{next_month_str})'
-        })
-        
-        df_movs = fetch_all_paginated('sap_consumo_movimientos', {
-            'select': 'material_clave,cantidad_final_tn,tipo2',
-            'fecha': f'gte.{current_month_str}'
-        })
-        
-        df_prod_real = fetch_all_paginated('sap_produccion', {
-            'select': 'material,cantidad_tn',
-            'fecha_contabilizacion': f'gte.{current_month_str}'
-        })
-        
-        df_programa = fetch_all_paginated('sap_programa_produccion', {
-            'select': 'sku_produccion,cantidad_programada',
-            'fecha': f'gte.{current_month_str}'
-        })
-
-        if df_maestro.empty:
-            logging.error("No se pudo obtener el maestro de artículos.")
+        # 2. Fetch Data
+        report = load_report_inputs(now)
+        if report is None:
             return
 
-        # 3. Procesamiento y Limpieza
+        # 3. Cálculos de Negocio (Replicando lógica Frontend)
         logging.info("Procesando cálculos dinámicos...")
-
-        def clean_sku(val):
-            if pd.isna(val): return ""
-            return str(val).split('.')[0].lstrip('0')
-
-        # Normalizar IDs
-        df_maestro['codigo'] = df_maestro['codigo'].apply(clean_sku)
-        if not df_hibrido.empty: df_hibrido['sku_id'] = df_hibrido['sku_id'].apply(clean_sku)
-        if not df_demanda.empty: df_demanda['sku_id'] = df_demanda['sku_id'].apply(clean_sku)
-        if not df_movs.empty: df_movs['material_clave'] = df_movs['material_clave'].apply(clean_sku)
-        if not df_prod_real.empty: df_prod_real['material'] = df_prod_real['material'].apply(clean_sku)
-        if not df_programa.empty: df_programa['sku_produccion'] = df_programa['sku_produccion'].apply(clean_sku)
-
-        # Agregaciones
-        valid_types = ['VENTA', 'CONSUMO', 'TRASPASO']
-        if not df_movs.empty:
-            df_movs_filtered = df_movs[df_movs['tipo2'].str.contains('|'.join(valid_types), case=False, na=False)]
-            real_venta = df_movs_filtered.groupby('material_clave')['cantidad_final_tn'].sum().reset_index()
-        else:
-            real_venta = pd.DataFrame(columns=['material_clave', 'cantidad_final_tn'])
-        
-        real_fab = df_prod_real.groupby('material')['cantidad_tn'].sum().reset_index() if not df_prod_real.empty else pd.DataFrame(columns=['material', 'cantidad_tn'])
-        prog_fab = df_programa.groupby('sku_produccion')['cantidad_programada'].sum().reset_index() if not df_programa.empty else pd.DataFrame(columns=['sku_produccion', 'cantidad_programada'])
-
-        po_actual = df_demanda[df_demanda['mes'] == current_month_str].groupby('sku_id')['cantidad'].sum().reset_index() if not df_demanda.empty else pd.DataFrame(columns=['sku_id', 'cantidad'])
-        po_prox = df_demanda[df_demanda['mes'] == next_month_str].groupby('sku_id')['cantidad'].sum().reset_index() if not df_demanda.empty else pd.DataFrame(columns=['sku_id', 'cantidad'])
-
-        # Merge Final del Reporte
-        report = df_maestro.merge(df_hibrido, left_on='codigo', right_on='sku_id', how='left')
-        report = report.merge(po_actual, left_on='codigo', right_on='sku_id', how='left', suffixes=('', '_po_act'))
-        report = report.merge(po_prox, left_on='codigo', right_on='sku_id', how='left', suffixes=('', '_po_prox'))
-        report = report.merge(real_venta, left_on='codigo', right_on='material_clave', how='left')
-        report = report.merge(real_fab, left_on='codigo', right_on='material', how='left')
-        report = report.merge(prog_fab, left_on='codigo', right_on='sku_produccion', how='left')
-
-        # Llenar ceros y valores por defecto
-        cols_to_zero = ['adu_hibrido_final', 'cantidad', 'cantidad_po_prox', 'cantidad_final_tn', 'cantidad_tn', 'cantidad_programada', 'stock_actual']
-        for c in cols_to_zero:
-            if c in report.columns:
-                report[c] = report[c].fillna(0)
-        if 'factor_fin_mes' in report.columns:
-            report['factor_fin_mes'] = report['factor_fin_mes'].fillna(1.0)
-        else:
-            report['factor_fin_mes'] = 1.0
-
-        # Cálculos de Negocio (Replicando lógica Frontend)
-        report['po_mes_actual'] = report['cantidad'] if 'cantidad' in report.columns else 0
-        report['stock_inicio_mes'] = report['stock_actual'] - report['cantidad_tn'] + report['cantidad_final_tn']
-        report['coverage_initial'] = np.where(report['po_mes_actual'] > 0, report['stock_inicio_mes'] / report['po_mes_actual'], 0)
-        report['projected_venta_consumo'] = report['adu_hibrido_final'] * remaining_days * report['factor_fin_mes']
-        report['projected_fabricado'] = (report['cantidad_programada'] - report['cantidad_tn']).clip(lower=0)
-        report['stock_fin_mes'] = report['stock_actual'] + report['projected_fabricado'] - report['projected_venta_consumo']
-        report['po_prox_mes'] = report['cantidad_po_prox'] if 'cantidad_po_prox' in report.columns else 0
-        report['coverage_final'] = np.where(report['po_prox_mes'] > 0, report['stock_fin_mes'] / report['po_prox_mes'], 0)
-        report['coverage_actual'] = np.where(report['po_mes_actual'] > 0, report['stock_actual'] / report['po_mes_actual'], 0)
-
-        # Preparación para Inserción
-        final_df = report[[
-            'codigo', 'descripcion_material', 'po_mes_actual', 'coverage_initial', 
-            'stock_inicio_mes', 'cantidad_final_tn', 'cantidad_tn', 'stock_actual',
-            'coverage_actual', 'projected_venta_consumo', 'projected_fabricado', 
-            'stock_fin_mes', 'po_prox_mes', 'coverage_final'
-        ]].rename(columns={
-            'codigo': 'sku_id',
-            'descripcion_material': 'descripcion',
-            'cantidad_final_tn': 'real_venta_consumo',
-            'cantidad_tn': 'real_fabricado',
-            'stock_actual': 'stock_hoy'
-        })
-
-        # Sanitizar valores antes de subir (JSON no acepta NaN/Inf)
-        final_df = final_df.replace([np.inf, -np.inf], 0).fillna(0)
+        final_df = compute_report(report, remaining_days)
         final_df['updated_at'] = datetime.now().isoformat()
 
-        # 4. Actualización en Supabase (Truncate + Insert)
-        logging.info("Limpiando tabla sap_reporte_maestro...")
-        headers = get_headers()
-        url_del = f"{SUPABASE_URL}/rest/v1/sap_reporte_maestro"
-        requests.delete(url_del, headers=headers, params={"sku_id": "neq.0"})
-        
-        logging.info("Insertando nuevos datos consolidado...")
-        records = final_df.to_dict(orient='records')
-        batch_size = 500
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i+batch_size]
-            post_to_supabase('sap_reporte_maestro', batch)
-            logging.info(f"Subido batch {i//batch_size + 1} ({min(i+batch_size, len(records))}/{len(records)})")
+        # 4. Actualización de la tabla: solo las filas que cambiaron desde la corrida anterior
+        written = publish_report(final_df, full=full)
 
         logging.info("--- Persistencia completada exitosamente ---")
+        return written
 
     except Exception as e:
         logging.error(f"Falla crítica en run_report_persistence: {e}", exc_info=True)
 
 if __name__ == "__main__":
-    run_report_persistence()
+    parser = argparse.ArgumentParser(description="Persistencia del Reporte Maestro")
+    parser.add_argument('--full', action='store_true', help="Vaciar y recargar la tabla completa")
+    add_cli_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    run_report_persistence(full=args.full)
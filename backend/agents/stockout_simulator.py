@@ -0,0 +1,247 @@
+"""
+stockout_simulator.py
+Probabilidad de quiebre de stock por SKU con simulación Monte Carlo.
+
+Para cada SKU simula miles de trayectorias de demanda diaria sobre el horizonte y las combina con
+el stock actual y el programa de producción:
+
+    stock[t] = stock_actual + Σ programa[≤t] − Σ demanda[≤t]
+
+La demanda de cada día se sortea de la historia diaria limpia del SKU (sap_consumo_diario_clean,
+calendario completo, días sin registro = 0) o, si el SKU tiene pronóstico, como pronóstico del día
+por un ruido bootstrap centrado en la media (día sorteado / promedio de la historia, media 1). No son
+residuos del pronóstico: el motor solo guarda el pronóstico vigente, no el de días ya observados. Todo
+se calcula con arreglos NumPy SKU × trayectoria × día, por bloques de SKUs que caben en MEMORY_BUDGET_MB.
+
+El horizonte por defecto es el del motor de pronóstico (90 días); 7/14/30 quedan como cortes.
+Resultado en sap_probabilidad_quiebre: P(quiebre antes del día 7/14/30/horizonte) y días de
+cobertura esperados (promedio de min(día de quiebre, horizonte)) y p10.
+
+Ejecución: py -3 backend/agents/stockout_simulator.py [--fixtures DIR] [--output-dir DIR] [--paths N] [--horizon D]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- Path setup ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+from modules.data_source import get_source, add_cli_arguments, configure_from_args
+from modules.sku_codes import canonical_sku
+from modules import state_store
+from sync_logger import log_sync_result
+from forecast_engine import HORIZON_DAYS as FORECAST_HORIZON_DAYS
+
+RESULT_TABLE = 'sap_probabilidad_quiebre'
+FORECAST_CACHE_STATE = 'forecast_cache.pkl'  # Pronóstico vigente en columnas (agents/forecast_engine.py)
+DEMAND_TYPES = ('venta', 'consumo')
+HISTORY_DAYS = 90
+N_PATHS = int(os.getenv('STOCKOUT_PATHS', '2000'))
+HORIZON_DAYS = int(os.getenv('STOCKOUT_HORIZON_DAYS', str(FORECAST_HORIZON_DAYS)))
+MEMORY_BUDGET_MB = int(os.getenv('STOCKOUT_MEMORY_MB', '256'))
+CHECKPOINTS = (7, 14, 30)
+SEED = 42
+BATCH_SIZE = 1000
+
+
+def _numeric(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+
+
+def _daily_matrix(skus, start, n_days, sku_values, fechas, quantities):
+    """Matriz SKU × día desde `start` (días sin registro = 0)."""
+    matrix = np.zeros((len(skus), n_days))
+    row = pd.Index(skus).get_indexer(canonical_sku(sku_values))
+    col = (pd.to_datetime(fechas).dt.normalize() - pd.Timestamp(start)).dt.days.to_numpy()
+    keep = (row >= 0) & (col >= 0) & (col < n_days)
+    np.add.at(matrix, (row[keep], col[keep]), np.asarray(quantities, dtype=float)[keep])
+    return matrix
+
+
+def chunk_size(n_paths, horizon, budget_mb=MEMORY_BUDGET_MB):
+    """
+    SKUs por bloque para que los arreglos SKU × trayectoria × día quepan en el presupuesto.
+    En el pico hay hasta 4 arreglos float64/int64 de ese tamaño vivos a la vez (sorteos, demanda,
+    ruido y su producto con el pronóstico, o demanda acumulada y nivel de stock).
+    """
+    per_sku = n_paths * horizon * 8 * 4
+    return max(1, int(budget_mb * 1024 * 1024 // per_sku))
+
+
+def simulate_block(rng, stock, supply, history, hist_start, forecast, use_forecast, n_paths):
+    """
+    Simula un bloque de SKUs. history: SKU × días de historia; hist_start: primer día con dato por SKU.
+    forecast/use_forecast: pronóstico SKU × horizonte y qué SKUs lo usan.
+    Retorna (día de quiebre por SKU × trayectoria, o horizonte+1 si no quiebra).
+    """
+    n_skus, horizon = supply.shape
+    hist_len = history.shape[1] - hist_start
+    # Día sorteado de la historia propia de cada SKU (desde su primer registro)
+    draws = hist_start[:, None, None] + (rng.random((n_skus, n_paths, horizon), dtype=np.float32)
+                                         * hist_len[:, None, None]).astype(np.int64)
+    demand = np.take_along_axis(history[:, None, :], draws.reshape(n_skus, 1, -1), axis=2).reshape(draws.shape)
+    del draws
+    if use_forecast.any():
+        # Pronóstico × ruido bootstrap centrado en la media (día sorteado / promedio del SKU, media 1).
+        # Multiplicativo: no hace falta recortar en 0, que sesgaría la demanda simulada hacia arriba.
+        # Sin historia el ruido es 1 (demanda = pronóstico).
+        mean = history.sum(axis=1) / hist_len
+        scale = np.divide(1.0, mean, out=np.zeros_like(mean), where=mean > 0)
+        noise = np.where((mean > 0)[:, None, None], demand * scale[:, None, None], 1.0)
+        demand = np.where(use_forecast[:, None, None], forecast[:, None, :] * noise, demand)
+        del noise
+
+    np.cumsum(demand, axis=2, out=demand)
+    level = (stock[:, None] + np.cumsum(supply, axis=1))[:, None, :] - demand
+    stockout = level <= 0
+    first = np.where(stockout.any(axis=2), stockout.argmax(axis=2) + 1, horizon + 1)
+    # Sin stock hoy: quiebre en el día 0
+    return np.where((stock <= 0)[:, None], 0, first)
+
+
+def summarize(first_day, horizon):
+    """Probabilidades de quiebre por corte y días de cobertura (censurados al horizonte)."""
+    out = {f'p_quiebre_{d}d': (first_day <= d).mean(axis=1) for d in CHECKPOINTS if d <= horizon}
+    out['p_quiebre_horizonte'] = (first_day <= horizon).mean(axis=1)
+    cover = np.minimum(first_day, horizon).astype(float)
+    out['dias_cobertura_esperados'] = cover.mean(axis=1)
+    out['dias_cobertura_p10'] = np.percentile(cover, 10, axis=1)
+    return out
+
+
+def load_inputs(today, horizon):
+    """Stock del plan híbrido, programa del horizonte, historia limpia y pronóstico, alineados por SKU."""
+    hibrido = get_source().fetch('sap_plan_inventario_hibrido', select='*')
+    since = today - timedelta(days=HISTORY_DAYS)
+    df_hist = get_source().fetch('sap_consumo_diario_clean', {'fecha': f'gte.{since.isoformat()}'},
+                                 'sku_id,fecha,cantidad_limpia')
+    if hibrido.empty or df_hist.empty:
+        return None
+
+    skus = pd.Index(canonical_sku(hibrido['sku_id'])).drop_duplicates().drop('', errors='ignore')
+    stock = pd.Series(_numeric(hibrido['stock_actual']) if 'stock_actual' in hibrido else 0.0,
+                      index=canonical_sku(hibrido['sku_id']))
+    stock = stock[~stock.index.duplicated()].reindex(skus, fill_value=0.0).to_numpy()
+
+    history = _daily_matrix(skus, since, HISTORY_DAYS, df_hist['sku_id'], df_hist['fecha'],
+                            _numeric(df_hist['cantidad_limpia']))
+    has_hist = (history != 0).any(axis=1)
+    # Sin historia: se sortean ceros de toda la ventana (la demanda queda igual al pronóstico)
+    hist_start = np.where(has_hist, (history != 0).argmax(axis=1), 0)
+
+    start = today + timedelta(days=1)
+    df_prog = get_source().fetch('sap_programa_produccion', {
+        'fecha': [f'gte.{start.isoformat()}', f'lte.{(today + timedelta(days=horizon)).isoformat()}'],
+    }, 'fecha,sku_produccion,cantidad_programada')
+    supply = (_daily_matrix(skus, start, horizon, df_prog['sku_produccion'], df_prog['fecha'],
+                            _numeric(df_prog['cantidad_programada']))
+              if not df_prog.empty else np.zeros((len(skus), horizon)))
+
+    forecast = np.zeros((len(skus), horizon))
+    df_fc = state_store.load_object(FORECAST_CACHE_STATE)
+    if df_fc is None or df_fc.empty:
+        df_fc = get_source().fetch('sap_pronostico_diario', {
+            'fecha': [f'gte.{start.isoformat()}', f'lte.{(today + timedelta(days=horizon)).isoformat()}'],
+            'tipo': f"in.({','.join(DEMAND_TYPES)})",
+        }, 'sku_id,fecha,tipo,cantidad_pronosticada', timeout=60)
+        df_fc = df_fc.rename(columns={'cantidad_pronosticada': 'cantidad'})
+    if not df_fc.empty:
+        df_fc = df_fc[df_fc['tipo'].astype(str).isin(DEMAND_TYPES)]
+        forecast = _daily_matrix(skus, start, horizon, df_fc['sku_id'], df_fc['fecha'], _numeric(df_fc['cantidad']))
+
+    return {
+        'skus': skus, 'stock': stock, 'supply': supply, 'history': history, 'hist_start': hist_start,
+        'has_history': has_hist, 'forecast': forecast, 'use_forecast': (forecast > 0).any(axis=1),
+    }
+
+
+def simulate(inputs, n_paths=N_PATHS, budget_mb=MEMORY_BUDGET_MB, seed=SEED):
+    """Corre la simulación por bloques de SKUs; retorna DataFrame con una fila por SKU simulable."""
+    horizon = inputs['supply'].shape[1]
+    rows = np.flatnonzero(inputs['has_history'] | inputs['use_forecast'])
+    block = chunk_size(n_paths, horizon, budget_mb)
+    rng = np.random.default_rng(seed)
+    parts = []
+    for i in range(0, len(rows), block):
+        idx = rows[i:i + block]
+        first = simulate_block(rng, inputs['stock'][idx], inputs['supply'][idx], inputs['history'][idx],
+                               inputs['hist_start'][idx], inputs['forecast'][idx], inputs['use_forecast'][idx],
+                               n_paths)
+        parts.append(pd.DataFrame({'sku_id': inputs['skus'][idx], **summarize(first, horizon)}))
+    if not parts:
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True)
+    df['metodo'] = np.where(inputs['use_forecast'][rows], 'pronostico', 'historia')
+    df['stock_actual'] = inputs['stock'][rows]
+    df['horizonte_dias'] = horizon
+    df['trayectorias'] = n_paths
+    return df
+
+
+def persist_results(df_results):
+    """Reemplaza el contenido de sap_probabilidad_quiebre."""
+    try:
+        get_source().delete(RESULT_TABLE, {"sku_id": "not.is.null"})
+    except Exception as e:
+        logging.error(f"Error truncando {RESULT_TABLE}: {e}")
+
+    prob_cols = [c for c in df_results.columns if c.startswith('p_quiebre')]
+    records = df_results.assign(
+        **{c: df_results[c].round(4) for c in prob_cols},
+        dias_cobertura_esperados=df_results['dias_cobertura_esperados'].round(2),
+        stock_actual=df_results['stock_actual'].round(2),
+        updated_at=datetime.now().isoformat(),
+    ).to_dict(orient='records')
+    total_inserted = 0
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        try:
+            get_source().insert(RESULT_TABLE, batch)
+            total_inserted += len(batch)
+        except Exception as e:
+            logging.error(f"Error insertando batch de probabilidades {i}: {e}")
+    return total_inserted
+
+
+def run_simulation(n_paths=N_PATHS, horizon=HORIZON_DAYS):
+    logging.info("Iniciando simulación Monte Carlo de quiebres...")
+    today = datetime.now().date()
+    inputs = load_inputs(today, horizon)
+    if inputs is None:
+        logging.warning("Sin plan híbrido o sin historia diaria: no hay quiebres que simular.")
+        return 0
+
+    start = time.perf_counter()
+    df_results = simulate(inputs, n_paths)
+    elapsed = time.perf_counter() - start
+    block = chunk_size(n_paths, horizon)
+    logging.info(f"  {len(df_results)} SKUs × {n_paths} trayectorias × {horizon} días en {elapsed:.1f}s "
+                 f"(bloques de {block} SKUs, presupuesto {MEMORY_BUDGET_MB} MB)")
+    if df_results.empty:
+        return 0
+
+    total = persist_results(df_results)
+    log_sync_result(table_name=RESULT_TABLE, rows_upserted=total, status="success")
+    logging.info(f"Simulación completada: {total} SKUs.")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Probabilidad de quiebre por SKU (Monte Carlo)")
+    add_cli_arguments(parser)
+    parser.add_argument('--paths', type=int, default=N_PATHS, help="Trayectorias por SKU")
+    parser.add_argument('--horizon', type=int, default=HORIZON_DAYS, help="Días simulados")
+    args = parser.parse_args()
+    configure_from_args(args)
+    run_simulation(args.paths, args.horizon)
@@ -0,0 +1,115 @@
+"""Limpieza vectorizada contra la limpieza SKU por SKU original, y corrida incremental con FixtureSource."""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ai_data_cleaner as cleaner
+
+RAW_TABLE = 'sap_consumo_diario_resumen'
+CLEAN_TABLE = 'sap_consumo_diario_clean'
+
+
+def reference_clean(orig):
+    """Limpieza de una serie tal como la hacía process_sku_timeseries antes de vectorizar."""
+    limpia = np.copy(orig)
+    n = len(orig)
+    es_outlier = np.zeros(n, dtype=bool)
+    es_quiebre = np.zeros(n, dtype=bool)
+    non_zeros = orig[orig > 0]
+    if len(non_zeros) >= 3:
+        p95 = np.percentile(non_zeros, 95)
+        mean_nz = np.mean(non_zeros)
+        std_nz = np.std(non_zeros)
+        for i in range(n):
+            if orig[i] > p95 and std_nz > 0 and (orig[i] - mean_nz) / std_nz > 2.0:
+                limpia[i] = p95
+                es_outlier[i] = True
+    for i in range(n):
+        if orig[i] == 0:
+            window_vals = limpia[max(0, i - 7):min(n, i + 8)]
+            if np.count_nonzero(window_vals) >= len(window_vals) * 0.7:
+                limpia[i] = np.mean(window_vals[window_vals > 0])
+                es_quiebre[i] = True
+    return limpia, es_outlier, es_quiebre
+
+
+def make_raw(n_skus=40, end=date(2026, 6, 30), seed=7):
+    """Series diarias con densidades, picos y largos distintos (algunas cortas, sin limpiar)."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k in range(n_skus):
+        length = int(rng.integers(3, 200))
+        days = pd.date_range(end=end, periods=length, freq='D')
+        density = rng.uniform(0.3, 1.0)
+        values = np.round(rng.gamma(2.0, 5.0, length), 3) * (rng.random(length) < density)
+        values[rng.random(length) < 0.03] *= 20
+        for day, value in zip(days, values):
+            if value > 0 or rng.random() < 0.5:
+                rows.append({'sku_id': f'4000{k:04d}', 'fecha': day.strftime('%Y-%m-%d'),
+                             'cantidad_total_tn': float(value)})
+    return pd.DataFrame(rows)
+
+
+def test_clean_raw_series_matches_per_sku_reference():
+    raw = make_raw()
+    cleaned = cleaner.clean_raw_series(raw, workers=1)
+    for sku, df_sku in raw.groupby('sku_id', sort=False):
+        got = cleaned[cleaned['sku_id'] == sku]
+        if len(df_sku) < cleaner.MIN_POINTS:
+            assert np.array_equal(got['cantidad_limpia'].to_numpy(), got['cantidad_total_tn'].to_numpy())
+            continue
+        series = df_sku.assign(fecha=pd.to_datetime(df_sku['fecha'])).set_index('fecha')['cantidad_total_tn']
+        full = series.reindex(pd.date_range(series.index.min(), series.index.max(), freq='D')).fillna(0.0)
+        limpia, es_outlier, es_quiebre = reference_clean(full.to_numpy(dtype=float))
+        assert np.array_equal(got['fecha'].to_numpy(), full.index.to_numpy())
+        # Bit a bit: mismas operaciones de coma flotante que el bucle original
+        assert np.array_equal(got['cantidad_limpia'].to_numpy(), limpia)
+        assert np.array_equal(got['es_outlier'].to_numpy(), es_outlier)
+        assert np.array_equal(got['es_quiebre_stock'].to_numpy(), es_quiebre)
+
+
+def test_parallel_matrix_matches_single_process(monkeypatch):
+    raw = make_raw(n_skus=60, seed=11)
+    df, _, is_short, _ = cleaner._prepare_raw(raw)
+    _, _, lengths, orig = cleaner._build_matrix(df[~is_short])
+    monkeypatch.setattr(cleaner, 'MIN_ROWS_FOR_POOL', 0)
+    single = cleaner.clean_series_matrix(orig, lengths)
+    parallel = cleaner.clean_series_matrix_parallel(orig, lengths, workers=2)
+    for a, b in zip(single, parallel):
+        assert np.array_equal(a, b)
+
+
+def _clean_table(source):
+    df = source.fetch(CLEAN_TABLE).drop(columns=['id'], errors='ignore')
+    return df.sort_values(['sku_id', 'fecha']).reset_index(drop=True)
+
+
+def test_incremental_run_without_changes_keeps_table(fixture_source):
+    today = date(2026, 7, 1)
+    since = (today - timedelta(days=cleaner.HISTORY_DAYS)).isoformat()
+    fixture_source.insert(RAW_TABLE, make_raw(n_skus=15, end=today - timedelta(days=1)).to_dict(orient='records'))
+
+    inserted, ok = cleaner._clean_full(today, since)
+    assert ok and inserted > 0
+    before = _clean_table(fixture_source)
+
+    state = cleaner.state_store.load_object(cleaner.CLEAN_STATE)
+    _, ok = cleaner._clean_incremental(state, today + timedelta(days=1), since)
+    assert ok
+    pd.testing.assert_frame_equal(_clean_table(fixture_source), before)
+
+
+def test_incremental_run_stops_when_fetch_comes_back_empty(fixture_source, monkeypatch):
+    today = date(2026, 7, 1)
+    since = (today - timedelta(days=cleaner.HISTORY_DAYS)).isoformat()
+    fixture_source.insert(RAW_TABLE, make_raw(n_skus=5, end=today - timedelta(days=1)).to_dict(orient='records'))
+    cleaner._clean_full(today, since)
+    before = _clean_table(fixture_source)
+    state = cleaner.state_store.load_object(cleaner.CLEAN_STATE)
+
+    monkeypatch.setattr(cleaner, 'fetch_all_paginated', lambda *args, **kwargs: pd.DataFrame())
+    with pytest.raises(RuntimeError):
+        cleaner._clean_incremental(state, today + timedelta(days=1), since)
+    pd.testing.assert_frame_equal(_clean_table(fixture_source), before)
@@ -0,0 +1,81 @@
+"""Planificación de la corrida incremental del Motor de Pronósticos."""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import forecast_engine as fe
+
+TODAY = date(2026, 10, 19)
+
+
+def make_data():
+    rng = np.random.default_rng(1)
+    months = list(pd.date_range('2025-10-01', periods=12, freq='MS').strftime('%Y-%m-%d'))
+    return {
+        'segmentos': pd.DataFrame({'sku_id': ['40001234'], 'abc_segment': ['A'], 'xyz_segment': ['X'],
+                                   'factor_fin_mes': [1.0], 'adu_hibrido_final': [1.0]}),
+        # El mismo material llega con ceros a la izquierda o con '.0' según la tabla
+        'consumo_mensual': pd.DataFrame({'sku_id': ['0040001234'] * 12, 'mes': months, 'tipo2': ['Venta'] * 12,
+                                         'cantidad_total_tn': rng.gamma(2.0, 10.0, 12)}),
+        'consumo_diario': pd.DataFrame({
+            'sku_id': ['40001234'] * 30,
+            'fecha': pd.date_range('2026-09-01', periods=30).strftime('%Y-%m-%d'),
+            'cantidad_limpia': rng.gamma(2.0, 1.0, 30),
+        }),
+        'produccion': pd.DataFrame(columns=['material', 'fecha_contabilizacion', 'cantidad_tn']),
+        'demanda': pd.DataFrame({'sku_id': ['40001234.0'], 'mes': ['2026-11-01'], 'cantidad': [40.0]}),
+        'programa': pd.DataFrame(columns=['fecha', 'sku_produccion', 'sku_consumo', 'cantidad_programada']),
+        'parametros': pd.DataFrame(columns=['sku_id', 'ses_alpha', 'croston_alpha']),
+    }
+
+
+def forecast_frame(inputs, today, day_offsets=None):
+    records = fe.forecast_sku(inputs['skus'][0], inputs, today, fe._empty_stats(), day_offsets)
+    return pd.DataFrame(records).set_index(['sku_id', 'fecha', 'tipo'])['cantidad_pronosticada']
+
+
+def test_plan_incremental_run():
+    previous = {
+        'same': ['a', TODAY.isoformat()],
+        'shifted': ['b', (TODAY - timedelta(days=3)).isoformat()],
+        'changed': ['old', TODAY.isoformat()],
+        'future': ['d', (TODAY + timedelta(days=1)).isoformat()],
+        'gone': ['e', TODAY.isoformat()],
+    }
+    fingerprints = {'same': 'a', 'shifted': 'b', 'changed': 'new', 'future': 'd', 'added': 'f'}
+
+    plan, replace_skus = fe.plan_incremental_run(fingerprints, previous, TODAY)
+
+    assert 'same' not in plan
+    assert plan['shifted'] == range(fe.HORIZON_DAYS - 3, fe.HORIZON_DAYS)
+    assert plan['changed'] is None and plan['future'] is None and plan['added'] is None
+    assert replace_skus == {'changed', 'future', 'added', 'gone'}
+
+
+def test_long_gap_replans_whole_horizon_without_replacing():
+    previous = {'sku': ['a', (TODAY - timedelta(days=fe.HORIZON_DAYS + 5)).isoformat()]}
+    plan, replace_skus = fe.plan_incremental_run({'sku': 'a'}, previous, TODAY)
+    assert plan['sku'] == range(0, fe.HORIZON_DAYS)
+    assert not replace_skus
+
+
+def test_shifted_horizon_adds_the_same_rows_as_a_full_run():
+    inputs = fe.build_forecast_inputs(make_data())
+    tomorrow = TODAY + timedelta(days=1)
+    stored = forecast_frame(inputs, TODAY)
+    full = forecast_frame(inputs, tomorrow)
+    added = forecast_frame(inputs, tomorrow, range(fe.HORIZON_DAYS - 1, fe.HORIZON_DAYS))
+
+    # Lo ya guardado sigue valiendo y el día nuevo del horizonte es el de una corrida completa
+    incremental = pd.concat([stored[stored.index.get_level_values('fecha') >= tomorrow.isoformat()], added])
+    pd.testing.assert_series_equal(incremental.sort_index(), full.sort_index())
+
+
+def test_inputs_keep_the_stored_sku_form():
+    inputs = fe.build_forecast_inputs(make_data())
+    # Un solo SKU para las tres formas del código, escrito como lo guarda la primera fuente
+    assert list(inputs['skus']) == ['0040001234']
+    assert set(forecast_frame(inputs, TODAY).index.get_level_values('sku_id')) == {'0040001234'}
+    assert fe.sku_fingerprint('0040001234', inputs) == fe.sku_fingerprint('0040001234',
+                                                                          fe.build_forecast_inputs(make_data()))
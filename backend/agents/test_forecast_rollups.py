@@ -0,0 +1,65 @@
+"""Rollups del pronóstico armados por bloque contra los armados desde el pronóstico diario completo."""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import forecast_rollups as fr
+
+
+def make_blocks(n_skus=12, days=60, block_skus=5, seed=5):
+    rng = np.random.default_rng(seed)
+    fechas = pd.date_range('2026-10-19', periods=days).strftime('%Y-%m-%d')
+    records = [{'sku_id': f'00{4000 + k}', 'fecha': f, 'tipo': tipo,
+                'cantidad_pronosticada': float(np.round(rng.gamma(2.0, 3.0), 6))}
+               for k in range(n_skus) for tipo in ('venta', 'consumo') for f in fechas]
+    per_block = block_skus * 2 * days
+    return [records[i:i + per_block] for i in range(0, len(records), per_block)]
+
+
+def test_running_sums_match_daily_frame(tmp_path, monkeypatch):
+    monkeypatch.setattr(fr, 'CONSOLIDATE_BLOCKS', 2)
+    blocks = make_blocks()
+    collector = fr.ForecastCollector(str(tmp_path / 'forecast.spool'))
+    assert sum(len(b) for b in collector.wrap(blocks)) == collector.rows
+
+    daily = pd.concat([fr.block_frame(b) for b in blocks], ignore_index=True)
+    expected = fr.sku_period_sums(daily).set_index(fr.SUM_KEYS)['cantidad'].sort_index()
+    got = collector.sums().set_index(fr.SUM_KEYS)['cantidad'].sort_index()
+    pd.testing.assert_series_equal(got, expected, check_exact=False, rtol=1e-12)
+
+    # El spool devuelve el pronóstico generado para armar la caché
+    pd.testing.assert_frame_equal(collector.frame(), daily.astype({'sku_id': 'object', 'tipo': 'object'}))
+
+
+def test_incremental_sums_add_the_kept_cache():
+    blocks = make_blocks()
+    daily = pd.concat([fr.block_frame(b) for b in blocks], ignore_index=True)
+    cached = fr.compact_for_cache(daily)
+    today = date(2026, 11, 1)
+    regenerated = daily[(daily['sku_id'] == '004003') & (daily['fecha'] >= pd.Timestamp(today))]
+
+    kept = fr.kept_forecast(cached, {'004003'}, today)
+    assert '004003' not in set(kept['sku_id']) and kept['fecha'].min() == pd.Timestamp(today)
+
+    sums = fr.combine_sums([fr.sku_period_sums(kept), fr.sku_period_sums(regenerated)])
+    merged = fr.merge_forecast(cached, regenerated, {'004003'}, today)
+    expected = fr.sku_period_sums(merged).set_index(fr.SUM_KEYS)['cantidad'].sort_index()
+    pd.testing.assert_series_equal(sums.set_index(fr.SUM_KEYS)['cantidad'].sort_index(), expected,
+                                   check_exact=False, rtol=1e-12)
+
+
+def test_build_rollups_counts_skus_per_dimension(fixture_source):
+    daily = pd.concat([fr.block_frame(b) for b in make_blocks(n_skus=4)], ignore_index=True)
+    maestro = pd.DataFrame({'codigo': ['4000', '4001', '4002'], 'jerarquia_nivel_1': ['A', 'A', 'B'],
+                            'grupo_articulos_descripcion': ['G', 'G', 'G'], 'pais': ['PE', 'PE', '']})
+    rollup = fr.build_rollups(fr.sku_period_sums(daily), maestro, 'x')
+
+    month = rollup[(rollup['periodo'] == 'mes') & (rollup['tipo'] == 'venta')
+                   & (rollup['periodo_inicio'] == '2026-11-01')]
+    by_value = month.set_index(['dimension', 'valor'])['skus'].to_dict()
+    assert by_value[('jerarquia_nivel_1', 'A')] == 2
+    assert by_value[('jerarquia_nivel_1', fr.UNCLASSIFIED)] == 1
+    assert by_value[('pais', fr.UNCLASSIFIED)] == 2
+    total = daily[(daily['tipo'] == 'venta') & (daily['fecha'].dt.month == 11)]['cantidad'].sum()
+    assert np.isclose(month[month['dimension'] == 'pais']['cantidad_pronosticada'].sum(), total)
@@ -1,14 +1,16 @@
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
-import subprocess
+from typing import Dict, List, Optional, Union
 import os
 import sys
 
 # Asegurar importaciones desde el directorio del script
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from modules.job_runner import JobRunner, sse_stream
+
 app = FastAPI(title="PCP Cognitive API")
 
 app.add_middleware(
@@ -20,10 +22,6 @@ app.add_middleware(
 )
 
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
-SYNC_SCRIPT = os.path.join(BACKEND_DIR, "daily_sync.py")
-PYTHON_EXE = sys.executable
-
-sync_in_progress = False
 
 
 class QueryRequest(BaseModel):
@@ -36,42 +34,68 @@ class AnomalyAction(BaseModel):
     notes: Optional[str] = None
 
 
-def run_sync_process():
-    global sync_in_progress
-    try:
-        print(f"Iniciando sincronización: {SYNC_SCRIPT}")
-        env = os.environ.copy()
-        env["PYTHONIOENCODING"] = "utf-8"
-        result = subprocess.run(
-            [PYTHON_EXE, SYNC_SCRIPT],
-            cwd=BACKEND_DIR,
-            capture_output=True,
-            text=True,
-            env=env
-        )
-        print("Sincronización finalizada.")
-        print("Salida:", result.stdout)
-        if result.stderr:
-            print("Errores:", result.stderr)
-    except Exception as e:
-        print(f"Error ejecutando sincronización: {e}")
-    finally:
-        sync_in_progress = False
+class ScenarioAdjustment(BaseModel):
+    field: str                                   # demanda_mes | demanda_prox_mes | produccion_programada | stock
+    multiplier: Optional[float] = None
+    value: Optional[float] = None                # reemplaza el valor en lugar de multiplicarlo
+    filters: Dict[str, Union[str, List[str]]] = {}  # sku_ids, jerarquia_nivel_1, grupo_articulos, pais
+
+
+class ScenarioRequest(BaseModel):
+    adjustments: List[ScenarioAdjustment] = []
+    demand_basis: str = "adu"                    # adu | pronostico
+    limit: Optional[int] = None
+    include_unchanged: bool = False
+
+
+def _after_sync(job):
+    # Los datos cambiaron: la próxima simulación recarga su línea base
+    from modules import scenario_engine, projection_engine
+    scenario_engine.invalidate()
+    projection_engine.invalidate()
+
+
+job_runner = JobRunner(on_finish=_after_sync)
+
+
+def _run_daily_sync(on_step_start, on_step_end):
+    # Import diferido: el primer job paga los imports de pandas/sklearn, los siguientes ya no
+    import daily_sync
+    daily_sync.run_daily_sync(on_step_start, on_step_end)
 
 
 @app.post("/run-sync")
-async def run_sync(background_tasks: BackgroundTasks):
-    global sync_in_progress
-    if sync_in_progress:
-        return {"status": "busy", "message": "Sincronización ya está en curso"}
-    sync_in_progress = True
-    background_tasks.add_task(run_sync_process)
-    return {"status": "started", "message": "Sincronización iniciada en segundo plano"}
+def run_sync():
+    """Encola la sincronización diaria en el proceso de la API; el avance se sigue en /jobs/{job_id}/events."""
+    job, created = job_runner.submit("daily_sync", _run_daily_sync)
+    if not created:
+        return {"status": "busy", "job_id": job.id, "message": "Sincronización ya está en curso"}
+    return {"status": "started", "job_id": job.id, "message": "Sincronización iniciada en segundo plano"}
 
 
 @app.get("/status")
 async def get_status():
-    return {"sync_in_progress": sync_in_progress}
+    job = job_runner.current()
+    return {"sync_in_progress": job is not None, "job": job.info() if job else None}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} no encontrado")
+    return job.info()
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events del job (step_started / step_finished / job_finished); repite desde Last-Event-ID."""
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} no encontrado")
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    return StreamingResponse(sse_stream(job, after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.post("/cognitive/query")
@@ -93,7 +117,8 @@ async def get_anomalies(limit: int = 50):
         "apikey": os.getenv("SUPABASE_KEY"),
         "Authorization": f"Bearer {os.getenv('SUPABASE_KEY')}",
     }
-    params = {"select": "*", "limit": limit, "order": "detected_at.desc"}
+    # Una fila por anomalía distinta: las que reaparecen suben por last_seen_at
+    params = {"select": "*", "limit": limit, "order": "last_seen_at.desc.nullslast,detected_at.desc"}
     try:
         response = req.get(url, headers=headers, params=params, timeout=10)
         return response.json() if response.status_code == 200 else []
@@ -122,6 +147,78 @@ async def anomaly_action(action: AnomalyAction):
         return {"success": False, "error": str(e)}
 
 
+
+# Endpoints síncronos: FastAPI los corre en su pool de hilos (la carga de la línea base bloquea)
+@app.get("/scenarios/baseline")
+def scenario_baseline():
+    """Estado de la línea base en memoria (la carga si no existe o venció)."""
+    from modules import scenario_engine
+    try:
+        return scenario_engine.get_engine().info()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post("/scenarios/reload")
+def scenario_reload():
+    """Fuerza la recarga de la línea base desde Supabase."""
+    from modules import scenario_engine
+    try:
+        return scenario_engine.get_engine(reload=True).info()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post("/scenarios/run")
+def scenario_run(request: ScenarioRequest):
+    """Recalcula stock fin de mes y cobertura del catálogo con los ajustes del escenario."""
+    from modules import scenario_engine
+    try:
+        engine = scenario_engine.get_engine()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    adjustments = [a.model_dump() for a in request.adjustments]
+    try:
+        return engine.run(adjustments, request.demand_basis, request.limit, request.include_unchanged)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/projection/summary")
+def projection_summary(status: Optional[List[str]] = Query(None), limit: Optional[int] = None):
+    """PSoH de todo el catálogo resumido por SKU (primer warning/critical, PSoH mínimo)."""
+    from modules import projection_engine
+    try:
+        engine = projection_engine.get_engine()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return engine.summary(status, limit)
+
+
+@app.post("/projection/reload")
+def projection_reload():
+    """Recalcula el PSoH aunque la versión de sincronización no haya cambiado."""
+    from modules import projection_engine
+    try:
+        return projection_engine.get_engine(reload=True).info()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/projection/{sku_id}")
+def projection_sku(sku_id: str, horizon: int = 90, almacenes: Optional[List[str]] = Query(None)):
+    """Proyección día a día de un SKU (formato ProjectionDay de utils/projection.ts)."""
+    from modules import projection_engine
+    try:
+        engine = projection_engine.get_engine()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        return engine.sku_projection(sku_id, horizon, almacenes)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -44,7 +44,7 @@ Tienes acceso a estas tablas PostgreSQL con sus columnas REALES:
   sap_consumo_sku_mensual → sku_id (TEXT=código), mes (DATE), cantidad_total_tn (NUMERIC), tipo2 (TEXT), pais (TEXT)
   sap_pronostico_diario → sku_id (TEXT), fecha (DATE), tipo (TEXT), cantidad_pronosticada (NUMERIC), metodo_usado (TEXT)
   sap_reporte_maestro → sku_id (TEXT), descripcion (TEXT), stock_hoy (NUMERIC), real_fabricado (NUMERIC), real_venta_consumo (NUMERIC), stock_fin_mes (NUMERIC)
-  ai_anomaly_alerts   → sku_id (TEXT), sku_name (TEXT), severity (TEXT), anomaly_score (NUMERIC), actual_value (NUMERIC), expected_value (NUMERIC), status (TEXT='open'/'reviewed')
+  ai_anomaly_alerts   → sku_id (TEXT), sku_name (TEXT), movement_type (TEXT='produccion'/'consumo'/'stock_mb52'), severity (TEXT), anomaly_score (NUMERIC), actual_value (NUMERIC), expected_value (NUMERIC), status (TEXT='open'/'reviewed'), occurrence_count (INT), last_seen_at (TIMESTAMPTZ)
 
 REGLAS CRÍTICAS DE SQL:
 1. SOLO SELECT. Jamás INSERT, UPDATE, DELETE, DROP, ALTER.
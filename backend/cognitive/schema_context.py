@@ -23,7 +23,7 @@ Tu tarea es traducir preguntas de negocio en SQL válido para PostgreSQL sobre e
    - Uso: Categorías de productos, nombres oficiales.
 
 5. **ai_anomaly_alerts**: Alertas generadas por la IA.
-   - Columnas: sku_id (TEXT), severity (TEXT), anomaly_score (NUMERIC), actual_value (NUMERIC), expected_value (NUMERIC), deviation_pct (NUMERIC), status (TEXT).
+   - Columnas: sku_id (TEXT), movement_type (TEXT: 'produccion', 'consumo' o 'stock_mb52'), severity (TEXT), anomaly_score (NUMERIC), actual_value (NUMERIC), expected_value (NUMERIC), deviation_pct (NUMERIC), status (TEXT), occurrence_count (INT, veces que se repitió la anomalía), last_seen_at (TIMESTAMPTZ).
    - Uso: ¿Qué anomalías hay hoy?, Ver SKUs con consumos extraños.
 
 ### REGLAS DE SQL:
@@ -0,0 +1,24 @@
+"""
+Configuración común de pytest: rutas de import como las usan los scripts (backend/ y
+backend/agents/) y una FixtureSource temporal en lugar de Supabase.
+"""
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (BACKEND_DIR, os.path.join(BACKEND_DIR, 'agents')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from modules import data_source, state_store  # noqa: E402
+
+
+@pytest.fixture
+def fixture_source(tmp_path, monkeypatch):
+    """FixtureSource vacía en tmp_path y estado local aislado; las tablas se cargan con upsert/insert."""
+    source = data_source.FixtureSource(str(tmp_path / 'fixtures'), str(tmp_path / 'output'))
+    monkeypatch.setattr(data_source, '_source', source)
+    monkeypatch.setattr(state_store, 'STATE_DIR', str(tmp_path / 'state'))
+    return source
@@ -1,6 +1,7 @@
 
 import os
 import sys
+import time
 from sync_logger import log_sync_result
 
 # Asegurar importación desde el directorio del script
@@ -10,7 +11,11 @@ from sync_utils import sync_file, sync_production_file, sync_stock_mb52, sync_pr
 from modules.api_client import call_rpc
 from agents.report_master_persistor import run_report_persistence
 from agents.forecast_engine import run_forecast
+from agents.forecast_tuner import run_tuning
 from agents.anomaly_detector import run_anomaly_audit
+from agents.ddmrp_buffers import run_ddmrp
+from agents.demand_explosion import run_explosion
+from agents.stockout_simulator import run_simulation
 
 # Absolute path to the Excel files (in OneDrive)
 BASE_PATH = r"D:\OneDrive - CORPORACIÓN ACEROS AREQUIPA SA\PCP - General"
@@ -22,65 +27,69 @@ PROGRAMA_FILE_PATH = os.path.join(BASE_PATH, r"2. CONTROL\COBERTURAS\Planes 2025
 # NOTA: La demanda proyectada (PO Histórico.xlsx) se sincroniza MENSUALMENTE
 # a mediados de mes, NO en el sync diario. Ver tarea separada para monthly_sync.
 
+def refresh_hybrid_plan():
+    res = call_rpc("refresh_inventory_hybrid_plan")
+    print(f"  Plan híbrido: {res}")
+    return 1
+
+
+# Pasos del sync diario en orden: (etiqueta, tabla de sync_status_log, función, argumentos)
+STEPS = [
+    ("Syncing Consumo Diario",         "sap_consumo_movimientos",  sync_file,              (CONSUMO_FILE_PATH, False)),
+    ("Syncing Produccion Diario",      "sap_produccion",           sync_production_file,   (PRODUCCION_FILE_PATH,)),
+    ("Syncing Programa Produccion",    "sap_programa_produccion",  sync_programa_produccion, (PROGRAMA_FILE_PATH,)),
+    ("Syncing Stock MB52",             "sap_stock_mb52",           sync_stock_mb52,        (MB52_FILE_PATH,)),
+    ("Actualizando Plan de Inventario Híbrido", "refresh_inventory_hybrid_plan_rpc", refresh_hybrid_plan, ()),
+    ("Refrescando Reporte Maestro de Proyección", "sap_reporte_maestro", run_report_persistence, ()),
+    ("Ajustando parámetros de suavización", "sap_parametros_pronostico", run_tuning, ()),
+    ("Generando Pronósticos Híbridos (90 días)", "sap_pronostico_diario", run_forecast, ()),
+    ("Calculando buffers DDMRP",       "sap_ddmrp_buffers",        run_ddmrp,              ()),
+    ("Explosionando demanda por BOM",  "sap_demanda_explosionada", run_explosion,          ()),
+    ("Simulando probabilidad de quiebre", "sap_probabilidad_quiebre", run_simulation,      ()),
+    ("Auditoría de IA: Detección de Anomalías", "ai_anomaly_alerts", run_anomaly_audit,    ()),
+]
+
+
 def run_step(label: str, table_name: str, fn, *args):
-    """Ejecuta un paso de sincronización y registra el resultado."""
+    """
+    Ejecuta un paso de sincronización y registra el resultado.
+    Retorna {'label', 'table', 'status', 'rows', 'duration_s', 'error'}.
+    """
     print(f"\n--- {label} ---")
+    start = time.perf_counter()
     try:
         result = fn(*args)
-        # Las funciones de sync_utils no retornan el conteo directamente,
-        # así que lo consultamos desde el log de sincronización.
-        # Por ahora registramos filas=0 como "éxito sin conteo exacto".
-        # TODO: refactorizar sync_utils para retornar el conteo de filas.
+        # Cada paso retorna las filas insertadas/actualizadas (las cargas de sync_utils incluidas)
         rows = result if isinstance(result, int) else 0
         log_sync_result(table_name=table_name, rows_upserted=rows, status="success")
         print(f"  [OK] {label} completado. Filas: {rows}")
+        status, error = "success", None
     except Exception as e:
         print(f"  [ERROR] Error en {label}: {e}")
         log_sync_result(table_name=table_name, rows_upserted=0, status="error", error_msg=str(e)[:500])
+        rows, status, error = 0, "error", str(e)[:500]
+    return {'label': label, 'table': table_name, 'status': status, 'rows': rows,
+            'duration_s': round(time.perf_counter() - start, 2), 'error': error}
 
 
-if __name__ == "__main__":
+def run_daily_sync(on_step_start=None, on_step_end=None):
+    """
+    Corre todos los pasos de STEPS; un error en un paso no detiene los siguientes.
+    on_step_start(i, total, label, table) y on_step_end(i, resultado) permiten seguir el avance
+    (modules/job_runner.py los usa para el streaming de /run-sync).
+    """
     print("=== Iniciando Sincronización Diaria ===")
+    results = []
+    for i, (label, table_name, fn, args) in enumerate(STEPS):
+        if on_step_start:
+            on_step_start(i, len(STEPS), label, table_name)
+        result = run_step(label, table_name, fn, *args)
+        results.append(result)
+        if on_step_end:
+            on_step_end(i, result)
+    print("\n=== Sincronización Diaria Completada ===")
+    return results
 
-    run_step("Syncing Consumo Diario",         "sap_consumo_movimientos",  sync_file,              CONSUMO_FILE_PATH, False)
-    run_step("Syncing Produccion Diario",      "sap_produccion",           sync_production_file,   PRODUCCION_FILE_PATH)
-    run_step("Syncing Programa Produccion",    "sap_programa_produccion",  sync_programa_produccion, PROGRAMA_FILE_PATH)
-    run_step("Syncing Stock MB52",             "sap_stock_mb52",           sync_stock_mb52,        MB52_FILE_PATH)
-
-    print("\n--- Actualizando Plan de Inventario Híbrido ---")
-    try:
-        res = call_rpc("refresh_inventory_hybrid_plan")
-        log_sync_result(table_name="refresh_inventory_hybrid_plan_rpc", rows_upserted=1, status="success")
-        print(f"  [OK] Plan híbrido actualizado: {res}")
-    except Exception as e:
-        print(f"  [ERROR] Error al actualizar plan híbrido: {e}")
-        log_sync_result(table_name="refresh_inventory_hybrid_plan_rpc", rows_upserted=0, status="error", error_msg=str(e)[:500])
-
-    print("\n--- Refrescando Reporte Maestro de Proyección ---")
-    try:
-        run_report_persistence()
-        log_sync_result(table_name="sap_reporte_maestro", rows_upserted=0, status="success")
-        print("  [OK] Reporte Maestro completado.")
-    except Exception as e:
-        print(f"  [ERROR] Error al refrescar reporte: {e}")
-        log_sync_result(table_name="sap_reporte_maestro", rows_upserted=0, status="error", error_msg=str(e)[:500])
-
-    print("\n--- Generando Pronósticos Híbridos (90 días) ---")
-    try:
-        forecast_count = run_forecast()
-        log_sync_result(table_name="sap_pronostico_diario", rows_upserted=forecast_count or 0, status="success")
-        print(f"  [OK] Pronósticos generados: {forecast_count} registros.")
-    except Exception as e:
-        print(f"  [ERROR] Error al generar pronósticos: {e}")
-        log_sync_result(table_name="sap_pronostico_diario", rows_upserted=0, status="error", error_msg=str(e)[:500])
-
-    print("\n--- Auditoría de IA: Detección de Anomalías ---")
-    try:
-        anomaly_count = run_anomaly_audit()
-        log_sync_result(table_name="ai_anomaly_alerts", rows_upserted=anomaly_count or 0, status="success")
-        print(f"  [OK] Auditoría completada: {anomaly_count} anomalías detectadas.")
-    except Exception as e:
-        print(f"  [ERROR] Error en auditoría de IA: {e}")
-        log_sync_result(table_name="ai_anomaly_alerts", rows_upserted=0, status="error", error_msg=str(e)[:500])
 
-    print("\n=== Sincronización Diaria Completada ===")
+if __name__ == "__main__":
+    run_daily_sync()
@@ -1,9 +1,12 @@
+import io
 import os
-import pandas as pd
+import time
 import logging
-import requests
-import json
-from modules.api_client import get_headers, post_to_supabase, SUPABASE_URL
+
+import pandas as pd
+
+from modules.data_source import get_source
+from modules.sku_codes import canonical_sku, stored_sku
 
 # Configure logging
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,77 +18,224 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+BOM_TABLE = "sap_bom_multinivel"
+# Una arista del BOM: PT → padre → componente en un nivel (índice único en sql/008_sap_bom_multinivel_edge_unique.sql)
+EDGE_KEY = ['pt_sku', 'parent_sku', 'component_sku', 'level']
+SKU_COLUMNS = ['pt_sku', 'parent_sku', 'component_sku']
+CHUNK_ROWS = 5000
+BATCH_SIZE = 1000
+DELETE_BATCH = 100
+EDGE_DELETE_BATCH = 50  # Aristas por DELETE con or=(and(...),...); acota el largo de la URL
+SNAPSHOT_RETRIES = 5
+
 def clean_bom_column(col_name):
     return col_name.strip().lower().replace(" ", "_").replace(".", "")
 
+def snapshot_workbook(file_path: str):
+    """
+    Copia el libro completo a memoria en una sola lectura (snapshot consistente aunque OneDrive/Excel
+    lo tengan abierto). Reintenta si el archivo está bloqueado momentáneamente.
+    """
+    for attempt in range(1, SNAPSHOT_RETRIES + 1):
+        try:
+            with open(file_path, 'rb') as f:
+                return io.BytesIO(f.read())
+        except PermissionError as e:
+            if attempt == SNAPSHOT_RETRIES:
+                raise
+            logging.warning(f"BOM bloqueado ({e}); reintento {attempt}/{SNAPSHOT_RETRIES - 1}")
+            time.sleep(2 * attempt)
+
+def iter_bom_chunks(workbook, chunk_rows=CHUNK_ROWS):
+    """Lee la primera hoja en modo streaming (openpyxl read_only) y entrega DataFrames de chunk_rows filas."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(workbook, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [clean_bom_column(str(c)) if c is not None else f"col_{i}" for i, c in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if any(v is not None for v in row):
+                chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        wb.close()
+
+def normalize_edges(df):
+    """
+    SKUs en la forma guardada (stored_sku), nivel entero y sin filas sin PT/componente; una fila por
+    arista (gana la última). Las aristas se identifican por los códigos canónicos (_edge_ids), así
+    '0040001234' y '40001234' son la misma arista sin reescribir lo que ya está en la tabla.
+    """
+    df = df.copy()
+    for col in SKU_COLUMNS:
+        if col in df.columns:
+            df[col] = stored_sku(df[col]).where(canonical_sku(df[col]) != '', None)
+        else:
+            df[col] = None
+    df['level'] = pd.to_numeric(df.get('level'), errors='coerce').astype('Int64')
+    df = df.dropna(subset=['pt_sku', 'component_sku'])
+    df = df[~_edge_ids(df).duplicated(keep='last').to_numpy()]
+    return df.reset_index(drop=True)
+
+def _edge_ids(df):
+    """Id de arista sobre los códigos canónicos (solo para comparar en memoria)."""
+    parts = []
+    for col in EDGE_KEY:
+        values = df[col].astype(object)
+        text = canonical_sku(values) if col in SKU_COLUMNS else values.where(values.notna(), '').astype(str)
+        parts.append(text.reset_index(drop=True))
+    return parts[0].str.cat(parts[1:], sep='|')
+
+def _value_text(df, columns):
+    """Valores comparables entre el Excel y la tabla: números con 9 decimales, texto sin espacios, nulos vacíos."""
+    out = pd.DataFrame(index=df.index)
+    for col in columns:
+        values = df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+        numeric = pd.to_numeric(values, errors='coerce')
+        if values.notna().any() and numeric[values.notna()].notna().all():
+            out[col] = numeric.round(9).map(lambda v: '' if pd.isna(v) else repr(float(v)))
+        else:
+            out[col] = values.astype(object).where(values.notna(), '').astype(str).str.strip()
+    return out
+
+def _edge_hashes(df, value_columns):
+    return pd.Series(pd.util.hash_pandas_object(_value_text(df, value_columns), index=False).to_numpy(),
+                     index=_edge_ids(df).to_numpy())
+
+def load_current_edges():
+    """BOM cargado hoy en la tabla (todas las columnas), normalizado como el Excel."""
+    current = get_source().fetch(BOM_TABLE)
+    if current.empty:
+        return current
+    return normalize_edges(current.drop(columns=['id'], errors='ignore'))
+
+def _records(df):
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
+
+def _edge_filter(edge):
+    """and(...) PostgREST de una arista; los códigos van entre comillas y los nulos con is.null."""
+    conds = []
+    for col, value in zip(EDGE_KEY, edge):
+        if pd.isna(value):
+            conds.append(f"{col}.is.null")
+        elif col == 'level':
+            conds.append(f"{col}.eq.{int(value)}")
+        else:
+            conds.append(f'{col}.eq."{value}"')
+    return 'and(' + ','.join(conds) + ')'
+
+def _delete_edges(removed, kept_pts, stats):
+    """
+    Borra aristas: PTs que desaparecen completos con un filtro in.(); el resto, EDGE_DELETE_BATCH aristas
+    por DELETE con or=(and(...),...). Suma a stats['borradas'] después de cada DELETE, así un error a mitad
+    de camino deja contado lo que sí se borró.
+    """
+    gone_pts = sorted(set(removed['pt_sku']) - set(kept_pts))
+    gone_rows = removed['pt_sku'].value_counts()
+    for i in range(0, len(gone_pts), DELETE_BATCH):
+        batch = gone_pts[i:i + DELETE_BATCH]
+        get_source().delete(BOM_TABLE, {'pt_sku': 'in.(' + ','.join(f'"{p}"' for p in batch) + ')'})
+        stats['borradas'] += int(gone_rows[batch].sum())
+    partial = removed[~removed['pt_sku'].isin(gone_pts)]
+    edges = [_edge_filter(edge) for edge in partial[EDGE_KEY].itertuples(index=False)]
+    for i in range(0, len(edges), EDGE_DELETE_BATCH):
+        batch = edges[i:i + EDGE_DELETE_BATCH]
+        get_source().delete(BOM_TABLE, {'or': '(' + ','.join(batch) + ')'})
+        stats['borradas'] += len(batch)
+
+def sync_bom_chunks(chunks, current=None, stats=None):
+    """
+    Compara los chunks del Excel con el BOM cargado por arista (pt_sku, parent_sku, component_sku, level):
+    hace upsert solo de las aristas nuevas o con valores distintos y borra las que ya no están.
+    Retorna {'nuevas', 'cambiadas', 'borradas', 'sin_cambio', 'escritas'} ('escritas': filas con upsert
+    confirmado). Si se pasa `stats`, se actualiza en el camino: ante un error refleja el avance parcial.
+    """
+    current = load_current_edges() if current is None else current
+    value_columns = None
+    current_hashes = pd.Series(dtype='uint64')
+    current_keys = pd.DataFrame(columns=SKU_COLUMNS)
+    seen = set()
+    stats = {} if stats is None else stats
+    stats.update({'nuevas': 0, 'cambiadas': 0, 'borradas': 0, 'sin_cambio': 0, 'escritas': 0})
+
+    for chunk in chunks:
+        chunk = normalize_edges(chunk)
+        if chunk.empty:
+            continue
+        if value_columns is None:
+            value_columns = [c for c in chunk.columns if c not in EDGE_KEY]
+            if not current.empty:
+                current_hashes = _edge_hashes(current, value_columns)
+                current_keys = current[SKU_COLUMNS].set_axis(_edge_ids(current).to_numpy())
+        # Una arista repetida en un chunk posterior reemplaza a la anterior
+        ids = _edge_ids(chunk).to_numpy()
+        hashes = _edge_hashes(chunk, value_columns).to_numpy()
+        previous = current_hashes.reindex(ids)
+        is_new = previous.isna().to_numpy()
+        changed = ~is_new & (previous.to_numpy() != hashes)
+        stats['nuevas'] += int(is_new.sum())
+        stats['cambiadas'] += int(changed.sum())
+        stats['sin_cambio'] += int((~is_new & ~changed).sum())
+        seen.update(ids)
+
+        # Las aristas ya cargadas se escriben con los códigos de la tabla para que el upsert caiga en su fila
+        if changed.any():
+            stored_keys = current_keys.reindex(ids[changed])
+            chunk.loc[changed, SKU_COLUMNS] = stored_keys[SKU_COLUMNS].to_numpy()
+        pending = _records(chunk[is_new | changed])
+        for i in range(0, len(pending), BATCH_SIZE):
+            batch = pending[i:i + BATCH_SIZE]
+            get_source().upsert(BOM_TABLE, batch, on_conflict=','.join(EDGE_KEY))
+            stats['escritas'] += len(batch)
+
+    if value_columns is None:
+        # Un Excel vacío no borra el BOM cargado: se asume un error de lectura
+        logging.warning("El BOM leído no tiene aristas; se conserva el BOM cargado.")
+        return stats
+
+    if not current.empty:
+        kept = _edge_ids(current).isin(seen).to_numpy()
+        removed = current[~kept]
+        if not removed.empty:
+            _delete_edges(removed, current.loc[kept, 'pt_sku'], stats)
+    return stats
+
 def sync_bom_file(file_path: str):
     logging.info(f"--- Starting BOM Sync: {file_path} ---")
-    
-    # Create temp copy to avoid file lock - using shell copy as it is more robust to locks
-    temp_path = "temp_bom_etl.xlsx"
     try:
-        import subprocess
-        # Windows copy command
-        cmd = f'copy "{file_path}" "{temp_path}"'
-        subprocess.run(cmd, shell=True, check=True)
+        workbook = snapshot_workbook(file_path)
     except Exception as e:
-        logging.error(f"Failed to copy file: {e}")
-        return
+        logging.error(f"Failed to read BOM file: {e}")
+        return 0
 
+    stats = {}
     try:
-        df = pd.read_excel(temp_path)
-        
-        # Normalize columns
-        df.columns = [clean_bom_column(c) for c in df.columns]
-        
-        # Expected columns mapping or verification
         # Actual: pt_sku, pt_description, parent_sku, parent_description, component_sku, component_description, level, ratio_mp_to_parent, total_ratio_to_pt
-        
-        records = []
-        for _, row in df.iterrows():
-            r = row.to_dict()
-            cleaned = {}
-            for k, v in r.items():
-                if pd.isna(v):
-                    cleaned[k] = None
-                else:
-                    cleaned[k] = v
-            records.append(cleaned)
-
-        if not records:
-            logging.info("No records found in BOM file.")
-            return
-
-        logging.info(f"Prepared {len(records)} records for sap_bom_multinivel.")
-
-        # Truncate table
-        del_url = f"{SUPABASE_URL}/rest/v1/sap_bom_multinivel"
-        resp = requests.delete(del_url, headers=get_headers(), params={"pt_sku": "neq.null"}) 
-        # Note: "neq.null" is a trick to delete all rows if no ID column. 
-        # Alternatively check if table has primary key. If not, delete all might be tricky with standard PostgREST if no allow_all is on.
-        # But for now assuming we can delete.
-        
-        if resp.status_code not in [200, 204]:
-             logging.warning(f"Truncate failed or returned {resp.status_code}. Response: {resp.text}")
-        else:
-             logging.info("Truncated sap_bom_multinivel successfully.")
-
-        # Upload in batches
-        batch_size = 1000
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i+batch_size]
-            try:
-                post_to_supabase("sap_bom_multinivel", batch)
-            except Exception as e:
-                logging.error(f"Error uploading BOM batch {i}: {e}")
-        
-        logging.info(f"Finished BOM sync. Total: {len(records)}")
-
+        sync_bom_chunks(iter_bom_chunks(workbook), stats=stats)
+        logging.info(f"Finished BOM sync: {stats}")
     except Exception as e:
-        logging.error(f"Error in sync_bom_file: {e}")
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        logging.error(f"Error in sync_bom_file: {e} (avance parcial: {stats})")
+    written = stats.get('escritas', 0) + stats.get('borradas', 0)
+
+    # Matriz dispersa PT × componente para la explosión de demanda (una vez por carga de BOM con cambios);
+    # también tras un error a mitad de carga, para que bom_matrix.pkl refleje lo que quedó en la tabla
+    if written:
+        try:
+            from modules.bom_explosion import refresh_bom_matrix
+            refresh_bom_matrix()
+        except Exception as e:
+            logging.error(f"Error rearmando la matriz del BOM: {e}")
+    return written
 
 if __name__ == "__main__":
     # For testing/manual run
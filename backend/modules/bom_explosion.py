@@ -0,0 +1,106 @@
+"""
+bom_explosion.py
+Explosión de demanda por BOM multinivel con matrices dispersas.
+
+sap_bom_multinivel ya trae, por cada par PT → componente, total_ratio_to_pt: la cantidad del
+componente por unidad de PT acumulada a través de todos los niveles. BomMatrix la guarda como
+una matriz dispersa PT × componente (CSR; los pares repetidos por aparecer en varias ramas se suman),
+así la explosión de cualquier cantidad de meses y orígenes es un solo producto:
+
+    demanda_componentes (periodo × componente) = demanda_pt (periodo × PT) @ BOM (PT × componente)
+
+La matriz se arma una vez por carga de BOM (etl_bom.py la guarda en backend/state/) y
+agents/demand_explosion.py la usa para materializar sap_demanda_explosionada.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from modules import state_store
+from modules.data_source import get_source
+from modules.sku_codes import canonical_sku
+
+STATE_FILE = 'bom_matrix.pkl'
+BOM_TABLE = 'sap_bom_multinivel'
+
+logger = logging.getLogger(__name__)
+
+
+class BomMatrix:
+    """BOM multinivel como matriz dispersa PT × componente con sus índices de SKU."""
+
+    def __init__(self, pts, components, matrix):
+        self.pts = pd.Index(pts, dtype=object)
+        self.components = pd.Index(components, dtype=object)
+        self.matrix = matrix.tocsr()
+
+    def __len__(self):
+        return self.matrix.nnz
+
+    def info(self):
+        return {'pts': len(self.pts), 'componentes': len(self.components), 'pares': self.matrix.nnz}
+
+    def explode(self, demand, keys=('mes',)):
+        """
+        demand: DataFrame con sku_id (PT), las columnas de `keys` y cantidad.
+        Retorna DataFrame (keys..., sku_id componente, cantidad_exploded) sin ceros.
+        """
+        keys = list(keys)
+        columns = keys + ['sku_id', 'cantidad_exploded']
+        if demand.empty:
+            return pd.DataFrame(columns=columns)
+        pt_idx = self.pts.get_indexer(canonical_sku(demand['sku_id']))
+        qty = pd.to_numeric(demand['cantidad'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+        keep = (pt_idx >= 0) & (qty != 0)
+        if not keep.any():
+            return pd.DataFrame(columns=columns)
+
+        # Periodo = combinación de `keys`; se factoriza cada columna y se combinan los códigos enteros
+        key_codes, key_values = zip(*(pd.factorize(demand.loc[keep, key]) for key in keys))
+        combined = np.ravel_multi_index(key_codes, [len(v) for v in key_values])
+        period_idx, period_values = pd.factorize(combined)
+        # Filas repetidas (mismo periodo y PT) se suman al construir la matriz
+        demand_matrix = sparse.csr_matrix((qty[keep], (period_idx, pt_idx[keep])),
+                                          shape=(len(period_values), len(self.pts)))
+        exploded = (demand_matrix @ self.matrix).tocoo()
+        nonzero = exploded.data != 0
+
+        out = pd.DataFrame(index=np.arange(nonzero.sum()))
+        picked = np.unravel_index(period_values[exploded.row[nonzero]], [len(v) for v in key_values])
+        for key, values, codes in zip(keys, key_values, picked):
+            out[key] = np.asarray(values)[codes]
+        out['sku_id'] = self.components.to_numpy(dtype=object)[exploded.col[nonzero]]
+        out['cantidad_exploded'] = exploded.data[nonzero]
+        return out[columns]
+
+
+def build_bom_matrix(df_bom):
+    """Arma BomMatrix desde los registros de sap_bom_multinivel (pt_sku, component_sku, total_ratio_to_pt)."""
+    pts = canonical_sku(df_bom['pt_sku']) if not df_bom.empty else pd.Series(dtype=object)
+    components = canonical_sku(df_bom['component_sku']) if not df_bom.empty else pd.Series(dtype=object)
+    ratio = (pd.to_numeric(df_bom['total_ratio_to_pt'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+             if not df_bom.empty else np.zeros(0))
+    # Sin PT/componente, sin ratio o la fila del propio PT: no aportan demanda derivada
+    keep = ((pts != '') & (components != '') & (pts != components)).to_numpy() & (ratio != 0)
+    pt_idx, pt_values = pd.factorize(pts[keep])
+    comp_idx, comp_values = pd.factorize(components[keep])
+    matrix = sparse.csr_matrix((ratio[keep], (pt_idx, comp_idx)), shape=(len(pt_values), len(comp_values)))
+    matrix.sum_duplicates()
+    return BomMatrix(pt_values, comp_values, matrix)
+
+
+def refresh_bom_matrix():
+    """Relee sap_bom_multinivel, arma la matriz y la guarda en backend/state/ (tras cada carga de BOM)."""
+    df_bom = get_source().fetch(BOM_TABLE, select='pt_sku,component_sku,total_ratio_to_pt')
+    bom = build_bom_matrix(df_bom)
+    state_store.save_object(STATE_FILE, bom)
+    logger.info(f"BOM: {bom.info()} ({len(df_bom)} registros)")
+    return bom
+
+
+def load_bom_matrix(refresh=False):
+    """Matriz de la última carga de BOM; se arma desde la tabla si no existe."""
+    bom = None if refresh else state_store.load_object(STATE_FILE)
+    return bom if bom is not None else refresh_bom_matrix()
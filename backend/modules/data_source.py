@@ -0,0 +1,433 @@
+"""
+data_source.py
+Capa de acceso a datos de los agentes. Por defecto lee y escribe en Supabase
+(PostgREST); en modo fixtures lee tablas desde un directorio de archivos
+Parquet/CSV y escribe las salidas en archivos locales, sin red.
+
+Selección del modo:
+  - CLI de cada agente: --fixtures DIR [--output-dir DIR]
+  - Variables de entorno: PCP_FIXTURES_DIR=DIR [PCP_OUTPUT_DIR=DIR]
+
+En modo fixtures cada tabla es el archivo <tabla>.parquet o <tabla>.csv del directorio.
+Los filtros PostgREST que usan los agentes (eq, neq, gt, gte, lt, lte, in, is, not.*),
+select, order y limit se aplican localmente, así la lógica de negocio es la misma.
+Las funciones SQL (rpc) no existen offline y retornan None, como una función sin desplegar.
+Las escrituras (insert/upsert/delete) operan sobre una copia en memoria que se vuelca a
+<output-dir>/<tabla>.csv al terminar el proceso; las lecturas posteriores de la misma
+tabla ven esas escrituras, por lo que una cadena de agentes funciona igual que en línea.
+"""
+import os
+import atexit
+import logging
+import threading
+
+import pandas as pd
+import requests
+
+FIXTURES_ENV = "PCP_FIXTURES_DIR"
+OUTPUT_ENV = "PCP_OUTPUT_DIR"
+
+# Columnas de códigos que deben leerse como texto aunque parezcan numéricas
+TEXT_COLUMNS = {
+    'sku_id', 'codigo', 'material', 'material_clave', 'sku_produccion', 'sku_consumo',
+    'pt_sku', 'parent_sku', 'component_sku', 'centro', 'almacen', 'orden', 'clase_orden',
+    'cl_movimiento', 'centro_id', 'abc_segment', 'xyz_segment', 'tipo2', 'tipo',
+}
+
+PAGE_SIZE = 1000
+
+
+class SupabaseSource:
+    """Acceso vía API REST de Supabase (comportamiento histórico de los agentes)."""
+
+    offline = False
+
+    def _url(self, table):
+        from modules.api_client import SUPABASE_URL
+        return f"{SUPABASE_URL}/rest/v1/{table}"
+
+    def _headers(self):
+        from modules.api_client import get_headers
+        return get_headers()
+
+    def fetch(self, table, params=None, select='*', paginate=True, timeout=None, strict=False):
+        """
+        Descarga registros como DataFrame (paginado con Range salvo paginate=False).
+        Un error a mitad de la paginación se registra y se retorna lo descargado hasta ahí; con
+        strict=True se propaga, para quien no puede distinguir un resultado parcial de uno real.
+        """
+        params = dict(params or {})
+        params['select'] = select
+        if not paginate:
+            resp = requests.get(self._url(table), headers=self._headers(), params=params, timeout=timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            return pd.DataFrame(data) if data else pd.DataFrame()
+
+        all_data = []
+        start = 0
+        while True:
+            headers = self._headers()
+            headers["Range"] = f"{start}-{start + PAGE_SIZE - 1}"
+            try:
+                resp = requests.get(self._url(table), headers=headers, params=params, timeout=timeout)
+                # 416: el rango pedido empieza después de la última fila (p.ej. total múltiplo de PAGE_SIZE)
+                if resp.status_code == 416:
+                    break
+                resp.raise_for_status()
+                data = resp.json()
+                if not data:
+                    break
+                all_data.extend(data)
+                if len(data) < PAGE_SIZE:
+                    break
+                start += PAGE_SIZE
+            except Exception as e:
+                if strict:
+                    raise
+                logging.error(f"Error descargando {table}: {e}")
+                break
+        return pd.DataFrame(all_data) if all_data else pd.DataFrame()
+
+    def insert(self, table, records, timeout=None):
+        """Inserta registros; lanza excepción si PostgREST responde con error."""
+        resp = requests.post(self._url(table), headers=self._headers(), json=records, timeout=timeout)
+        resp.raise_for_status()
+        return resp
+
+    def upsert(self, table, records, on_conflict, timeout=None):
+        """
+        Inserta o actualiza por la clave única `on_conflict` (columnas separadas por coma).
+        En filas existentes solo se actualizan las columnas presentes en los registros.
+        """
+        headers = self._headers()
+        headers["Prefer"] = "resolution=merge-duplicates,return=minimal"
+        resp = requests.post(self._url(table), headers=headers, params={"on_conflict": on_conflict},
+                             json=records, timeout=timeout)
+        resp.raise_for_status()
+        return resp
+
+    def update(self, table, params, values, timeout=None):
+        """
+        Actualiza (PATCH) solo las columnas de `values` en las filas que cumplen el filtro `params`;
+        a diferencia de upsert, nunca inserta. Lanza excepción si PostgREST responde con error.
+        """
+        headers = self._headers()
+        headers["Prefer"] = "return=minimal"
+        resp = requests.patch(self._url(table), headers=headers, params=params, json=values, timeout=timeout)
+        resp.raise_for_status()
+        return resp
+
+    def rpc(self, function, payload=None, paginate=True, timeout=None):
+        """
+        Llama a una función SQL (POST /rpc/<function>) que retorna filas, paginando con Range.
+        Retorna None si la función no existe en la base; otros errores se propagan, porque
+        un resultado parcial de un agregado no sirve.
+        """
+        from modules.api_client import SUPABASE_URL
+        url = f"{SUPABASE_URL}/rest/v1/rpc/{function}"
+        all_data = []
+        start = 0
+        while True:
+            headers = self._headers()
+            if paginate:
+                headers["Range"] = f"{start}-{start + PAGE_SIZE - 1}"
+            resp = requests.post(url, headers=headers, json=payload or {}, timeout=timeout)
+            if resp.status_code == 404:
+                logging.warning(f"RPC {function} no disponible: {resp.text[:200]}")
+                return None
+            # 416: el rango pedido empieza después de la última fila (p.ej. total múltiplo de PAGE_SIZE)
+            if paginate and resp.status_code == 416:
+                break
+            resp.raise_for_status()
+            data = resp.json() or []
+            all_data.extend(data)
+            if not paginate or not data or len(data) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+        return pd.DataFrame(all_data)
+
+    def delete(self, table, params):
+        """Borra las filas que cumplen el filtro. Retorna True si la respuesta fue exitosa."""
+        resp = requests.delete(self._url(table), headers=self._headers(), params=params)
+        if resp.status_code not in (200, 204):
+            logging.warning(f"DELETE {table} retornó {resp.status_code}: {resp.text[:200]}")
+            return False
+        return True
+
+
+class FixtureSource:
+    """Acceso a tablas locales (Parquet/CSV) para correr sin red."""
+
+    offline = True
+
+    def __init__(self, fixtures_dir, output_dir=None):
+        self.fixtures_dir = os.path.abspath(fixtures_dir)
+        self.output_dir = os.path.abspath(output_dir or os.path.join(self.fixtures_dir, "_output"))
+        self._tables = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    # --- Carga de tablas ---
+
+    def _read_file(self, directory, table):
+        for ext in ('.parquet', '.csv'):
+            path = os.path.join(directory, f"{table}{ext}")
+            if not os.path.exists(path):
+                continue
+            if ext == '.parquet':
+                return pd.read_parquet(path)
+            header = pd.read_csv(path, nrows=0).columns
+            dtypes = {c: str for c in header if c in TEXT_COLUMNS}
+            return pd.read_csv(path, dtype=dtypes, float_precision='round_trip')
+        return None
+
+    def _table(self, table):
+        with self._lock:
+            if table not in self._tables:
+                df = self._read_file(self.output_dir, table)
+                if df is None:
+                    df = self._read_file(self.fixtures_dir, table)
+                if df is not None and 'id' not in df.columns:
+                    # Las tablas de Supabase tienen id serial; los filtros "id=gt.0" lo usan para truncar
+                    df.insert(0, 'id', range(1, len(df) + 1))
+                self._tables[table] = df if df is not None else pd.DataFrame()
+            return self._tables[table]
+
+    # --- Filtros PostgREST ---
+
+    @staticmethod
+    def _parse_list(raw):
+        items = raw.strip()[1:-1] if raw.strip().startswith('(') else raw
+        return [i.strip().strip('"') for i in items.split(',') if i.strip()]
+
+    @staticmethod
+    def _compare(col, op, raw):
+        if op == 'is':
+            return col.isna() if raw.lower() == 'null' else col.astype(str).str.lower() == raw.lower()
+        if op == 'in':
+            values = FixtureSource._parse_list(raw)
+            if pd.api.types.is_numeric_dtype(col):
+                return col.isin(pd.to_numeric(pd.Series(values), errors='coerce'))
+            return col.astype(str).isin(values)
+        if pd.api.types.is_numeric_dtype(col):
+            value = pd.to_numeric(raw, errors='coerce')
+            target = col
+        else:
+            value = raw
+            target = col.astype(str).where(col.notna())
+        if op == 'eq':
+            return target == value
+        if op == 'neq':
+            return (target != value) & col.notna()
+        if op == 'gt':
+            return target > value
+        if op == 'gte':
+            return target >= value
+        if op == 'lt':
+            return target < value
+        if op == 'lte':
+            return target <= value
+        raise ValueError(f"Operador PostgREST no soportado en fixtures: {op}")
+
+    @staticmethod
+    def _split_logic(expr):
+        """Separa una lista lógica PostgREST por las comas de primer nivel (respeta paréntesis y comillas)."""
+        parts, current, depth, quoted = [], '', 0, False
+        for ch in expr:
+            if ch == '"':
+                quoted = not quoted
+            elif not quoted and ch == '(':
+                depth += 1
+            elif not quoted and ch == ')':
+                depth -= 1
+            elif not quoted and ch == ',' and depth == 0:
+                parts.append(current.strip())
+                current = ''
+                continue
+            current += ch
+        if current.strip():
+            parts.append(current.strip())
+        return parts
+
+    def _condition(self, df, key, raw):
+        negate = raw.startswith('not.')
+        if negate:
+            raw = raw[4:]
+        if key in ('or', 'and'):
+            # Filtro lógico: or=(a.eq.1,and(b.eq.2,c.is.null))
+            conds = []
+            for part in self._split_logic(raw.strip()[1:-1]):
+                name, paren, inner = part.partition('(')
+                if paren and name.replace('not.', '') in ('and', 'or'):
+                    prefix = 'not.' if name.startswith('not.') else ''
+                    conds.append(self._condition(df, name.replace('not.', ''), prefix + '(' + inner))
+                else:
+                    # columna.operador.valor; dentro de la lista los valores pueden ir entre comillas
+                    column, _, condition = part.partition('.')
+                    conds.append(self._condition(df, column, condition.replace('"', '')))
+            matrix = pd.concat(conds, axis=1)
+            cond = matrix.any(axis=1) if key == 'or' else matrix.all(axis=1)
+            return ~cond if negate else cond
+        op, _, value = raw.partition('.')
+        if key not in df.columns:
+            cond = pd.Series(op == 'is' and value.lower() == 'null', index=df.index)
+        else:
+            cond = self._compare(df[key], op, value).fillna(False).astype(bool)
+        return ~cond if negate else cond
+
+    def _mask(self, df, params):
+        mask = pd.Series(True, index=df.index)
+        for key, raw_values in (params or {}).items():
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict'):
+                continue
+            for raw in (raw_values if isinstance(raw_values, (list, tuple)) else [raw_values]):
+                mask &= self._condition(df, key, str(raw))
+        return mask
+
+    # --- API común ---
+
+    def fetch(self, table, params=None, select='*', paginate=True, timeout=None, strict=False):
+        params = dict(params or {})
+        select = params.pop('select', select)
+        df = self._table(table)
+        if df.empty:
+            return pd.DataFrame()
+        df = df[self._mask(df, params)]
+
+        order = params.get('order')
+        if order:
+            cols, ascending = [], []
+            for part in str(order).split(','):
+                name, _, direction = part.partition('.')
+                if name in df.columns:
+                    cols.append(name)
+                    ascending.append(not direction.startswith('desc'))
+            if cols:
+                df = df.sort_values(cols, ascending=ascending, kind='mergesort')
+        offset = int(params.get('offset', 0) or 0)
+        if 'limit' in params:
+            df = df.iloc[offset:offset + int(params['limit'])]
+        elif offset:
+            df = df.iloc[offset:]
+
+        if select and select != '*':
+            cols = [c.strip() for c in select.split(',') if c.strip() in df.columns]
+            df = df[cols]
+        return df.reset_index(drop=True).copy()
+
+    def insert(self, table, records, timeout=None):
+        if not records:
+            return None
+        with self._lock:
+            current = self._table(table)
+            new = pd.DataFrame(records)
+            if 'id' in current.columns or current.empty:
+                next_id = int(current['id'].max()) + 1 if 'id' in current.columns and len(current) else 1
+                if 'id' not in new.columns:
+                    new.insert(0, 'id', range(next_id, next_id + len(new)))
+            self._tables[table] = new if current.empty else pd.concat([current, new], ignore_index=True)
+            self._dirty.add(table)
+        return None
+
+    def upsert(self, table, records, on_conflict, timeout=None):
+        if not records:
+            return None
+        keys = [k.strip() for k in on_conflict.split(',')]
+        with self._lock:
+            current = self._table(table)
+            new = pd.DataFrame(records)
+            if current.empty or any(k not in current.columns for k in keys):
+                return self.insert(table, records)
+            index = pd.MultiIndex.from_frame(current[keys].astype(str))
+            positions = index.get_indexer(pd.MultiIndex.from_frame(new[keys].astype(str)))
+            found = positions >= 0
+            current = current.copy()
+            for col in new.columns:
+                if col not in current.columns:
+                    current[col] = None
+                elif current[col].dtype != new[col].dtype:
+                    # p.ej. None sobre una columna float: sin esto pandas rechaza la asignación
+                    current[col] = current[col].astype(object)
+                current.loc[current.index[positions[found]], col] = new.loc[found, col].values
+            self._tables[table] = current
+            self._dirty.add(table)
+            if (~found).any():
+                self.insert(table, new[~found].to_dict(orient='records'))
+        return None
+
+    def update(self, table, params, values, timeout=None):
+        with self._lock:
+            current = self._table(table)
+            if current.empty:
+                return None
+            mask = self._mask(current, params).to_numpy()
+            current = current.copy()
+            for col, value in values.items():
+                if col not in current.columns:
+                    current[col] = None
+                elif current[col].dtype != pd.Series([value]).dtype:
+                    current[col] = current[col].astype(object)
+                current.loc[mask, col] = value
+            self._tables[table] = current
+            self._dirty.add(table)
+        return None
+
+    def rpc(self, function, payload=None, paginate=True, timeout=None):
+        """Las funciones SQL no existen offline: el agente usa su camino con las tablas."""
+        return None
+
+    def delete(self, table, params):
+        with self._lock:
+            current = self._table(table)
+            if not current.empty:
+                self._tables[table] = current[~self._mask(current, params)].reset_index(drop=True)
+            self._dirty.add(table)
+        return True
+
+    def flush(self):
+        """Vuelca a disco las tablas modificadas (<output-dir>/<tabla>.csv)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            for table in sorted(self._dirty):
+                self._tables[table].to_csv(os.path.join(self.output_dir, f"{table}.csv"), index=False)
+            logging.info(f"Fixtures: {len(self._dirty)} tablas escritas en {self.output_dir}")
+            self._dirty.clear()
+
+
+_source = None
+
+
+def configure(fixtures_dir=None, output_dir=None):
+    """Fija la fuente de datos del proceso. Sin fixtures_dir se usa Supabase."""
+    global _source
+    if fixtures_dir:
+        _source = FixtureSource(fixtures_dir, output_dir)
+        logging.info(f"Modo offline: fixtures en {_source.fixtures_dir}, salidas en {_source.output_dir}")
+    else:
+        _source = SupabaseSource()
+    return _source
+
+
+def get_source():
+    """Fuente activa; la primera vez se decide por las variables de entorno."""
+    if _source is None:
+        configure(os.getenv(FIXTURES_ENV), os.getenv(OUTPUT_ENV))
+    return _source
+
+
+def add_cli_arguments(parser):
+    """Agrega --fixtures / --output-dir al parser de un agente."""
+    parser.add_argument('--fixtures', default=None,
+                        help=f"Directorio de tablas Parquet/CSV para correr sin red (o {FIXTURES_ENV})")
+    parser.add_argument('--output-dir', default=None,
+                        help=f"Directorio donde escribir las salidas en modo fixtures (o {OUTPUT_ENV})")
+
+
+def configure_from_args(args):
+    fixtures_dir = getattr(args, 'fixtures', None) or os.getenv(FIXTURES_ENV)
+    output_dir = getattr(args, 'output_dir', None) or os.getenv(OUTPUT_ENV)
+    return configure(fixtures_dir, output_dir)
@@ -1,23 +1,114 @@
+"""
+ddmrp_engine.py
+Buffers DDMRP con la lógica experta de Aceros Arequipa.
+
+calculate_buffers_batch() calcula de una vez, con arreglos NumPy, las zonas de todo el
+catálogo (roja base/alerta, amarilla, verde y sus topes); net_flow_plan() agrega la
+posición de flujo neto (disponible + en orden − demanda calificada), la zona en que cae,
+la prioridad de planificación y la orden recomendada. calculate_ddmrp_buffers() se
+conserva para un SKU y usa las mismas fórmulas.
+"""
+import numpy as np
+
+# Lead Time Factor (LTF) - Estándar Aceros
+LEAD_TIME_FACTOR = 0.2
+# Variability Factor (VF) - Tiers Expertos basados en CoV: CoV <= 0.5 → 0.2, < 0.8 → 0.4, resto 0.7
+VF_TIERS = ((0.5, 0.2), (0.8, 0.4))
+VF_MAX = 0.7
+# Umbral de pico de demanda (Order Spike Threshold) como fracción de la zona roja
+SPIKE_THRESHOLD_FACTOR = 0.5
+
+ZONES = np.array(['RED', 'YELLOW', 'GREEN', 'BLUE'])  # BLUE: sobre el tope de verde (exceso)
+
+
+def variability_factor(cov):
+    cov = np.asarray(cov, dtype=float)
+    (low_cov, low_vf), (mid_cov, mid_vf) = VF_TIERS
+    return np.select([cov <= low_cov, cov < mid_cov], [low_vf, mid_vf], default=VF_MAX)
+
+
+def calculate_buffers_batch(adu, lead_time, cov, moq=0.0, order_cycle=0.0):
+    """
+    Zonas DDMRP completas para arreglos de SKUs (escalares se difunden):
+      amarilla = ADU × LT
+      roja     = ADU × LT × LTF (base) + ADU × LT × VF (alerta)
+      verde    = máx(MOQ, ADU × ciclo de pedido, ADU × LT × LTF)
+    Retorna un dict de arreglos, incluidos los topes de cada zona.
+    """
+    adu = np.asarray(adu, dtype=float)
+    lead_time = np.asarray(lead_time, dtype=float)
+    usage = adu * lead_time
+    vf = variability_factor(cov)
+    yellow = usage
+    red_base = usage * LEAD_TIME_FACTOR
+    red_alert = usage * vf
+    red_total = red_base + red_alert
+    green = np.maximum.reduce([
+        np.broadcast_to(np.asarray(moq, dtype=float), usage.shape),
+        adu * np.asarray(order_cycle, dtype=float),
+        usage * LEAD_TIME_FACTOR,
+    ])
+    top_of_red = red_total
+    top_of_yellow = top_of_red + yellow
+    return {
+        'vf': vf,
+        'yellow': yellow,
+        'red_base': red_base,
+        'red_alert': red_alert,
+        'red_total': red_total,
+        'green': green,
+        'top_of_red': top_of_red,
+        'top_of_yellow': top_of_yellow,
+        'top_of_green': top_of_yellow + green,
+    }
+
+
+def qualified_demand(daily_demand, lead_time, red_total, spike_factor=SPIKE_THRESHOLD_FACTOR):
+    """
+    Demanda calificada por SKU a partir de la matriz SKU × día (columna 0 = hoy):
+    la demanda de hoy más los picos dentro del horizonte del lead time, es decir los días
+    cuya demanda supera spike_factor × zona roja.
+    """
+    daily_demand = np.asarray(daily_demand, dtype=float)
+    if daily_demand.ndim != 2 or daily_demand.shape[1] == 0:
+        return np.zeros(len(np.atleast_1d(lead_time)))
+    days = np.arange(1, daily_demand.shape[1])[np.newaxis, :]
+    future = daily_demand[:, 1:]
+    in_horizon = days <= np.asarray(lead_time, dtype=float)[:, np.newaxis]
+    spikes = future > (spike_factor * np.asarray(red_total, dtype=float))[:, np.newaxis]
+    return daily_demand[:, 0] + np.where(in_horizon & spikes, future, 0.0).sum(axis=1)
+
+
+def net_flow_plan(buffers, on_hand, on_order, qualified, moq=0.0):
+    """
+    Posición de flujo neto y recomendación por SKU:
+      flujo neto = disponible + en orden − demanda calificada
+      orden      = tope de verde − flujo neto si el flujo neto está en o bajo el tope de amarillo
+                   (como mínimo el MOQ), 0 si no
+      prioridad  = flujo neto / tope de verde (menor = más urgente)
+    """
+    net_flow = np.asarray(on_hand, dtype=float) + np.asarray(on_order, dtype=float) - np.asarray(qualified, dtype=float)
+    tor, toy, tog = buffers['top_of_red'], buffers['top_of_yellow'], buffers['top_of_green']
+    zone_idx = np.select([net_flow <= tor, net_flow <= toy, net_flow <= tog], [0, 1, 2], default=3)
+    reorder = net_flow <= toy
+    order_qty = np.where(reorder, np.maximum(tog - net_flow, np.asarray(moq, dtype=float)), 0.0)
+    priority = np.divide(net_flow, tog, out=np.zeros_like(net_flow), where=tog > 0)
+    return {
+        'net_flow': net_flow,
+        'zone': ZONES[zone_idx],
+        'planning_priority': priority,
+        'order_qty': order_qty,
+    }
+
+
 def calculate_ddmrp_buffers(adu, lead_time, cov):
     """
     Calcula las zonas DDMRP basadas en la lógica experta de Aceros Arequipa.
     """
-    # Lead Time Factor (LTF) - Estándar Aceros
-    ltf = 0.2
-    
-    # Variability Factor (VF) - Tiers Expertos basados en CoV
-    if cov <= 0.5: vf = 0.2
-    elif cov < 0.8: vf = 0.4
-    else: vf = 0.7
-    
-    yellow_zone = adu * lead_time
-    red_base = adu * lead_time * ltf
-    red_alert = adu * lead_time * vf
-    red_total = red_base + red_alert
-    
+    zones = calculate_buffers_batch(adu, lead_time, cov)
     return {
-        "yellow": round(yellow_zone, 2),
-        "red_base": round(red_base, 2),
-        "red_alert": round(red_alert, 2),
-        "red_total": round(red_total, 2)
+        "yellow": round(float(zones['yellow']), 2),
+        "red_base": round(float(zones['red_base']), 2),
+        "red_alert": round(float(zones['red_alert']), 2),
+        "red_total": round(float(zones['red_total']), 2)
     }
@@ -0,0 +1,147 @@
+"""
+job_runner.py
+Ejecución de la sincronización diaria dentro del proceso de la API, con avance en vivo.
+
+Antes /run-sync lanzaba `daily_sync.py` con subprocess.run: cada corrida pagaba el arranque del
+intérprete y los imports de pandas/sklearn, la salida quedaba en memoria hasta el final y el estado
+era un booleano global. JobRunner corre los pasos de daily_sync.STEPS en un hilo de trabajo del
+mismo proceso (los módulos quedan importados entre corridas) como un job con id; cada paso emite
+eventos (inicio, fin con filas y duración) que api_server.py publica como Server-Sent Events en
+/jobs/{job_id}/events. Solo corre un job a la vez; los últimos MAX_JOBS quedan consultables.
+"""
+import json
+import uuid
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_JOBS = 20
+HEARTBEAT_S = 15
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Un job con su historial de eventos; los lectores esperan eventos nuevos con `wait_events`."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.total_steps = None
+        self.status = 'queued'
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.steps = []
+        self.events = []
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('success', 'error')
+
+    def emit(self, event_type, **data):
+        with self._cond:
+            event = {'id': len(self.events), 'type': event_type, 'job_id': self.id,
+                     'timestamp': datetime.now().isoformat(), **data}
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def wait_events(self, after, timeout=HEARTBEAT_S):
+        """Eventos con id > after; espera hasta `timeout` si no hay nuevos (lista vacía = sin novedades)."""
+        with self._cond:
+            if len(self.events) <= after + 1 and not self.done:
+                self._cond.wait(timeout)
+            return self.events[after + 1:]
+
+    def info(self):
+        return {
+            'job_id': self.id, 'name': self.name, 'status': self.status, 'created_at': self.created_at,
+            'finished_at': self.finished_at, 'total_steps': self.total_steps, 'steps': list(self.steps),
+        }
+
+
+class JobRunner:
+    """Un hilo de trabajo; submit() rechaza (retorna el job en curso) si ya hay uno activo."""
+
+    def __init__(self, on_finish=None):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pcp-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._on_finish = on_finish
+
+    def current(self):
+        with self._lock:
+            return next((j for j in reversed(self._jobs.values()) if not j.done), None)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def submit(self, name, steps_fn):
+        """
+        steps_fn(on_step_start, on_step_end) corre los pasos en el hilo de trabajo (como
+        daily_sync.run_daily_sync); on_step_start recibe (índice, total de pasos, etiqueta, tabla).
+        Retorna (job, creado); si hay un job activo retorna (ese job, False).
+        """
+        with self._lock:
+            active = next((j for j in self._jobs.values() if not j.done), None)
+            if active is not None:
+                return active, False
+            job = Job(name)
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, steps_fn)
+        return job, True
+
+    def _run(self, job, steps_fn):
+        job.status = 'running'
+        job.emit('job_started', name=job.name)
+
+        def on_step_start(index, total, label, table):
+            job.total_steps = total
+            job.emit('step_started', index=index, label=label, table=table, total_steps=job.total_steps)
+
+        def on_step_end(index, result):
+            job.steps.append({'index': index, **result})
+            job.emit('step_finished', index=index, total_steps=job.total_steps, **result)
+
+        error = None
+        try:
+            steps_fn(on_step_start, on_step_end)
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.name}) falló")
+            error = str(e)[:500]
+        failed = sum(1 for s in job.steps if s['status'] == 'error')
+        status = 'error' if error or failed else 'success'
+
+        job.finished_at = datetime.now().isoformat()
+        if self._on_finish:
+            try:
+                self._on_finish(job)
+            except Exception as e:
+                logger.error(f"Error en on_finish del job {job.id}: {e}")
+        # El estado final se publica al último (quien lo ve ya puede leer los datos nuevos) y junto
+        # con su evento, para que un lector no vea el job terminado sin el job_finished
+        with job._cond:
+            job.status = status
+            job.emit('job_finished', status=status, rows=sum(s['rows'] for s in job.steps), error=error,
+                     failed_steps=failed)
+
+
+def sse_stream(job, last_event_id=-1, heartbeat_s=HEARTBEAT_S):
+    """Generador de texto SSE: repite los eventos posteriores a last_event_id y sigue hasta el fin del job."""
+    after = last_event_id
+    while True:
+        events = job.wait_events(after, heartbeat_s)
+        if not events:
+            if job.done:
+                return
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            after = event['id']
+            yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        if events[-1]['type'] == 'job_finished':
+            return
@@ -0,0 +1,440 @@
+"""
+projection_engine.py
+Proyección de stock disponible (PSoH - Projected Stock on Hand) de todo el catálogo.
+
+Versión servidor de frontend_extracted/utils/projection.ts: en lugar de proyectar un SKU a la vez
+en el navegador, arma matrices SKU × día (ayer + hoy..hoy+90) y resuelve el catálogo completo con
+una suma acumulada:
+
+    PSoH[t] = PSoH[t-1] + supply[t] − demand[t]
+
+- Stock inicial: MB52 (libre utilización + inspección de calidad, kg → t), por centro/almacén.
+- Supply: sap_programa_produccion donde el SKU es sku_produccion.
+- Demand: demanda proyectada mensual (sap_demanda_proyectada) repartida en los días hábiles del mes
+  (lunes a sábado; FEI = factor_fin_mes en la última semana si es > 1) + consumos del programa donde
+  el SKU es sku_consumo. Los meses del horizonte sin demanda proyectada toman la venta del pronóstico
+  diario (state/forecast_cache.pkl o sap_pronostico_diario).
+- Estado: critical si PSoH <= 0, warning si PSoH <= stock de seguridad (stock_seguridad del plan
+  híbrido o, si es 0, la zona roja DDMRP), healthy en el resto; las mismas reglas del frontend.
+
+El resultado se guarda por versión de sincronización (última ejecución en sync_status_log + día):
+en memoria y en backend/state/, así que se calcula una vez por sincronización y api_server.py
+solo lo sirve (/projection/*).
+"""
+import os
+import time
+import logging
+import calendar
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from modules import state_store
+from modules.data_source import get_source
+from modules.sku_codes import canonical_sku
+from modules.ddmrp_engine import calculate_buffers_batch
+
+HORIZON_DAYS = int(os.getenv('PSOH_HORIZON_DAYS', '90'))
+STATE_FILE = 'psoh_projection.pkl'
+FORECAST_CACHE_STATE = 'forecast_cache.pkl'  # Pronóstico vigente en columnas (agents/forecast_engine.py)
+DEFAULT_LEAD_TIME = 25
+STATUSES = np.array(['healthy', 'warning', 'critical'])
+INVALID_WAREHOUSES = {'NONE', 'NAN', 'N/A', ''}
+LAST_WEEK_DAYS = 7
+
+logger = logging.getLogger(__name__)
+
+
+def _numeric(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+
+
+def _round(values):
+    return np.round(np.asarray(values, dtype=float), 2)
+
+
+def _by_proceso(rows, default):
+    """cantidad_programada por (fecha, clase_proceso); clase vacía o nula toma `default`."""
+    proceso = rows['clase_proceso'].replace('', None).fillna(default).rename('clase_proceso')
+    return rows.groupby([rows['fecha'], proceso])['cantidad_programada'].sum()
+
+
+# =============================================================================
+# CALENDARIO
+# =============================================================================
+
+def working_days_in_month(year, month):
+    """Días hábiles (lunes a sábado) del mes."""
+    days = calendar.monthrange(year, month)[1]
+    return sum(1 for d in range(1, days + 1) if calendar.weekday(year, month, d) != calendar.SUNDAY)
+
+
+def horizon_dates(today, horizon=HORIZON_DAYS):
+    """Ayer (día del stock inicial) y de hoy a hoy + horizon."""
+    return pd.date_range(today - timedelta(days=1), today + timedelta(days=horizon), freq='D')
+
+
+# =============================================================================
+# CÁLCULO VECTORIZADO
+# =============================================================================
+
+def monthly_to_daily(monthly, dates, fei=None):
+    """
+    Reparte la demanda mensual (SKU × mes, columnas = periodos 'YYYY-MM' de `dates`) en los
+    días hábiles de cada mes. Retorna (venta, incremento FEI), ambas SKU × día.
+    """
+    periods = dates.to_period('M')
+    month_idx = pd.Index(monthly.columns).get_indexer(periods)
+    wd = np.array([working_days_in_month(p.year, p.month) for p in periods], dtype=float)
+    share = np.where(np.asarray(dates.dayofweek) != 6, 1.0 / wd, 0.0)  # 6 = domingo
+    venta = monthly.to_numpy(dtype=float)[:, month_idx] * share[np.newaxis, :]
+
+    increment = np.zeros_like(venta)
+    if fei is not None:
+        last_week = np.asarray(dates.day > dates.days_in_month - LAST_WEEK_DAYS)
+        fei = np.asarray(fei, dtype=float)[:, np.newaxis]
+        applies = (fei > 1) & last_week[np.newaxis, :]
+        increment = np.where(applies, venta * (fei - 1), 0.0)
+    return venta, increment
+
+
+def project(initial_stock, supply, demand):
+    """PSoH por SKU × día; la columna 0 es el stock inicial (supply y demand de esa columna se ignoran)."""
+    flow = supply - demand
+    flow[:, 0] = 0.0
+    return np.asarray(initial_stock, dtype=float)[:, np.newaxis] + np.cumsum(flow, axis=1)
+
+
+def status_codes(psoh, safety_stock):
+    """0 healthy, 1 warning (PSoH <= stock de seguridad), 2 critical (PSoH <= 0)."""
+    safety = np.asarray(safety_stock, dtype=float)[:, np.newaxis]
+    return np.select([psoh <= 0, psoh <= safety], [2, 1], default=0).astype(np.int8)
+
+
+class ProjectionEngine:
+    """
+    PSoH del catálogo calculado una vez. Matrices SKU × día (columna 0 = ayer) más los registros
+    de stock y programa por SKU para armar los desgloses de un SKU al consultarlo.
+    """
+
+    def __init__(self, skus, dates, initial_stock, safety_stock, supply, venta, fei_increment, consumo,
+                 forecast_fill, stock_rows, programa_rows, version=None):
+        self.skus = pd.Index(skus, dtype=object)
+        self.dates = dates
+        self.initial_stock = np.asarray(initial_stock, dtype=float)
+        self.safety_stock = np.asarray(safety_stock, dtype=float)
+        self.supply = supply
+        self.venta = venta
+        self.fei_increment = fei_increment
+        self.consumo = consumo
+        self.forecast_fill = forecast_fill  # SKU × día: True si la venta viene del pronóstico
+        self.demand = venta + fei_increment + consumo
+        self.psoh = project(self.initial_stock, supply, self.demand)
+        self.status = status_codes(self.psoh, self.safety_stock)
+        self.stock_rows = stock_rows
+        self.programa_rows = programa_rows
+        self.version = version
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.skus)
+
+    @property
+    def today(self):
+        return self.dates[1].date()
+
+    def info(self):
+        counts = np.bincount(self.status[:, 1:].max(axis=1), minlength=3)
+        return {
+            'skus': len(self),
+            'desde': self.dates[0].date().isoformat(),
+            'hasta': self.dates[-1].date().isoformat(),
+            'version': self.version,
+            'loaded_at': datetime.fromtimestamp(self.loaded_at).isoformat(timespec='seconds'),
+            'peor_estado': dict(zip(STATUSES.tolist(), counts.tolist())),
+        }
+
+    def summary(self, status=None, limit=None):
+        """
+        Una fila por SKU: estado de hoy, peor estado del horizonte, primer día warning/critical,
+        PSoH mínimo y PSoH al final. Ordenado por primer quiebre y PSoH mínimo.
+        """
+        horizon = self.status[:, 1:]
+        worst = horizon.max(axis=1)
+
+        def first_day(mask):
+            has = mask.any(axis=1)
+            idx = mask.argmax(axis=1) + 1
+            return np.where(has, self.dates.strftime('%Y-%m-%d').to_numpy()[idx], None)
+
+        df = pd.DataFrame({
+            'sku_id': self.skus.to_numpy(dtype=object),
+            'stock_inicial': _round(self.initial_stock),
+            'stock_seguridad': _round(self.safety_stock),
+            'estado_hoy': STATUSES[self.status[:, 1]].tolist(),
+            'peor_estado': STATUSES[worst].tolist(),
+            'primer_warning': first_day(horizon >= 1),
+            'primer_critical': first_day(horizon == 2),
+            'dias_a_quiebre': np.where((horizon == 2).any(axis=1), (horizon == 2).argmax(axis=1), -1),
+            'psoh_min': _round(self.psoh[:, 1:].min(axis=1)),
+            'psoh_final': _round(self.psoh[:, -1]),
+        })
+        if status:
+            wanted = [status] if isinstance(status, str) else list(status)
+            df = df[df['peor_estado'].isin(wanted)]
+        df['_order'] = np.where(df['dias_a_quiebre'] >= 0, df['dias_a_quiebre'], len(self.dates))
+        df = df.sort_values(['_order', 'psoh_min'], kind='mergesort').drop(columns='_order')
+        if limit:
+            df = df.head(int(limit))
+        return {**self.info(), 'rows': df.replace({np.nan: None}).to_dict(orient='records')}
+
+    def sku_projection(self, sku_id, horizon=HORIZON_DAYS, warehouses=None):
+        """
+        Proyección de un SKU con el formato de ProjectionDay del frontend (date, psoh, supply, demand,
+        status y desgloses). `warehouses` ('centro - almacen') limita el stock inicial como el filtro
+        de almacenes de StockProjection; solo desplaza la curva, no se recalcula el catálogo.
+        """
+        sku = canonical_sku([sku_id]).iloc[0]
+        row = self.skus.get_indexer([sku])[0]
+        if row < 0:
+            raise KeyError(f"SKU {sku_id} sin proyección")
+        n_days = min(int(horizon), len(self.dates) - 2) + 2
+
+        stock = self.stock_rows[self.stock_rows['sku_id'] == sku]
+        breakdown = {key: {'qty': float(round(qty, 2)), 'is_valid': True}
+                     for key, qty in stock.groupby('almacen_key', sort=False)['qty'].sum().items()}
+        shift = 0.0
+        if warehouses:
+            shift = float(stock.loc[stock['almacen_key'].isin(warehouses), 'qty'].sum()) - self.initial_stock[row]
+        psoh = self.psoh[row, :n_days] + shift
+        safety = self.safety_stock[row]
+        status = np.select([psoh <= 0, psoh <= safety], [2, 1], default=0)
+
+        programa = self.programa_rows[(self.programa_rows['sku_produccion'] == sku) |
+                                      (self.programa_rows['sku_consumo'] == sku)]
+        # Sin clase de proceso: la oferta cae en 'PRODUCCION' y el consumo en 'OTROS' (como projection.ts)
+        supply_bd = _by_proceso(programa[programa['sku_produccion'] == sku], 'PRODUCCION')
+        consumo_bd = _by_proceso(programa[programa['sku_consumo'] == sku], 'OTROS')
+
+        days = []
+        for t in range(n_days):
+            date = self.dates[t].strftime('%Y-%m-%d')
+            day = {'date': date, 'psoh': float(round(psoh[t], 2)), 'status': str(STATUSES[status[t]])}
+            if t == 0:
+                days.append({**day, 'supply': 0.0, 'demand': 0.0, 'stock_breakdown': breakdown})
+                continue
+            venta, increment = self.venta[row, t], self.fei_increment[row, t]
+            demand_bd = {}
+            if venta + increment > 0:
+                if increment > 0:
+                    demand_bd['VENTA BASE'] = float(round(venta, 2))
+                    demand_bd['ESTACIONALIDAD (FEI)'] = float(round(increment, 2))
+                else:
+                    demand_bd['PRONOSTICO' if self.forecast_fill[row, t] else 'VENTA'] = float(round(venta, 2))
+            if date in consumo_bd.index.get_level_values(0):
+                for proceso, qty in consumo_bd.loc[date].items():
+                    demand_bd[f"CONSUMO | {proceso}"] = float(round(qty, 2))
+            supply_day = supply_bd.loc[date] if date in supply_bd.index.get_level_values(0) else pd.Series(dtype=float)
+            days.append({**day,
+                         'supply': float(round(self.supply[row, t], 2)),
+                         'demand': float(round(self.demand[row, t], 2)),
+                         'supply_breakdown': {k: float(round(v, 2)) for k, v in supply_day.items()},
+                         'demand_breakdown': demand_bd})
+        return {'sku_id': sku, 'stock_seguridad': float(round(safety, 2)), 'version': self.version,
+                'projection': days}
+
+
+# =============================================================================
+# CARGA
+# =============================================================================
+
+def sync_version(today=None):
+    """Versión de los datos: día + última ejecución registrada en sync_status_log."""
+    today = today or datetime.now().date()
+    last = ''
+    try:
+        df = get_source().fetch('sync_status_log', {'order': 'executed_at.desc', 'limit': '1'},
+                                'executed_at', paginate=False, timeout=30)
+        if not df.empty:
+            last = str(df['executed_at'].iloc[0])
+    except Exception as e:
+        logger.warning(f"PSoH: no se pudo leer sync_status_log ({e})")
+    return f"{today.isoformat()}|{last}"
+
+
+def _load_stock():
+    """Stock MB52 por SKU y centro/almacén en toneladas (mismas reglas que calculateInitialStock)."""
+    df = get_source().fetch('sap_stock_mb52', select='material,centro,almacen,libre_utilizacion,inspeccion_calidad')
+    if df.empty:
+        return pd.DataFrame(columns=['sku_id', 'almacen_key', 'qty'])
+    almacen = df['almacen'].astype(str).str.strip()
+    df = df[df['almacen'].notna() & ~almacen.str.upper().isin(INVALID_WAREHOUSES)]
+    rows = pd.DataFrame({
+        'sku_id': canonical_sku(df['material']).to_numpy(dtype=object),
+        'almacen_key': (df['centro'].astype(str).str.strip() + ' - ' + df['almacen'].astype(str).str.strip()).to_numpy(),
+        'qty': (_numeric(df['libre_utilizacion']) + _numeric(df['inspeccion_calidad'])) / 1000,
+    })
+    return rows[rows['sku_id'] != '']
+
+
+def _load_programa(today, end):
+    df = get_source().fetch('sap_programa_produccion', {
+        'fecha': [f"gte.{today.isoformat()}", f"lte.{end.isoformat()}"],
+    }, 'fecha,sku_produccion,sku_consumo,cantidad_programada,clase_proceso')
+    if df.empty:
+        return pd.DataFrame(columns=['fecha', 'sku_produccion', 'sku_consumo', 'cantidad_programada', 'clase_proceso'])
+    df = df.assign(
+        fecha=pd.to_datetime(df['fecha']).dt.strftime('%Y-%m-%d'),
+        sku_produccion=canonical_sku(df['sku_produccion']),
+        sku_consumo=canonical_sku(df['sku_consumo']) if 'sku_consumo' in df else '',
+        cantidad_programada=_numeric(df['cantidad_programada']),
+    )
+    if 'clase_proceso' not in df:
+        df['clase_proceso'] = None
+    return df[df['cantidad_programada'] > 0].reset_index(drop=True)
+
+
+def _load_safety_stock(skus):
+    """stock_seguridad del plan híbrido si es > 0; si no, la zona roja DDMRP (como DataContext)."""
+    hibrido = get_source().fetch('sap_plan_inventario_hibrido', select='*')
+    fei = pd.Series(1.0, index=skus)
+    if hibrido.empty:
+        return np.zeros(len(skus)), fei.to_numpy()
+    hibrido = hibrido.assign(sku_id=canonical_sku(hibrido['sku_id'])).drop_duplicates('sku_id').set_index('sku_id')
+    maestro = get_source().fetch('sap_maestro_articulos', select='*')
+    lead_time = pd.Series(np.nan, index=hibrido.index)
+    if not maestro.empty and 'lead_time' in maestro:
+        lt = pd.Series(_numeric(maestro['lead_time']), index=canonical_sku(maestro['codigo']))
+        lead_time = lt[~lt.index.duplicated()].reindex(hibrido.index)
+    lead_time = lead_time.where(lead_time > 0, DEFAULT_LEAD_TIME)
+
+    adu = _numeric(hibrido['adu_hibrido_final'])
+    desv = _numeric(hibrido['desv_std_diaria']) if 'desv_std_diaria' in hibrido else np.zeros(len(hibrido))
+    cov = np.divide(desv, adu, out=np.zeros_like(adu), where=adu > 0)
+    red_total = calculate_buffers_batch(adu, lead_time.to_numpy(dtype=float), cov)['red_total']
+    stock_seguridad = _numeric(hibrido['stock_seguridad']) if 'stock_seguridad' in hibrido else np.zeros(len(hibrido))
+    safety = pd.Series(np.where(stock_seguridad > 0, stock_seguridad, red_total), index=hibrido.index)
+    if 'factor_fin_mes' in hibrido:
+        fei = pd.Series(pd.to_numeric(hibrido['factor_fin_mes'], errors='coerce').fillna(1.0).to_numpy(),
+                        index=hibrido.index).reindex(skus, fill_value=1.0)
+    return safety.reindex(skus, fill_value=0.0).to_numpy(dtype=float), fei.to_numpy(dtype=float)
+
+
+def _load_forecast_sales(skus, dates):
+    """Venta pronosticada SKU × día (0 si no hay pronóstico)."""
+    matrix = np.zeros((len(skus), len(dates)))
+    df = state_store.load_object(FORECAST_CACHE_STATE)
+    if df is None or df.empty:
+        df = get_source().fetch('sap_pronostico_diario', {
+            'fecha': [f"gte.{dates[1].date().isoformat()}", f"lte.{dates[-1].date().isoformat()}"],
+            'tipo': 'eq.venta',
+        }, 'sku_id,fecha,tipo,cantidad_pronosticada', timeout=60)
+        if df.empty:
+            return matrix
+        df = df.rename(columns={'cantidad_pronosticada': 'cantidad'})
+    col = dates.get_indexer(pd.to_datetime(df['fecha']).dt.normalize())
+    row = pd.Index(skus).get_indexer(canonical_sku(df['sku_id']))
+    keep = (row >= 0) & (col >= 1) & (df['tipo'].astype(str) == 'venta').to_numpy()
+    np.add.at(matrix, (row[keep], col[keep]), _numeric(df['cantidad'])[keep])
+    return matrix
+
+
+def _daily_matrix(skus, dates, sku_values, fechas, quantities):
+    matrix = np.zeros((len(skus), len(dates)))
+    row = pd.Index(skus).get_indexer(sku_values)
+    col = dates.get_indexer(pd.to_datetime(fechas))
+    keep = (row >= 0) & (col >= 1)
+    np.add.at(matrix, (row[keep], col[keep]), np.asarray(quantities, dtype=float)[keep])
+    return matrix
+
+
+def load_engine(now=None, horizon=HORIZON_DAYS, version=None):
+    """Carga entradas y calcula el PSoH del catálogo (SKUs del maestro, del stock o del programa)."""
+    now = now or datetime.now()
+    today = now.date()
+    start = time.perf_counter()
+    dates = horizon_dates(today, horizon)
+
+    stock_rows = _load_stock()
+    programa = _load_programa(today, dates[-1].date())
+    demanda = get_source().fetch('sap_demanda_proyectada', {
+        'mes': [f"gte.{dates[1].replace(day=1).date().isoformat()}", f"lte.{dates[-1].date().isoformat()}"],
+    }, 'sku_id,mes,cantidad')
+    maestro = get_source().fetch('sap_maestro_articulos', select='codigo')
+
+    sku_sources = [stock_rows['sku_id'], programa['sku_produccion'], programa['sku_consumo']]
+    if not maestro.empty:
+        sku_sources.append(canonical_sku(maestro['codigo']))
+    if not demanda.empty:
+        demanda = demanda.assign(sku_id=canonical_sku(demanda['sku_id']), cantidad=_numeric(demanda['cantidad']),
+                                 periodo=pd.to_datetime(demanda['mes'].astype(str).str[:10]).dt.to_period('M'))
+        demanda = demanda[demanda['cantidad'] > 0]
+        sku_sources.append(demanda['sku_id'])
+    skus = pd.Index(pd.concat(sku_sources, ignore_index=True).unique()).drop('', errors='ignore').sort_values()
+    if len(skus) == 0:
+        raise RuntimeError("Sin SKUs para proyectar: maestro, stock y programa vacíos")
+
+    initial = stock_rows.groupby('sku_id')['qty'].sum().reindex(skus, fill_value=0.0).to_numpy(dtype=float)
+    safety, fei = _load_safety_stock(skus)
+
+    periods = dates.to_period('M').unique()
+    if demanda.empty:
+        monthly = pd.DataFrame(0.0, index=skus, columns=periods)
+        has_month = np.zeros((len(skus), len(periods)), dtype=bool)
+    else:
+        pivot = demanda.pivot_table(index='sku_id', columns='periodo', values='cantidad', aggfunc='sum')
+        pivot = pivot.reindex(index=skus, columns=periods)
+        has_month = pivot.notna().to_numpy()
+        monthly = pivot.fillna(0.0)
+    venta, increment = monthly_to_daily(monthly, dates, fei)
+
+    # Meses sin demanda proyectada: venta del pronóstico diario (sin FEI)
+    forecast_fill = ~has_month[:, pd.Index(periods).get_indexer(dates.to_period('M'))]
+    forecast_fill[:, 0] = False
+    if forecast_fill.any():
+        forecast = _load_forecast_sales(skus, dates)
+        venta = np.where(forecast_fill, forecast, venta)
+        increment = np.where(forecast_fill, 0.0, increment)
+        forecast_fill &= forecast > 0
+
+    supply = _daily_matrix(skus, dates, programa['sku_produccion'], programa['fecha'], programa['cantidad_programada'])
+    consumo = _daily_matrix(skus, dates, programa['sku_consumo'], programa['fecha'], programa['cantidad_programada'])
+
+    engine = ProjectionEngine(skus, dates, initial, safety, supply, venta, increment, consumo, forecast_fill,
+                              stock_rows.reset_index(drop=True), programa, version=version)
+    logger.info(f"PSoH: {len(engine)} SKUs × {len(dates)} días calculados en {time.perf_counter() - start:.1f}s")
+    return engine
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine(reload=False):
+    """
+    PSoH vigente para la versión de sincronización actual: desde memoria, desde backend/state/
+    (p.ej. tras reiniciar la API) o recalculado y guardado si la versión cambió.
+    """
+    global _ENGINE
+    with _ENGINE_LOCK:
+        version = sync_version()
+        if not reload and _ENGINE is not None and _ENGINE.version == version:
+            return _ENGINE
+        if not reload:
+            stored = state_store.load_object(STATE_FILE)
+            if stored is not None and getattr(stored, 'version', None) == version:
+                _ENGINE = stored
+                return _ENGINE
+        _ENGINE = load_engine(version=version)
+        state_store.save_object(STATE_FILE, _ENGINE)
+        return _ENGINE
+
+
+def invalidate():
+    """Descarta el PSoH en memoria y en disco (al terminar una sincronización)."""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        _ENGINE = None
+        state_store.clear(STATE_FILE)
@@ -0,0 +1,312 @@
+"""
+scenario_engine.py
+Simulación what-if sobre la proyección de stock del Reporte Maestro.
+
+report_projection() contiene las fórmulas del reporte (stock_fin_mes, coverage_final,
+projected_venta_consumo, ...) sobre arreglos NumPy; la usan tanto
+agents/report_master_persistor.py como ScenarioEngine.
+
+ScenarioEngine mantiene en memoria la línea base por SKU como columnas NumPy (stock, ADU,
+factor, PO del mes y del siguiente, real y programado del mes, pronóstico del resto del mes)
+y aplica ajustes por SKU o jerarquía ("demanda del próximo mes +15% para el grupo X")
+recalculando todo el catálogo en una sola pasada vectorizada. api_server.py lo expone en
+/scenarios/*; la línea base se carga una vez y se renueva por antigüedad o tras una sincronización.
+"""
+import os
+import time
+import logging
+import threading
+import calendar
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from modules import state_store
+from modules.data_source import get_source
+from modules.sku_codes import canonical_sku, get_code_table
+
+FORECAST_CACHE_STATE = 'forecast_cache.pkl'  # Pronóstico vigente en columnas (agents/forecast_engine.py)
+DEMAND_TYPES = ('venta', 'consumo')
+BASELINE_TTL_S = int(os.getenv('SCENARIO_BASELINE_TTL_S', '900'))
+
+# Selector de la API → columna de sap_maestro_articulos
+ATTRIBUTES = {
+    'jerarquia_nivel_1': 'jerarquia_nivel_1',
+    'grupo_articulos': 'grupo_articulos_descripcion',
+    'pais': 'pais',
+}
+BASE_COLUMNS = ('stock', 'adu', 'factor', 'po_actual', 'po_prox', 'real_venta', 'real_fabricado', 'programado')
+# Campo ajustable → columna de la línea base ('demanda_mes' es la demanda proyectada del resto del mes)
+SCENARIO_FIELDS = {
+    'demanda_mes': 'demand',
+    'demanda_prox_mes': 'po_prox',
+    'produccion_programada': 'programado',
+    'stock': 'stock',
+}
+# Demanda del resto del mes: ADU × días restantes × factor (como el reporte) o suma del pronóstico diario
+DEMAND_BASES = ('adu', 'pronostico')
+COMPARED_COLUMNS = ('projected_venta_consumo', 'stock_fin_mes', 'coverage_final')
+
+logger = logging.getLogger(__name__)
+
+
+def _ratio(num, den):
+    """num / den donde den > 0, 0 en el resto (sin advertencias de división por cero)."""
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def report_projection(stock, adu, factor, po_actual, po_prox, real_venta, real_fabricado, programado,
+                      remaining_days, demand=None):
+    """
+    Fórmulas del Reporte Maestro sobre arreglos por SKU. `demand` reemplaza a
+    ADU × días restantes × factor como demanda proyectada del resto del mes.
+    """
+    if demand is None:
+        demand = adu * remaining_days * factor
+    stock_inicio_mes = stock - real_fabricado + real_venta
+    projected_fabricado = np.clip(programado - real_fabricado, 0, None)
+    stock_fin_mes = stock + projected_fabricado - demand
+    return {
+        'po_mes_actual': po_actual,
+        'coverage_initial': _ratio(stock_inicio_mes, po_actual),
+        'stock_inicio_mes': stock_inicio_mes,
+        'coverage_actual': _ratio(stock, po_actual),
+        'projected_venta_consumo': demand,
+        'projected_fabricado': projected_fabricado,
+        'stock_fin_mes': stock_fin_mes,
+        'po_prox_mes': po_prox,
+        'coverage_final': _ratio(stock_fin_mes, po_prox),
+    }
+
+
+class ScenarioEngine:
+    """Línea base del catálogo en columnas NumPy + simulación de escenarios sobre ella."""
+
+    def __init__(self, baseline, remaining_days, forecast_rest=None, today=None):
+        baseline = baseline.drop_duplicates('sku_id').reset_index(drop=True)
+        self.sku_ids = baseline['sku_id'].to_numpy(dtype=object)
+        self._sku_index = pd.Index(self.sku_ids)
+        self.descripcion = baseline['descripcion'].fillna('').to_numpy(dtype=object)
+        self.columns = {name: baseline[name].to_numpy(dtype=float) for name in BASE_COLUMNS}
+        self.attributes = {
+            key: pd.Categorical(baseline[key].fillna('').astype(str).str.strip()) if key in baseline
+            else pd.Categorical([''] * len(baseline))
+            for key in ATTRIBUTES
+        }
+        self.remaining_days = remaining_days
+        self.forecast_rest = forecast_rest
+        self.today = today or datetime.now().date()
+        self.loaded_at = time.monotonic()
+        self.loaded_at_iso = datetime.now().isoformat(timespec='seconds')
+        self._base = {}
+
+    def __len__(self):
+        return len(self.sku_ids)
+
+    def age_s(self):
+        return time.monotonic() - self.loaded_at
+
+    def info(self):
+        return {
+            'skus': len(self),
+            'remaining_days': self.remaining_days,
+            'loaded_at': self.loaded_at_iso,
+            'demand_bases': [b for b in DEMAND_BASES if b == 'adu' or self.forecast_rest is not None],
+            'fields': list(SCENARIO_FIELDS),
+            'filters': ['sku_ids'] + list(ATTRIBUTES),
+            'attribute_values': {k: [c for c in cat.categories if c] for k, cat in self.attributes.items()},
+        }
+
+    def select(self, filters):
+        """Máscara de SKUs que cumplen todos los filtros ({} = todo el catálogo)."""
+        mask = np.ones(len(self), dtype=bool)
+        for key, values in (filters or {}).items():
+            values = [values] if isinstance(values, str) else list(values)
+            if key == 'sku_ids':
+                positions = self._sku_index.get_indexer(canonical_sku(pd.Series(values, dtype=object)))
+                selected = np.zeros(len(self), dtype=bool)
+                selected[positions[positions >= 0]] = True
+            elif key in self.attributes:
+                cat = self.attributes[key]
+                wanted = cat.categories.get_indexer([str(v).strip() for v in values])
+                selected = np.isin(cat.codes, wanted[wanted >= 0])
+            else:
+                raise ValueError(f"Filtro desconocido: {key}")
+            mask &= selected
+        return mask
+
+    def _demand(self, basis):
+        if basis == 'adu':
+            c = self.columns
+            return c['adu'] * self.remaining_days * c['factor']
+        if basis == 'pronostico':
+            if self.forecast_rest is None:
+                raise ValueError("No hay pronóstico cargado: use demand_basis='adu'")
+            return self.forecast_rest.copy()
+        raise ValueError(f"demand_basis debe ser uno de {DEMAND_BASES}")
+
+    def project(self, adjustments=(), demand_basis='adu'):
+        """Proyección del catálogo con los ajustes aplicados en orden."""
+        cols = dict(self.columns)
+        demand = self._demand(demand_basis)
+        copied = set()
+        for adj in adjustments:
+            field = adj.get('field')
+            if field not in SCENARIO_FIELDS:
+                raise ValueError(f"Campo desconocido: {field}. Opciones: {list(SCENARIO_FIELDS)}")
+            mask = self.select(adj.get('filters'))
+            name = SCENARIO_FIELDS[field]
+            if name == 'demand':
+                target = demand
+            else:
+                # Copia perezosa: la línea base nunca se modifica
+                if name not in copied:
+                    cols[name] = cols[name].copy()
+                    copied.add(name)
+                target = cols[name]
+            if adj.get('value') is not None:
+                target[mask] = float(adj['value'])
+            else:
+                target[mask] *= float(1.0 if adj.get('multiplier') is None else adj['multiplier'])
+        return report_projection(remaining_days=self.remaining_days, demand=demand, **cols)
+
+    def baseline(self, demand_basis='adu'):
+        if demand_basis not in self._base:
+            self._base[demand_basis] = self.project((), demand_basis)
+        return self._base[demand_basis]
+
+    def run(self, adjustments=(), demand_basis='adu', limit=None, include_unchanged=False):
+        """
+        Compara el escenario con la línea base. Retorna el resumen del catálogo y las filas
+        por SKU (solo las que cambian, salvo include_unchanged) ordenadas por coverage_final.
+        """
+        start = time.perf_counter()
+        base = self.baseline(demand_basis)
+        scenario = self.project(adjustments, demand_basis)
+
+        changed = np.zeros(len(self), dtype=bool)
+        for col in COMPARED_COLUMNS:
+            changed |= ~np.isclose(base[col], scenario[col], rtol=0, atol=1e-9)
+        rows_mask = np.ones(len(self), dtype=bool) if include_unchanged else changed
+        idx = np.flatnonzero(rows_mask)
+        idx = idx[np.argsort(scenario['coverage_final'][idx], kind='stable')]
+        if limit:
+            idx = idx[:int(limit)]
+
+        rows = pd.DataFrame({'sku_id': self.sku_ids[idx], 'descripcion': self.descripcion[idx]})
+        for col in COMPARED_COLUMNS:
+            rows[f'{col}_base'] = np.round(base[col][idx], 4)
+            rows[f'{col}_escenario'] = np.round(scenario[col][idx], 4)
+
+        summary = {
+            'skus': len(self),
+            'skus_afectados': int(changed.sum()),
+            'stock_fin_mes_base': round(float(base['stock_fin_mes'].sum()), 2),
+            'stock_fin_mes_escenario': round(float(scenario['stock_fin_mes'].sum()), 2),
+            'quiebres_fin_mes_base': int((base['stock_fin_mes'] < 0).sum()),
+            'quiebres_fin_mes_escenario': int((scenario['stock_fin_mes'] < 0).sum()),
+            'cobertura_menor_1_base': int(((base['po_prox_mes'] > 0) & (base['coverage_final'] < 1)).sum()),
+            'cobertura_menor_1_escenario': int(((scenario['po_prox_mes'] > 0) & (scenario['coverage_final'] < 1)).sum()),
+        }
+        return {
+            'baseline': {'loaded_at': self.loaded_at_iso, 'remaining_days': self.remaining_days,
+                         'demand_basis': demand_basis},
+            'summary': summary,
+            'rows': rows.to_dict(orient='records'),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+
+
+# =============================================================================
+# CARGA DE LA LÍNEA BASE
+# =============================================================================
+
+def forecast_rest_of_month(sku_ids, today):
+    """
+    Demanda pronosticada (venta + consumo) de mañana a fin de mes por SKU, alineada a `sku_ids`.
+    Usa el pronóstico en caché del motor; si no existe, lo lee de sap_pronostico_diario.
+    Retorna None si no hay pronóstico.
+    """
+    month_end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+    df = state_store.load_object(FORECAST_CACHE_STATE)
+    if df is None or df.empty:
+        df = get_source().fetch('sap_pronostico_diario', {
+            'fecha': [f"gt.{today.isoformat()}", f"lte.{month_end.isoformat()}"],
+            'tipo': f"in.({','.join(DEMAND_TYPES)})",
+        }, 'sku_id,fecha,tipo,cantidad_pronosticada', timeout=60)
+        if df.empty:
+            return None
+        df = df.rename(columns={'cantidad_pronosticada': 'cantidad'})
+    fecha = pd.to_datetime(df['fecha']).dt.date
+    keep = (fecha > today) & (fecha <= month_end) & df['tipo'].astype(str).isin(DEMAND_TYPES)
+    per_sku = (df.loc[keep]
+               .assign(sku_id=canonical_sku(df.loc[keep, 'sku_id']),
+                       cantidad=pd.to_numeric(df.loc[keep, 'cantidad'], errors='coerce').fillna(0.0))
+               .groupby('sku_id')['cantidad'].sum())
+    return per_sku.reindex(sku_ids, fill_value=0.0).to_numpy(dtype=float)
+
+
+def load_engine(now=None):
+    """Arma la línea base con las mismas entradas del Reporte Maestro, atributos del maestro y pronóstico."""
+    # Import diferido: el persistor importa este módulo para sus fórmulas
+    from agents.report_master_persistor import load_report_inputs, report_dates
+
+    now = now or datetime.now()
+    start = time.perf_counter()
+    _, _, remaining_days = report_dates(now)
+    report = load_report_inputs(now)
+    if report is None:
+        raise RuntimeError("No se pudo cargar la línea base: maestro de artículos vacío")
+
+    baseline = pd.DataFrame({
+        'sku_id': report['codigo'].to_numpy(dtype=object),
+        'sku_code': report['sku_code'].to_numpy(),
+        'descripcion': report['descripcion_material'].to_numpy(dtype=object),
+        'stock': report['stock_actual'].to_numpy(dtype=float),
+        'adu': report['adu_hibrido_final'].to_numpy(dtype=float),
+        'factor': report['factor_fin_mes'].to_numpy(dtype=float),
+        'po_actual': report['cantidad'].to_numpy(dtype=float),
+        'po_prox': report['cantidad_po_prox'].to_numpy(dtype=float),
+        'real_venta': report['cantidad_final_tn'].to_numpy(dtype=float),
+        'real_fabricado': report['cantidad_tn'].to_numpy(dtype=float),
+        'programado': report['cantidad_programada'].to_numpy(dtype=float),
+    }).drop_duplicates('sku_id')
+
+    attrs = get_source().fetch('sap_maestro_articulos', select='codigo,' + ','.join(ATTRIBUTES.values()))
+    if not attrs.empty:
+        attrs = attrs.rename(columns={col: key for key, col in ATTRIBUTES.items()})
+        attrs['sku_code'] = get_code_table().encode(attrs['codigo'])
+        attrs = attrs[attrs['sku_code'] >= 0].drop_duplicates('sku_code')
+        present = [key for key in ATTRIBUTES if key in attrs.columns]
+        baseline = baseline.merge(attrs[['sku_code'] + present], on='sku_code', how='left')
+
+    forecast_rest = forecast_rest_of_month(baseline['sku_id'].to_numpy(dtype=object), now.date())
+    engine = ScenarioEngine(baseline, remaining_days, forecast_rest, today=now.date())
+    logger.info(f"Escenarios: línea base de {len(engine)} SKUs cargada en {time.perf_counter() - start:.1f}s "
+                f"(pronóstico {'sí' if forecast_rest is not None else 'no'})")
+    return engine
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine(reload=False, max_age_s=BASELINE_TTL_S):
+    """Motor compartido del proceso; se recarga si se pide, si venció o si cambió el día."""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        stale = (_ENGINE is None or _ENGINE.age_s() > max_age_s
+                 or _ENGINE.today != datetime.now().date())
+        if reload or stale:
+            _ENGINE = load_engine()
+        return _ENGINE
+
+
+def invalidate():
+    """Descarta la línea base (p.ej. al terminar una sincronización); la próxima consulta la recarga."""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        _ENGINE = None
@@ -0,0 +1,71 @@
+"""
+shared_arrays.py
+Arreglos numpy en memoria compartida (multiprocessing.shared_memory) para que los
+procesos de un pool lean y escriban la misma matriz sin serializarla.
+
+El proceso principal crea los bloques con SharedArrays y pasa a los workers solo
+la especificación (nombre, forma, dtype); cada worker se adjunta con attach(),
+trabaja sobre su rango de filas y se desadjunta con detach().
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    """Conjunto de arreglos compartidos creados por el proceso principal (context manager)."""
+
+    def __init__(self):
+        self._blocks = {}
+        self.arrays = {}
+        self.spec = {}
+
+    def add(self, key, source=None, shape=None, dtype=None):
+        """Crea un bloque; si se pasa `source` se copia su contenido, si no queda en cero."""
+        if source is not None:
+            source = np.ascontiguousarray(source)
+            shape, dtype = source.shape, source.dtype
+        dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if source is not None:
+            array[...] = source
+        else:
+            array.fill(0)
+        self._blocks[key] = block
+        self.arrays[key] = array
+        self.spec[key] = (block.name, tuple(shape), dtype.str)
+        return array
+
+    def close(self):
+        self.arrays.clear()
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def attach(spec):
+    """Desde un worker: adjunta los bloques descritos en `spec`. Retorna (handles, arrays)."""
+    handles, arrays = [], {}
+    for key, (name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        handles.append(block)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return handles, arrays
+
+
+def detach(handles, arrays=None):
+    """Libera las vistas y cierra los bloques adjuntados (el dueño es quien los elimina)."""
+    if arrays is not None:
+        arrays.clear()
+    for block in handles:
+        block.close()
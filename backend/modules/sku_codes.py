@@ -0,0 +1,144 @@
+"""
+sku_codes.py
+Forma canónica de los códigos de material/SKU y tabla de códigos enteros.
+
+SAP y los Excel entregan el mismo material como '000040001234', '40001234.0',
+40001234 o ' 40001234 '. canonical_sku() los lleva todos a '40001234' de forma
+vectorizada (la normalización se calcula una vez por valor distinto, no por fila).
+
+SkuCodeTable asigna a cada código canónico un entero denso y estable: la tabla
+solo crece y se persiste en backend/state/, así que el mismo SKU tiene el mismo
+código en todos los agentes y ejecuciones. Los cruces entre tablas se hacen sobre
+esos enteros (sku_categorical() / encode()) en lugar de sobre strings.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from modules import state_store
+
+STATE_FILE = "sku_codes.pkl"
+MISSING_CODE = -1
+
+# Numérico puro (opcionalmente con decimales en cero): se quitan ceros a la izquierda y el '.0'.
+# Cualquier otro código (alfanumérico, con decimales reales) solo pierde los espacios.
+_NUMERIC_ID = r'^0*(\d+?)(?:\.0*)?$'
+_EMPTY = {'', 'nan', 'none', 'null', 'nat', '<na>'}
+
+
+def canonical_sku(values):
+    """
+    Código canónico (str) para cada valor de `values` (Series, array o lista).
+    Nulos y vacíos quedan como ''. Conserva el índice si `values` es una Series.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if series.empty:
+        return series.astype(object)
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    # Flotantes enteros (40001234.0) a int antes de pasar a texto para evitar notación científica
+    as_float = pd.to_numeric(uniques, errors='coerce')
+    is_int = uniques.map(lambda v: isinstance(v, (int, float, np.integer, np.floating))
+                         and not isinstance(v, bool)) & as_float.notna() & (as_float % 1 == 0)
+    text = uniques.astype(str).str.strip()
+    if is_int.any():
+        text[is_int] = as_float[is_int].astype('int64').astype(str)
+    text = text.str.replace(_NUMERIC_ID, r'\1', regex=True)
+    text = text.mask(text.str.lower().isin(_EMPTY), '')
+    lookup = np.append(text.to_numpy(dtype=object), '')
+    return pd.Series(lookup[codes], index=series.index, dtype=object)
+
+
+def stored_sku(values):
+    """
+    Forma en que los ETL persisten los códigos (sap_stock_mb52.material, sap_maestro_articulos.codigo):
+    sin espacios y sin el sufijo '.0' del Excel, pero con los ceros a la izquierda tal como vienen, igual
+    que los movimientos (misma regla que str(v).strip() sin '.0', incluidos los nulos). Los cruces en
+    memoria usan canonical_sku().
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    text = series.map(str).astype(object)
+    return text.str.strip().str.replace(r'\.0$', '', regex=True).astype(object)
+
+
+class SkuCodeTable:
+    """Tabla de internado SKU canónico -> entero denso (solo crece)."""
+
+    def __init__(self, skus=()):
+        self._index = pd.Index(list(skus), dtype=object)
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def skus(self):
+        return self._index
+
+    def encode(self, values, grow=True, canonical=False):
+        """
+        Códigos enteros (int32) de `values`. Con grow=True los SKUs nuevos se agregan
+        al final de la tabla; con grow=False quedan en MISSING_CODE. '' siempre es MISSING_CODE.
+        """
+        canon = values if canonical else canonical_sku(values)
+        canon = canon if isinstance(canon, pd.Series) else pd.Series(canon, dtype=object)
+        codes, uniques = pd.factorize(canon)
+        positions = self._index.get_indexer(uniques)
+        if grow:
+            new = (positions < 0) & (uniques != '')
+            if new.any():
+                with self._lock:
+                    self._index = self._index.append(pd.Index(uniques[new], dtype=object))
+                    self._dirty = True
+                positions = self._index.get_indexer(uniques)
+        positions = np.where(uniques == '', MISSING_CODE, positions).astype(np.int32)
+        return positions[codes] if len(codes) else np.empty(0, dtype=np.int32)
+
+    def decode(self, codes):
+        """SKU canónico de cada código ('' para MISSING_CODE)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        lookup = np.append(self._index.to_numpy(dtype=object), '')
+        return lookup[np.where(codes < 0, len(self._index), codes)]
+
+    def categorical(self, values, canonical=False):
+        """
+        Series categórica con las categorías de la tabla completa: dos columnas
+        construidas así comparten categorías y se cruzan por sus códigos enteros.
+        """
+        codes = self.encode(values, canonical=canonical)
+        index = values.index if isinstance(values, pd.Series) else None
+        cat = pd.Categorical.from_codes(codes, categories=self._index)
+        return pd.Series(cat, index=index)
+
+    def save(self, force=False):
+        if not (self._dirty or force):
+            return
+        # Otro agente pudo agregar códigos mientras tanto: se fusiona sin renumerar los existentes
+        stored = pd.Index(list(state_store.load_object(STATE_FILE, default=[]) or []), dtype=object)
+        merged = stored.append(self._index.difference(stored, sort=False))
+        state_store.save_object(STATE_FILE, merged.tolist())
+        self._index = merged
+        self._dirty = False
+
+
+_TABLE = None
+
+
+def get_code_table():
+    """Tabla compartida del proceso, cargada una vez desde backend/state/."""
+    global _TABLE
+    if _TABLE is None:
+        _TABLE = SkuCodeTable(state_store.load_object(STATE_FILE, default=[]) or [])
+    return _TABLE
+
+
+def sku_categorical(values):
+    """Atajo: canónico + categórica sobre la tabla compartida."""
+    return get_code_table().categorical(values)
+
+
+def save_code_table():
+    if _TABLE is not None:
+        _TABLE.save()
@@ -0,0 +1,63 @@
+"""
+state_store.py
+Persistencia local del estado entre ejecuciones de los agentes
+(huellas de entrada, cachés de trabajo, marcas de agua).
+Los archivos viven en backend/state/ y pueden borrarse sin riesgo:
+el agente correspondiente hará una ejecución completa la próxima vez.
+"""
+import os
+import json
+import pickle
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STATE_DIR = os.getenv("PCP_STATE_DIR", os.path.join(BACKEND_DIR, "state"))
+
+
+def state_path(name):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def _atomic_write(path, mode, writer):
+    # Escribir a un temporal y renombrar: un corte a medio camino no deja estado corrupto
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode, **({'encoding': 'utf-8'} if 'b' not in mode else {})) as f:
+        writer(f)
+    os.replace(tmp_path, path)
+
+
+def load_json(name, default=None):
+    path = state_path(name)
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(name, obj):
+    _atomic_write(state_path(name), 'w', lambda f: json.dump(obj, f, ensure_ascii=False))
+
+
+def load_object(name, default=None):
+    """Carga un objeto serializado con pickle (DataFrames, modelos, arrays)."""
+    path = state_path(name)
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return default
+
+
+def save_object(name, obj):
+    _atomic_write(state_path(name), 'wb', lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def clear(name):
+    path = state_path(name)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,67 @@
+"""Filtros PostgREST de FixtureSource y fin de la paginación de SupabaseSource."""
+from unittest import mock
+
+import pytest
+
+from modules import data_source
+
+
+class Response:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data
+        self.text = ''
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    monkeypatch.setattr(data_source, 'PAGE_SIZE', 2)
+    monkeypatch.setattr(data_source.SupabaseSource, '_headers', lambda self: {})
+    return data_source.SupabaseSource()
+
+
+def test_fixture_or_and_filters(fixture_source):
+    fixture_source.insert('t', [
+        {'pt': '1', 'parent': None, 'level': 1},
+        {'pt': '1', 'parent': 'A', 'level': 2},
+        {'pt': '2', 'parent': None, 'level': 1},
+    ])
+    df = fixture_source.fetch('t', {'or': '(and(pt.eq."1",parent.is.null,level.eq.1),and(pt.eq."2",level.eq.1))'})
+    assert sorted(df['pt']) == ['1', '2'] and df['parent'].isna().all()
+
+
+def test_fixture_update_only_touches_matching_rows(fixture_source):
+    fixture_source.insert('t', [{'key': 'a|1', 'n': 1, 'status': 'open'}, {'key': 'b|2', 'n': 1, 'status': 'open'}])
+    fixture_source.update('t', {'key': 'eq.a|1'}, {'n': 2})
+    df = fixture_source.fetch('t').set_index('key')
+    assert df.loc['a|1', 'n'] == 2 and df.loc['b|2', 'n'] == 1
+    assert (df['status'] == 'open').all()
+
+
+@pytest.mark.parametrize('last_page', [Response(416), Response(200, [])])
+def test_rpc_stops_on_416_or_empty_page(supabase, last_page):
+    pages = [Response(200, [{'a': 1}, {'a': 2}]), last_page]
+    with mock.patch.object(data_source.requests, 'post', side_effect=pages):
+        assert list(supabase.rpc('f')['a']) == [1, 2]
+
+
+def test_strict_fetch_stops_on_416(supabase):
+    pages = [Response(200, [{'a': 1}, {'a': 2}]), Response(416)]
+    with mock.patch.object(data_source.requests, 'get', side_effect=pages):
+        assert len(supabase.fetch('t', strict=True)) == 2
+
+
+def test_strict_fetch_raises_on_errors(supabase):
+    pages = [Response(200, [{'a': 1}, {'a': 2}]), Response(500)]
+    with mock.patch.object(data_source.requests, 'get', side_effect=pages):
+        with pytest.raises(RuntimeError):
+            supabase.fetch('t', strict=True)
+    with mock.patch.object(data_source.requests, 'get', side_effect=list(pages)):
+        assert len(supabase.fetch('t')) == 2
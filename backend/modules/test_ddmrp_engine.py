@@ -0,0 +1,52 @@
+"""Zonas DDMRP en lote contra el cálculo escalar por SKU."""
+import numpy as np
+
+from modules.ddmrp_engine import (calculate_buffers_batch, calculate_ddmrp_buffers, net_flow_plan,
+                                  qualified_demand)
+
+
+def scalar_buffers(adu, lead_time, cov):
+    """Fórmulas originales de calculate_ddmrp_buffers (sin redondeo)."""
+    vf = 0.2 if cov <= 0.5 else 0.4 if cov < 0.8 else 0.7
+    return {
+        'yellow': adu * lead_time,
+        'red_base': adu * lead_time * 0.2,
+        'red_alert': adu * lead_time * vf,
+        'red_total': adu * lead_time * 0.2 + adu * lead_time * vf,
+    }
+
+
+def test_batch_matches_scalar_per_sku():
+    rng = np.random.default_rng(3)
+    adu = rng.gamma(2.0, 4.0, 500)
+    lead_time = rng.integers(1, 60, 500).astype(float)
+    # Incluye los bordes de los tramos de variabilidad
+    cov = np.concatenate([[0.5, 0.8, 0.0, 0.79999], rng.uniform(0, 1.5, 496)])
+    zones = calculate_buffers_batch(adu, lead_time, cov)
+    for i in range(len(adu)):
+        expected = scalar_buffers(adu[i], lead_time[i], cov[i])
+        for key, value in expected.items():
+            assert zones[key][i] == value
+        rounded = calculate_ddmrp_buffers(adu[i], lead_time[i], cov[i])
+        assert rounded == {key: round(value, 2) for key, value in expected.items()}
+
+
+def test_scalar_inputs_broadcast():
+    zones = calculate_buffers_batch(10.0, 5.0, 0.6, moq=100.0, order_cycle=3.0)
+    assert float(zones['green']) == 100.0
+    assert float(zones['top_of_green']) == float(zones['red_total']) + 50.0 + 100.0
+
+
+def test_net_flow_plan_zones_and_orders():
+    zones = calculate_buffers_batch(np.full(4, 10.0), np.full(4, 10.0), np.full(4, 0.3))
+    # tope de rojo 40, tope de amarillo 140, tope de verde 160
+    on_hand = np.array([30.0, 100.0, 150.0, 200.0])
+    plan = net_flow_plan(zones, on_hand, np.zeros(4), np.zeros(4))
+    assert list(plan['zone']) == ['RED', 'YELLOW', 'GREEN', 'BLUE']
+    assert np.allclose(plan['order_qty'], [130.0, 60.0, 0.0, 0.0])
+
+
+def test_qualified_demand_counts_spikes_inside_lead_time():
+    demand = np.array([[5.0, 1.0, 30.0, 1.0, 30.0]])
+    # roja 40 → umbral de pico 20; el pico del día 4 cae fuera del lead time de 3 días
+    assert qualified_demand(demand, np.array([3.0]), np.array([40.0]))[0] == 35.0
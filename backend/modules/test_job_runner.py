@@ -0,0 +1,67 @@
+"""Eventos del JobRunner y su repetición por SSE desde Last-Event-ID."""
+import json
+import threading
+
+from modules.job_runner import JobRunner, sse_stream
+
+
+def parse(chunks):
+    """Eventos (id, tipo, datos) de los bloques SSE, sin los keep-alive."""
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def steps(on_step_start, on_step_end):
+    for index, table in enumerate(['sap_a', 'sap_b']):
+        on_step_start(index, 2, f'Paso {index}', table)
+        on_step_end(index, {'status': 'success', 'rows': 10 * (index + 1), 'label': f'Paso {index}'})
+
+
+def run_job(steps_fn=steps):
+    runner = JobRunner()
+    job, created = runner.submit('test', steps_fn)
+    assert created
+    return runner, job
+
+
+def test_stream_replays_every_event_until_job_finished():
+    _, job = run_job()
+    events = parse(sse_stream(job, heartbeat_s=1))
+    assert [e[1] for e in events] == ['job_started', 'step_started', 'step_finished',
+                                      'step_started', 'step_finished', 'job_finished']
+    assert [e[0] for e in events] == list(range(6))
+    assert events[-1][2]['status'] == 'success' and events[-1][2]['rows'] == 30
+
+
+def test_reconnect_resumes_after_last_event_id():
+    _, job = run_job()
+    first = parse(sse_stream(job, heartbeat_s=1))
+    resumed = parse(sse_stream(job, last_event_id=2, heartbeat_s=1))
+    assert resumed == first[3:]
+
+
+def test_live_stream_waits_for_new_events_and_sends_keep_alive():
+    release = threading.Event()
+
+    def slow_steps(on_step_start, on_step_end):
+        on_step_start(0, 1, 'Paso lento', 'sap_a')
+        release.wait(5)
+        on_step_end(0, {'status': 'error', 'rows': 0, 'label': 'Paso lento'})
+
+    runner, job = run_job(slow_steps)
+    stream = sse_stream(job, heartbeat_s=0.05)
+    seen = []
+    for chunk in stream:
+        seen.append(chunk)
+        if chunk.startswith(':'):
+            # Mientras corre el paso no hay eventos nuevos: keep-alive, y un segundo submit no crea otro job
+            assert runner.submit('otro', steps) == (job, False)
+            release.set()
+    events = parse(seen)
+    assert events[-1][1] == 'job_finished' and events[-1][2]['status'] == 'error'
+    assert events[-1][2]['failed_steps'] == 1
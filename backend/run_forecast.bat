@@ -4,7 +4,7 @@ echo   Motor de Pronosticos Hibrido - PCP
 echo ============================================
 cd /d "%~dp0"
 
-echo [1/2] Limpiando datos historicos con IA...
+echo [1/3] Limpiando datos historicos con IA...
 py -3 agents/ai_data_cleaner.py
 if %errorlevel% neq 0 (
     echo Error durante la limpieza de datos. Cancelando pronostico.
@@ -13,7 +13,11 @@ if %errorlevel% neq 0 (
 )
 echo.
 
-echo [2/2] Generando pronosticos...
+echo [2/3] Ajustando parametros de suavizacion por SKU...
+py -3 agents/forecast_tuner.py
+echo.
+
+echo [3/3] Generando pronosticos...
 py -3 agents/forecast_engine.py
 echo.
 echo === Ejecucion completada ===
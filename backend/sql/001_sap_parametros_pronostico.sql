@@ -0,0 +1,11 @@
+-- Parámetros de suavización ajustados por SKU (agents/forecast_tuner.py).
+-- Leída por agents/forecast_engine.py; si un SKU no tiene fila se usan SES_ALPHA / CROSTON_ALPHA.
+CREATE TABLE IF NOT EXISTS public.sap_parametros_pronostico (
+    sku_id        TEXT PRIMARY KEY,
+    ses_alpha     NUMERIC NOT NULL,
+    croston_alpha NUMERIC NOT NULL,
+    ses_mse       NUMERIC,
+    croston_mse   NUMERIC,
+    n_obs         INTEGER,
+    updated_at    TIMESTAMPTZ DEFAULT now()
+);
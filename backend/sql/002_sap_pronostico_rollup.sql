@@ -0,0 +1,17 @@
+-- Agregados del pronóstico diario (agents/forecast_rollups.py, publicado por forecast_engine.py).
+-- periodo: 'semana' (periodo_inicio = lunes) o 'mes' (periodo_inicio = día 1).
+-- dimension: 'jerarquia_nivel_1', 'grupo_articulos' o 'pais'; valor: el valor de esa dimensión.
+CREATE TABLE IF NOT EXISTS public.sap_pronostico_rollup (
+    id                    BIGSERIAL PRIMARY KEY,
+    periodo               TEXT NOT NULL,
+    periodo_inicio        DATE NOT NULL,
+    dimension             TEXT NOT NULL,
+    valor                 TEXT NOT NULL,
+    tipo                  TEXT NOT NULL,
+    cantidad_pronosticada NUMERIC NOT NULL,
+    skus                  INTEGER,
+    updated_at            TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_pronostico_rollup_lookup
+    ON public.sap_pronostico_rollup (periodo, dimension, periodo_inicio);
@@ -0,0 +1,38 @@
+-- Alertas de anomalías idempotentes (agents/anomaly_detector.py).
+-- Cada alerta tiene una clave natural: sku_id|movement_type|fecha|source_ref (orden del
+-- registro de origen). Una anomalía que vuelve a aparecer no genera otra fila: el detector
+-- suma occurrence_count y renueva last_seen_at con un upsert por alert_key.
+ALTER TABLE public.ai_anomaly_alerts
+    ADD COLUMN IF NOT EXISTS alert_key        TEXT,
+    ADD COLUMN IF NOT EXISTS fecha            DATE,
+    ADD COLUMN IF NOT EXISTS source_ref       TEXT,
+    ADD COLUMN IF NOT EXISTS occurrence_count INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS last_seen_at     TIMESTAMPTZ DEFAULT now();
+
+ALTER TABLE public.ai_anomaly_alerts ALTER COLUMN status SET DEFAULT 'open';
+
+-- Historial previo (sin registro de origen): las repeticiones de un mismo SKU, tipo y valor
+-- real se colapsan en la alerta más antigua, conservando el conteo y la última detección.
+WITH grouped AS (
+    SELECT id,
+           FIRST_VALUE(id) OVER w AS keep_id,
+           COUNT(*)        OVER (PARTITION BY sku_id, movement_type, actual_value) AS n,
+           MAX(detected_at) OVER (PARTITION BY sku_id, movement_type, actual_value) AS last_seen
+    FROM public.ai_anomaly_alerts
+    WHERE alert_key IS NULL
+    WINDOW w AS (PARTITION BY sku_id, movement_type, actual_value ORDER BY detected_at, id)
+)
+UPDATE public.ai_anomaly_alerts a
+SET occurrence_count = g.n,
+    last_seen_at     = g.last_seen,
+    alert_key        = a.sku_id || '|' || a.movement_type || '|legacy|' || a.actual_value::TEXT
+FROM grouped g
+WHERE a.id = g.id AND g.id = g.keep_id;
+
+DELETE FROM public.ai_anomaly_alerts WHERE alert_key IS NULL;
+
+ALTER TABLE public.ai_anomaly_alerts ALTER COLUMN alert_key SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS ai_anomaly_alerts_alert_key_idx
+    ON public.ai_anomaly_alerts (alert_key);
+CREATE INDEX IF NOT EXISTS ai_anomaly_alerts_last_seen_idx
+    ON public.ai_anomaly_alerts (last_seen_at DESC);
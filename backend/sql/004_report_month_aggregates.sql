@@ -0,0 +1,33 @@
+-- Sumas por SKU del mes en curso para agents/report_master_persistor.py.
+-- El agente llama POST /rpc/report_month_aggregates {"p_desde": "YYYY-MM-01"} y recibe una fila
+-- por (origen, sku_id) en lugar de todos los movimientos del mes. Mismos filtros que el cálculo
+-- local de respaldo (aggregate_month_locally):
+--   real_venta     → sap_consumo_movimientos con tipo2 VENTA/CONSUMO/TRASPASO, suma cantidad_final_tn
+--   real_fabricado → sap_produccion, suma cantidad_tn
+--   programado     → sap_programa_produccion, suma cantidad_programada
+CREATE OR REPLACE FUNCTION public.report_month_aggregates(p_desde DATE)
+RETURNS TABLE (origen TEXT, sku_id TEXT, cantidad NUMERIC)
+LANGUAGE sql STABLE
+AS $$
+    SELECT 'real_venta', m.material_clave::TEXT, COALESCE(SUM(m.cantidad_final_tn), 0)
+    FROM public.sap_consumo_movimientos m
+    WHERE m.fecha >= p_desde
+      AND m.tipo2 ~* '(VENTA|CONSUMO|TRASPASO)'
+    GROUP BY m.material_clave
+    UNION ALL
+    SELECT 'real_fabricado', p.material::TEXT, COALESCE(SUM(p.cantidad_tn), 0)
+    FROM public.sap_produccion p
+    WHERE p.fecha_contabilizacion >= p_desde
+    GROUP BY p.material
+    UNION ALL
+    SELECT 'programado', g.sku_produccion::TEXT, COALESCE(SUM(g.cantidad_programada), 0)
+    FROM public.sap_programa_produccion g
+    WHERE g.fecha >= p_desde
+    GROUP BY g.sku_produccion
+    ORDER BY 1, 2
+$$;
+
+-- Los filtros por fecha usan estos índices (no-op si ya existen)
+CREATE INDEX IF NOT EXISTS idx_consumo_movimientos_fecha ON public.sap_consumo_movimientos (fecha);
+CREATE INDEX IF NOT EXISTS idx_produccion_fecha_contab ON public.sap_produccion (fecha_contabilizacion);
+CREATE INDEX IF NOT EXISTS idx_programa_produccion_fecha ON public.sap_programa_produccion (fecha);
@@ -0,0 +1,10 @@
+-- Publicación incremental del Reporte Maestro (agents/report_master_persistor.py).
+-- El agente hace upsert por sku_id de las filas que cambiaron, así que sku_id debe ser único:
+-- se eliminan duplicados previos (se conserva la fila física más antigua) y se crea el índice.
+DELETE FROM public.sap_reporte_maestro a
+USING public.sap_reporte_maestro b
+WHERE a.sku_id = b.sku_id
+  AND a.ctid > b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS sap_reporte_maestro_sku_id_idx
+    ON public.sap_reporte_maestro (sku_id);
@@ -0,0 +1,31 @@
+-- Buffers DDMRP por SKU (agents/ddmrp_buffers.py; se vacía y recarga en cada corrida).
+-- Topes: top_of_red = roja, top_of_yellow = roja + amarilla, top_of_green = roja + amarilla + verde.
+-- zone: 'RED' | 'YELLOW' | 'GREEN' | 'BLUE' (flujo neto sobre el tope de verde).
+CREATE TABLE IF NOT EXISTS public.sap_ddmrp_buffers (
+    id                BIGSERIAL PRIMARY KEY,
+    sku_id            TEXT NOT NULL,
+    adu               NUMERIC,
+    lead_time         NUMERIC,
+    cov               NUMERIC,
+    moq               NUMERIC,
+    order_cycle       NUMERIC,
+    red_base          NUMERIC,
+    red_alert         NUMERIC,
+    red_total         NUMERIC,
+    yellow            NUMERIC,
+    green             NUMERIC,
+    top_of_red        NUMERIC,
+    top_of_yellow     NUMERIC,
+    top_of_green      NUMERIC,
+    on_hand           NUMERIC,
+    on_order          NUMERIC,
+    qualified_demand  NUMERIC,
+    net_flow          NUMERIC,
+    zone              TEXT,
+    planning_priority NUMERIC,
+    order_qty         NUMERIC,
+    updated_at        TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ddmrp_buffers_sku ON public.sap_ddmrp_buffers (sku_id);
+CREATE INDEX IF NOT EXISTS idx_ddmrp_buffers_priority ON public.sap_ddmrp_buffers (zone, planning_priority);
@@ -0,0 +1,14 @@
+-- Demanda explosionada de componentes (agents/demand_explosion.py; se vacía y recarga en cada corrida).
+-- origen: 'demanda_proyectada' (equivale a view_exploded_demand) o 'pronostico' (venta pronosticada por mes).
+-- mes: primer día del mes. sku_id: componente.
+CREATE TABLE IF NOT EXISTS public.sap_demanda_explosionada (
+    id                BIGSERIAL PRIMARY KEY,
+    origen            TEXT NOT NULL,
+    mes               DATE NOT NULL,
+    sku_id            TEXT NOT NULL,
+    cantidad_exploded NUMERIC NOT NULL,
+    updated_at        TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_demanda_explosionada_lookup
+    ON public.sap_demanda_explosionada (origen, mes, sku_id);
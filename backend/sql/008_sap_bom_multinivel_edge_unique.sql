@@ -0,0 +1,16 @@
+-- Clave de arista del BOM para la carga incremental de etl_bom.py (upsert on_conflict y borrados por arista).
+-- Los códigos se dejan como están: etl_bom.py compara las aristas por código canónico en memoria y escribe
+-- y borra con la forma guardada en la tabla.
+
+-- 1. Una fila por arista (se conserva la última cargada), requisito del índice único
+DELETE FROM public.sap_bom_multinivel a
+USING public.sap_bom_multinivel b
+WHERE a.pt_sku = b.pt_sku
+  AND a.parent_sku IS NOT DISTINCT FROM b.parent_sku
+  AND a.component_sku = b.component_sku
+  AND a.level IS NOT DISTINCT FROM b.level
+  AND a.ctid < b.ctid;
+
+-- 2. Índice único; NULLS NOT DISTINCT (PostgreSQL 15+) para aristas sin padre o sin nivel
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bom_multinivel_edge
+    ON public.sap_bom_multinivel (pt_sku, parent_sku, component_sku, level) NULLS NOT DISTINCT;
@@ -0,0 +1,18 @@
+-- Probabilidad de quiebre por SKU (agents/stockout_simulator.py; se vacía y recarga en cada corrida).
+-- p_quiebre_Nd: fracción de trayectorias Monte Carlo con stock <= 0 antes del día N.
+-- dias_cobertura_*: día del primer quiebre (censurado al horizonte), promedio y percentil 10.
+CREATE TABLE IF NOT EXISTS public.sap_probabilidad_quiebre (
+    id                       BIGSERIAL PRIMARY KEY,
+    sku_id                   TEXT NOT NULL UNIQUE,
+    p_quiebre_7d             NUMERIC,
+    p_quiebre_14d            NUMERIC,
+    p_quiebre_30d            NUMERIC,
+    p_quiebre_horizonte      NUMERIC NOT NULL,
+    dias_cobertura_esperados NUMERIC NOT NULL,
+    dias_cobertura_p10       NUMERIC NOT NULL,
+    metodo                   TEXT NOT NULL,
+    stock_actual             NUMERIC,
+    horizonte_dias           INTEGER NOT NULL,
+    trayectorias             INTEGER NOT NULL,
+    updated_at               TIMESTAMPTZ DEFAULT now()
+);
@@ -51,6 +51,15 @@ def log_sync_result(
         "error_msg": error_msg,
         "executed_at": datetime.now().isoformat(),
     }
+    try:
+        # En modo fixtures (sin red) el log queda en la tabla local
+        from modules.data_source import get_source
+        source = get_source()
+        if source.offline:
+            source.insert("sync_status_log", [payload])
+            return
+    except ImportError:
+        pass
     try:
         headers = get_headers()
         # Prefer: return=minimal para no recibir el registro completo
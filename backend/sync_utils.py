@@ -8,6 +8,7 @@ from datetime import datetime
 from modules.api_client import get_headers, post_to_supabase, SUPABASE_URL
 from modules.transformers import *
 from modules.validators import generate_signature, generate_production_signature
+from modules.sku_codes import stored_sku
 
 # Configure logging
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -75,8 +76,9 @@ def sync_file(file_path: str, is_historical: bool = False, dry_run: bool = False
     logging.info(f"--- Starting Sync: {file_path} ---")
     if not os.path.exists(file_path):
         logging.error(f"File not found: {file_path}")
-        return
+        return 0
 
+    uploaded = 0
     try:
         df = pd.read_excel(file_path, header=1)
         df = cleanup_column_names(df)
@@ -85,7 +87,7 @@ def sync_file(file_path: str, is_historical: bool = False, dry_run: bool = False
         
         if df.empty:
             logging.info("No valid records found in file.")
-            return
+            return 0
 
         existing_signatures = fetch_existing_signatures(df['fecha'].min())
         
@@ -116,22 +118,26 @@ def sync_file(file_path: str, is_historical: bool = False, dry_run: bool = False
             for i in range(0, len(new_rows), batch_size):
                 batch = new_rows[i:i+batch_size]
                 post_to_supabase("sap_consumo_movimientos", batch)
+                uploaded += len(batch)
                 logging.info(f"Uploaded batch {i} - {i+len(batch)}")
             logging.info(f"Finished. Total uploaded: {len(new_rows)}")
         else:
             logging.info("No new rows to upload.")
+        return uploaded
     except Exception as e:
         err_msg = str(e)
         if hasattr(e, 'response') and e.response is not None:
             err_msg += f" Response: {e.response.text}"
         logging.error(f"Error in sync_file: {err_msg}")
+        return uploaded
 
 def sync_production_file(file_path: str, dry_run: bool = False):
     logging.info(f"--- Starting Production Sync: {file_path} ---")
     if not os.path.exists(file_path):
         logging.error(f"File not found: {file_path}")
-        return
+        return 0
 
+    uploaded = 0
     try:
         df = pd.read_excel(file_path, header=3)
         # Rename columns
@@ -139,14 +145,14 @@ def sync_production_file(file_path: str, dry_run: bool = False):
         
         if 'fecha_contabilizacion' not in df.columns:
             logging.error("Column 'fecha_contabilizacion' not found after cleaning.")
-            return
+            return 0
 
         df['fecha_contabilizacion'] = df['fecha_contabilizacion'].apply(parse_date)
         df = df.dropna(subset=['fecha_contabilizacion'])
         
         if df.empty:
             logging.info("No valid records found.")
-            return
+            return 0
 
         existing_signatures = fetch_existing_production_signatures(df['fecha_contabilizacion'].min())
         
@@ -174,23 +180,27 @@ def sync_production_file(file_path: str, dry_run: bool = False):
             for i in range(0, len(new_rows), batch_size):
                 batch = new_rows[i:i+batch_size]
                 post_to_supabase("sap_produccion", batch)
+                uploaded += len(batch)
                 logging.info(f"Uploaded production batch {i}")
             logging.info(f"Finished Production sync. Total: {len(new_rows)}")
         else:
             logging.info("No new production rows.")
+        return uploaded
 
     except Exception as e:
         err_msg = str(e)
         if hasattr(e, 'response') and e.response is not None:
             err_msg += f" Response: {e.response.text}"
         logging.error(f"Error in sync_production_file: {err_msg}")
+        return uploaded
 
 def sync_stock_mb52(file_path: str, dry_run: bool = False):
     logging.info(f"--- Starting Stock MB52 Sync: {file_path} ---")
     if not os.path.exists(file_path):
         logging.error(f"File not found: {file_path}")
-        return
+        return 0
 
+    uploaded = 0
     try:
         df = pd.read_excel(file_path)
         # Rename columns
@@ -207,6 +217,10 @@ def sync_stock_mb52(file_path: str, dry_run: bool = False):
             'stock_no_libre', 'bloqueado', 'stock_en_transito'
         }
 
+        # Material ID without the '.0' suffix (leading zeros kept, as in the movement tables), vectorized
+        if 'material' in df.columns:
+            df['material'] = stored_sku(df['material'])
+
         records = []
         for _, row in df.iterrows():
             r = row.to_dict()
@@ -214,11 +228,8 @@ def sync_stock_mb52(file_path: str, dry_run: bool = False):
             for k, v in r.items():
                 if k not in allowed_columns: continue
                 
-                # Special handling for material ID (remove .0 suffix if present)
                 if k == 'material':
-                    val_str = str(v).strip()
-                    if val_str.endswith('.0'): val_str = val_str[:-2]
-                    cleaned[k] = val_str
+                    cleaned[k] = v
                     continue
 
                 # Numeric coercion
@@ -257,15 +268,18 @@ def sync_stock_mb52(file_path: str, dry_run: bool = False):
                 batch = records[i:i+batch_size]
                 try:
                     post_to_supabase("sap_stock_mb52", batch)
+                    uploaded += len(batch)
                 except Exception as e:
                     err_msg = str(e)
                     if hasattr(e, 'response') and e.response is not None:
                         err_msg += f" Response: {e.response.text}"
                     logging.error(f"Error uploading MB52 batch {i}: {err_msg}")
-            logging.info(f"Finished MB52 sync. Total uploaded: {len(records)}")
+            logging.info(f"Finished MB52 sync. Total uploaded: {uploaded}/{len(records)}")
+        return uploaded
 
     except Exception as e:
         logging.error(f"Error in sync_stock_mb52: {e}")
+        return uploaded
 
 
 def sync_master_data(file_path, sheet_name, table_name, clean_col_func, pk_col, usecols=None):
@@ -295,6 +309,11 @@ def sync_master_data(file_path, sheet_name, table_name, clean_col_func, pk_col,
             logging.error(f"PK column {pk_col} not found. Cols: {df.columns.tolist()}")
             return
 
+        # Normalizar IDs de material (quitar .0), vectorizado; los nulos quedan como NULL
+        for id_col in ('codigo', 'material'):
+            if id_col in df.columns:
+                df[id_col] = stored_sku(df[id_col]).where(df[id_col].notna(), None)
+
         # Limpiar datos
         records = []
         for _, row in df.iterrows():
@@ -304,13 +323,7 @@ def sync_master_data(file_path, sheet_name, table_name, clean_col_func, pk_col,
                 if pd.isna(v): 
                     cleaned[k] = None
                 else:
-                    # Normalizar IDs de material (quitar .0)
-                    if k == 'codigo' or k == 'material':
-                        val = str(v).strip()
-                        if val.endswith('.0'): val = val[:-2]
-                        cleaned[k] = val
-                    else:
-                        cleaned[k] = v
+                    cleaned[k] = v
             
             # Lógica de País: Si no viene en el Excel, intentar deducir o poner default
             # Pero en este sistema, el país es vital. Si el código empieza por '4', suele ser Colombia para BACO.
@@ -343,8 +356,9 @@ def sync_programa_produccion(file_path: str, dry_run: bool = False):
     logging.info(f"--- Starting Programa Produccion Sync: {file_path} ---")
     if not os.path.exists(file_path):
         logging.error(f"File not found: {file_path}")
-        return
+        return 0
 
+    uploaded = 0
     try:
         # Based on previous task description for Planes 2025.xlsm
         # Read 'BASE DATOS', cols A-F
@@ -394,13 +408,16 @@ def sync_programa_produccion(file_path: str, dry_run: bool = False):
                 batch = records[i:i+batch_size]
                 try:
                     post_to_supabase("sap_programa_produccion", batch)
+                    uploaded += len(batch)
                 except Exception as e:
                     err_msg = str(e)
                     if hasattr(e, 'response') and e.response is not None:
                         err_msg += f" Response: {e.response.text}"
                     logging.error(f"Error uploading Program batch {i}: {err_msg}")
-            logging.info(f"Finished Programa Produccion sync. Total: {len(records)}")
+            logging.info(f"Finished Programa Produccion sync. Total: {uploaded}/{len(records)}")
+        return uploaded
 
     except Exception as e:
         logging.error(f"Error in sync_programa_produccion: {e}")
+        return uploaded
 
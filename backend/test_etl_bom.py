@@ -0,0 +1,69 @@
+"""Carga incremental del BOM por arista contra una FixtureSource."""
+import pandas as pd
+
+import etl_bom
+
+COLUMNS = ['pt_sku', 'parent_sku', 'component_sku', 'level', 'ratio_mp_to_parent']
+
+
+def load_table(source, rows):
+    source.insert(etl_bom.BOM_TABLE, [dict(zip(COLUMNS, row)) for row in rows])
+
+
+def table(source):
+    df = source.fetch(etl_bom.BOM_TABLE).drop(columns=['id'])
+    return df.sort_values(['pt_sku', 'component_sku']).reset_index(drop=True)
+
+
+def test_only_changed_edges_are_written(fixture_source):
+    load_table(fixture_source, [
+        ('0040001234', None, '0050000001', 1, 1.0),
+        ('0040001234', None, '0050000002', 1, 2.0),
+        ('0040001234', None, '0050000003', 1, 2.0),
+        ('0070000000', None, '0050000003', 1, 2.0),
+    ])
+    # El Excel trae los mismos materiales con otro formato; una arista cambia y otra es nueva
+    excel = pd.DataFrame([
+        (40001234, None, '50000001.0', 1, 1.0),
+        (40001234, None, '50000002', 1, 3.0),
+        (40001234, '50000002', '60000001', 2, 0.5),
+    ], columns=COLUMNS)
+
+    stats = etl_bom.sync_bom_chunks([excel])
+
+    assert stats == {'nuevas': 1, 'cambiadas': 1, 'borradas': 2, 'sin_cambio': 1, 'escritas': 2}
+    result = table(fixture_source)
+    # Las aristas que ya estaban conservan los códigos de la tabla
+    assert list(result['component_sku']) == ['0050000001', '0050000002', '60000001']
+    assert set(result['pt_sku']) == {'0040001234', '40001234'}
+    assert list(result['ratio_mp_to_parent']) == [1.0, 3.0, 0.5]
+
+
+def test_unchanged_workbook_writes_nothing(fixture_source):
+    rows = [('40001234', None, '50000001', 1, 1.0), ('40001234', '50000001', '60000001', 2, 0.25)]
+    load_table(fixture_source, rows)
+    stats = etl_bom.sync_bom_chunks([pd.DataFrame(rows[:1], columns=COLUMNS),
+                                     pd.DataFrame(rows[1:], columns=COLUMNS)])
+    assert stats['escritas'] == 0 and stats['borradas'] == 0 and stats['sin_cambio'] == 2
+
+
+def test_empty_workbook_keeps_loaded_bom(fixture_source):
+    load_table(fixture_source, [('40001234', None, '50000001', 1, 1.0)])
+    stats = etl_bom.sync_bom_chunks([pd.DataFrame(columns=COLUMNS)])
+    assert stats['borradas'] == 0
+    assert len(table(fixture_source)) == 1
+
+
+def test_partial_edge_deletes_are_batched(fixture_source, monkeypatch):
+    load_table(fixture_source, [('40001234', None, f'5000{i:04d}', 1, 1.0) for i in range(7)])
+    deletes = []
+    original = fixture_source.delete
+    monkeypatch.setattr(fixture_source, 'delete',
+                        lambda table_name, params: deletes.append(params) or original(table_name, params))
+    monkeypatch.setattr(etl_bom, 'EDGE_DELETE_BATCH', 3)
+
+    stats = etl_bom.sync_bom_chunks([pd.DataFrame([('40001234', None, '50000000', 1, 1.0)], columns=COLUMNS)])
+
+    assert stats['borradas'] == 6
+    assert [p['or'].count('and(') for p in deletes] == [3, 3]
+    assert list(table(fixture_source)['component_sku']) == ['50000000']
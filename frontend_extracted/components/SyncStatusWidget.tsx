@@ -23,6 +23,26 @@ const TABLE_LABELS: Record<string, string> = {
     sap_demanda_proyectada: 'Demanda Proyectada',
 };
 
+interface SyncJobStep {
+    index: number;
+    label: string;
+    table: string;
+    status: 'success' | 'error';
+    rows: number;
+    duration_s: number;
+    error: string | null;
+}
+
+// Avance del job de /run-sync (eventos SSE de /jobs/{job_id}/events)
+interface SyncProgress {
+    jobId: string;
+    totalSteps: number | null;
+    current: string | null;
+    steps: SyncJobStep[];
+}
+
+const API_URL = 'http://localhost:8000';
+
 const EXPECTED_TABLES = [
     'sap_consumo_movimientos',
     'sap_produccion',
@@ -36,7 +56,9 @@ export const SyncStatusWidget: React.FC = () => {
     const [loading, setLoading] = useState(true);
     const [syncing, setSyncing] = useState(false);
     const [open, setOpen] = useState(false);
+    const [progress, setProgress] = useState<SyncProgress | null>(null);
     const panelRef = useRef<HTMLDivElement>(null);
+    const eventSourceRef = useRef<EventSource | null>(null);
 
     const fetchLogs = async () => {
         setLoading(true);
@@ -53,27 +75,63 @@ export const SyncStatusWidget: React.FC = () => {
         setLoading(false);
     };
 
+    const stopFollowing = () => {
+        eventSourceRef.current?.close();
+        eventSourceRef.current = null;
+        setSyncing(false);
+        setProgress(null);
+    };
+
+    // Sigue el avance del job por SSE; al reconectar, EventSource envía Last-Event-ID y el servidor repite lo pendiente
+    const followJob = (jobId: string) => {
+        eventSourceRef.current?.close();
+        setSyncing(true);
+        setProgress({ jobId, totalSteps: null, current: null, steps: [] });
+
+        const es = new EventSource(`${API_URL}/jobs/${jobId}/events`);
+        eventSourceRef.current = es;
+        es.addEventListener('step_started', (e) => {
+            const data = JSON.parse((e as MessageEvent).data);
+            setProgress((p) => p && { ...p, totalSteps: data.total_steps, current: data.label });
+        });
+        es.addEventListener('step_finished', (e) => {
+            const data = JSON.parse((e as MessageEvent).data) as SyncJobStep & { total_steps: number };
+            setProgress((p) => p && { ...p, totalSteps: data.total_steps, current: null, steps: [...p.steps, data] });
+        });
+        es.addEventListener('job_finished', () => {
+            stopFollowing();
+            fetchLogs();
+        });
+        es.onerror = () => {
+            // CLOSED: el job ya no existe (p. ej. la API se reinició); si no, EventSource reintenta solo
+            if (es.readyState === EventSource.CLOSED) {
+                stopFollowing();
+                fetchLogs();
+            }
+        };
+    };
+
     useEffect(() => {
         fetchLogs();
+        // Si hay una sincronización en curso (iniciada en otra pestaña), se engancha a su avance
+        fetch(`${API_URL}/status`)
+            .then((resp) => resp.json())
+            .then((data) => {
+                if (data.sync_in_progress && data.job) followJob(data.job.job_id);
+            })
+            .catch(() => undefined);
+        return () => eventSourceRef.current?.close();
     }, []);
 
     const handleManualSync = async () => {
         if (syncing) return;
         setSyncing(true);
         try {
-            const resp = await fetch('http://localhost:8000/run-sync', { method: 'POST' });
+            const resp = await fetch(`${API_URL}/run-sync`, { method: 'POST' });
             const data = await resp.json();
 
-            if (data.status === 'started' || data.status === 'busy') {
-                const interval = setInterval(async () => {
-                    const statusResp = await fetch('http://localhost:8000/status');
-                    const statusData = await statusResp.json();
-                    if (!statusData.sync_in_progress) {
-                        clearInterval(interval);
-                        setSyncing(false);
-                        fetchLogs();
-                    }
-                }, 3000);
+            if ((data.status === 'started' || data.status === 'busy') && data.job_id) {
+                followJob(data.job_id);
             } else {
                 setSyncing(false);
             }
@@ -211,7 +269,11 @@ export const SyncStatusWidget: React.FC = () => {
                     )}
                 </span>
 
-                {loading ? (
+                {progress ? (
+                    <span style={{ fontSize: '12px', fontWeight: 600 }}>
+                        Sincronizando {progress.steps.length}/{progress.totalSteps ?? '…'}
+                    </span>
+                ) : loading ? (
                     <span style={{ fontSize: '12px', fontWeight: 600 }}>Verificando…</span>
                 ) : (
                     <span style={{ fontSize: '12px', fontWeight: 600 }}>{cfg.label}</span>
@@ -285,6 +347,43 @@ export const SyncStatusWidget: React.FC = () => {
                         </div>
                     </div>
 
+                    {/* Avance de la sincronización en curso */}
+                    {progress && (
+                        <div style={{ padding: '12px 20px', borderBottom: '1px solid rgba(100,116,139,0.2)' }}>
+                            <div style={{ display: 'flex', justifyContent: 'space-between', marginBottom: '6px' }}>
+                                <span style={{ color: '#e2e8f0', fontSize: '12px', fontWeight: 600 }}>
+                                    {progress.current ?? (progress.totalSteps ? 'Preparando siguiente paso…' : 'Iniciando…')}
+                                </span>
+                                <span style={{ color: '#64748b', fontSize: '11px' }}>
+                                    {progress.steps.length}/{progress.totalSteps ?? '…'}
+                                </span>
+                            </div>
+                            <div style={{ height: '4px', borderRadius: '2px', background: 'rgba(100,116,139,0.2)', overflow: 'hidden' }}>
+                                <div
+                                    style={{
+                                        height: '100%',
+                                        width: `${progress.totalSteps ? (100 * progress.steps.length) / progress.totalSteps : 0}%`,
+                                        background: '#3b82f6',
+                                        transition: 'width 0.3s ease',
+                                    }}
+                                />
+                            </div>
+                            {progress.steps.map((step) => (
+                                <div
+                                    key={step.index}
+                                    style={{ display: 'flex', justifyContent: 'space-between', marginTop: '6px', fontSize: '11px' }}
+                                >
+                                    <span style={{ color: step.status === 'success' ? '#94a3b8' : '#ef4444' }} title={step.error ?? undefined}>
+                                        {step.status === 'success' ? '✓' : '✗'} {step.label}
+                                    </span>
+                                    <span style={{ color: '#64748b', whiteSpace: 'nowrap' }}>
+                                        +{step.rows.toLocaleString()} · {step.duration_s.toFixed(1)}s
+                                    </span>
+                                </div>
+                            ))}
+                        </div>
+                    )}
+
                     {/* Lista de tablas */}
                     <div style={{ padding: '12px 8px', maxHeight: '340px', overflowY: 'auto' }}>
                         {loading ? (
@@ -12,6 +12,8 @@ interface AnomalyAlert {
     actual_value: number;
     deviation_pct: number;
     status: 'open' | 'reviewed' | 'dismissed';
+    occurrence_count?: number;
+    last_seen_at?: string;
 }
 
 export const AnomalyAlertsPage: React.FC = () => {
@@ -97,6 +99,11 @@ export const AnomalyAlertsPage: React.FC = () => {
                                 <tr key={alert.id} className={`hover:bg-slate-800/30 transition-colors ${alert.status !== 'open' ? 'opacity-50' : ''}`}>
                                     <td className="px-6 py-4 text-slate-400 whitespace-nowrap">
                                         {new Date(alert.detected_at).toLocaleString()}
+                                        {(alert.occurrence_count ?? 1) > 1 && (
+                                            <div className="text-[10px] text-amber-500">
+                                                ×{alert.occurrence_count} · última {new Date(alert.last_seen_at ?? alert.detected_at).toLocaleDateString()}
+                                            </div>
+                                        )}
                                     </td>
                                     <td className="px-6 py-4">
                                         <div className="font-bold text-white">{alert.sku_id}</div>
@@ -1,21 +1,51 @@
-import React, { useState, useMemo } from 'react';
+import React, { useState, useMemo, useEffect } from 'react';
 import { useData } from '../contexts/DataContext';
 import { SKU, ABCClass } from '../types';
 import { FilterBar } from '../components/FilterBar';
+import { api } from '../services/api';
+
+interface ProjectionSummaryRow {
+    sku_id: string;
+    estado_hoy: 'healthy' | 'warning' | 'critical';
+    peor_estado: 'healthy' | 'warning' | 'critical';
+    primer_critical: string | null;
+    dias_a_quiebre: number;
+    psoh_min: number;
+}
+
+// El backend identifica los SKUs por código canónico (sin ceros a la izquierda), como DataContext
+const normSku = (id: string) => (id || '').toString().replace(/^0+/, '');
 
 export const CriticalStockPage: React.FC = () => {
     const { skus, isLoading, updateSku } = useData();
     const [filterText, setFilterText] = useState('');
     const [selectedArea, setSelectedArea] = useState('Todos');
+    // PSoH del backend por SKU (null = backend no disponible, se usa el stock actual)
+    const [projectionRows, setProjectionRows] = useState<Record<string, ProjectionSummaryRow> | null>(null);
+
+    useEffect(() => {
+        api.getProjectionSummary(['warning', 'critical'])
+            .then(summary => {
+                const bySku: Record<string, ProjectionSummaryRow> = {};
+                for (const row of summary.rows || []) bySku[normSku(row.sku_id)] = row;
+                setProjectionRows(bySku);
+            })
+            .catch(error => console.warn('Resumen PSoH del backend no disponible, usando stock actual:', error));
+    }, []);
+
+    // Crítico: quiebre proyectado en el horizonte (o stock actual <= 0 sin backend)
+    const isCriticalSku = (sku: SKU) => projectionRows
+        ? projectionRows[normSku(sku.id)]?.peor_estado === 'critical'
+        : sku.stockLevel <= 0;
+
+    const isRiskSku = (sku: SKU) => projectionRows
+        ? projectionRows[normSku(sku.id)]?.peor_estado === 'warning'
+        : sku.stockLevel > 0 && sku.stockLevel < sku.safetyStock;
 
     // Derived Logic
     const criticalItems = useMemo(() => {
-        return skus.filter(sku => {
-            const isCritical = sku.stockLevel <= 0;
-            const isRisk = sku.stockLevel > 0 && sku.stockLevel < sku.safetyStock;
-            return isCritical || isRisk;
-        });
-    }, [skus]);
+        return skus.filter(sku => isCriticalSku(sku) || isRiskSku(sku));
+    }, [skus, projectionRows]);
 
     // Apply UI Filters
     const filteredItems = useMemo(() => {
@@ -29,24 +59,29 @@ export const CriticalStockPage: React.FC = () => {
 
     const stats = useMemo(() => {
         const total = filteredItems.length;
-        const critical = filteredItems.filter(i => i.stockLevel <= 0).length;
+        const critical = filteredItems.filter(isCriticalSku).length;
         const risk = total - critical;
         return { total, critical, risk };
-    }, [filteredItems]);
+    }, [filteredItems, projectionRows]);
 
     const getStatusColor = (sku: SKU) => {
-        if (sku.stockLevel <= 0) return 'text-red-500 bg-red-500/10 border-red-500/20';
-        if (sku.stockLevel < sku.safetyStock) return 'text-amber-500 bg-amber-500/10 border-amber-500/20';
+        if (isCriticalSku(sku)) return 'text-red-500 bg-red-500/10 border-red-500/20';
+        if (isRiskSku(sku)) return 'text-amber-500 bg-amber-500/10 border-amber-500/20';
         return 'text-emerald-500 bg-emerald-500/10 border-emerald-500/20';
     };
 
     const getStatusLabel = (sku: SKU) => {
-        if (sku.stockLevel <= 0) return 'AGOTADO';
-        if (sku.stockLevel < sku.safetyStock) return 'RIESGO';
+        const row = projectionRows?.[normSku(sku.id)];
+        if (row && row.peor_estado === 'critical' && row.estado_hoy !== 'critical') return 'QUIEBRE';
+        if (isCriticalSku(sku)) return 'AGOTADO';
+        if (isRiskSku(sku)) return 'RIESGO';
         return 'OK';
     };
 
     const calculateDaysCoverage = (sku: SKU) => {
+        // Con PSoH del backend: días hasta el primer quiebre proyectado
+        const row = projectionRows?.[normSku(sku.id)];
+        if (row && row.dias_a_quiebre >= 0) return row.dias_a_quiebre;
         if (sku.adu <= 0) return 999;
         return (sku.stockLevel / sku.adu).toFixed(1);
     };
@@ -145,7 +180,7 @@ export const CriticalStockPage: React.FC = () => {
                                 <tr key={sku.id} className="hover:bg-slate-800/30 transition-colors group">
                                     <td className="p-4">
                                         <div className="flex items-center gap-3">
-                                            <div className={`w-2 h-10 rounded-full ${sku.stockLevel <= 0 ? 'bg-red-500' : 'bg-amber-500'}`}></div>
+                                            <div className={`w-2 h-10 rounded-full ${isCriticalSku(sku) ? 'bg-red-500' : 'bg-amber-500'}`}></div>
                                             <div>
                                                 <div className="font-mono text-xs text-slate-500">{sku.id}</div>
                                                 <div className="font-medium text-slate-200">{sku.name}</div>
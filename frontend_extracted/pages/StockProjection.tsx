@@ -128,8 +128,35 @@ export const StockProjection: React.FC<StockProjectionProps> = ({
     }, [horizon]); // Solo cuando cambia el horizonte
 
     const fetchAlerts = async () => {
-        // Las alertas se calculan de forma simplificada en el cliente
-        // basándose en los SKUs disponibles y su stock actual
+        // Alertas desde el PSoH del backend: primer día warning/critical dentro del horizonte
+        try {
+            const summary = await api.getProjectionSummary(['warning', 'critical']);
+            // El resumen viene con código canónico (sin ceros a la izquierda); las alertas usan el id de la lista
+            const visible = new Map((skusToDisplay || []).map(s => [(s.id || '').toString().replace(/^0+/, ''), s.id]));
+            const today = new Date(new Date().toISOString().split('T')[0]);
+            const daysUntil = (dateStr: string) => Math.round((new Date(dateStr).getTime() - today.getTime()) / 86400000);
+            const serverAlerts: SkuAlert[] = [];
+            for (const row of summary.rows || []) {
+                const skuId = visible.get((row.sku_id || '').toString().replace(/^0+/, ''));
+                if (!skuId) continue;
+                const isCritical = row.primer_critical && daysUntil(row.primer_critical) <= horizon;
+                const date = isCritical ? row.primer_critical : row.primer_warning;
+                if (!date || daysUntil(date) > horizon) continue;
+                serverAlerts.push({
+                    sku: skuId,
+                    type: isCritical ? 'critical' : 'warning',
+                    date,
+                    psoh: row.psoh_min,
+                    days_until: daysUntil(date)
+                });
+            }
+            setAlerts(serverAlerts);
+            return;
+        } catch (serverError) {
+            console.warn('Resumen PSoH del backend no disponible, alertas simplificadas:', serverError);
+        }
+
+        // Respaldo: alertas simplificadas en el cliente según el stock actual
         try {
             const simpleAlerts: SkuAlert[] = [];
             for (const sku of (skusToDisplay || []).slice(0, 50)) { // Limitar a 50 para performance
@@ -157,50 +184,63 @@ export const StockProjection: React.FC<StockProjectionProps> = ({
         }
     };
 
+    // Respaldo si el backend no responde: mismo cálculo PSoH en el navegador desde Supabase
+    const calculateClientProjection = async (skuId: string, warehouseFilter: string[] | null): Promise<ProjectionDay[]> => {
+        const currentSku = allSkus.find(s => s.id === skuId);
+        const safetyStock = currentSku?.safetyStock || 0;
+
+        // Calcular rango de fechas para consultas
+        const today = new Date();
+        const endDate = new Date(today);
+        endDate.setDate(today.getDate() + horizon);
+        const startStr = today.toISOString().split('T')[0];
+        const endStr = endDate.toISOString().split('T')[0];
+
+        // Consultar datos en paralelo desde Supabase
+        const [demandaData, stockData, produccionData, consumoData, feiFactor] = await Promise.all([
+            api.getDemandaProyectada(skuId),
+            api.getStockActual(skuId),
+            api.getProduccionProgramada(skuId, startStr, endStr),
+            api.getConsumoProduccion(skuId, startStr, endStr),
+            api.getFEIFactor(skuId)
+        ]);
+
+        console.log('DEBUG: Demanda mensual:', demandaData.length, 'registros');
+        console.log('DEBUG: Stock MB52:', stockData.length, 'registros');
+        console.log('DEBUG: Producción:', produccionData.length, 'registros');
+        console.log('DEBUG: Consumos:', consumoData.length, 'registros');
+
+        // Calcular stock inicial (con o sin filtro de almacenes)
+        const { total: initialStock, breakdown: stockBreakdown } = calculateInitialStock(
+            stockData,
+            warehouseFilter
+        );
+
+        // Calcular proyección PSoH con distribución diaria de demanda mensual
+        return calculateProjection(
+            initialStock,
+            safetyStock,
+            demandaData,
+            produccionData,
+            consumoData,
+            horizon,
+            stockBreakdown,
+            feiFactor
+        );
+    };
+
     const fetchProjection = async (skuId: string, warehouseFilter: string[] | null = null) => {
         setIsLoading(true);
         try {
-            const currentSku = allSkus.find(s => s.id === skuId);
-            const safetyStock = currentSku?.safetyStock || 0;
-
-            // Calcular rango de fechas para consultas
-            const today = new Date();
-            const endDate = new Date(today);
-            endDate.setDate(today.getDate() + horizon);
-            const startStr = today.toISOString().split('T')[0];
-            const endStr = endDate.toISOString().split('T')[0];
-
-            // Consultar datos en paralelo desde Supabase
-            const [demandaData, stockData, produccionData, consumoData, feiFactor] = await Promise.all([
-                api.getDemandaProyectada(skuId),
-                api.getStockActual(skuId),
-                api.getProduccionProgramada(skuId, startStr, endStr),
-                api.getConsumoProduccion(skuId, startStr, endStr),
-                api.getFEIFactor(skuId)
-            ]);
-
-            console.log('DEBUG: Demanda mensual:', demandaData.length, 'registros');
-            console.log('DEBUG: Stock MB52:', stockData.length, 'registros');
-            console.log('DEBUG: Producción:', produccionData.length, 'registros');
-            console.log('DEBUG: Consumos:', consumoData.length, 'registros');
-
-            // Calcular stock inicial (con o sin filtro de almacenes)
-            const { total: initialStock, breakdown: stockBreakdown } = calculateInitialStock(
-                stockData,
-                warehouseFilter
-            );
-
-            // Calcular proyección PSoH con distribución diaria de demanda mensual
-            const proj = calculateProjection(
-                initialStock,
-                safetyStock,
-                demandaData,
-                produccionData,
-                consumoData,
-                horizon,
-                stockBreakdown,
-                feiFactor
-            );
+            // PSoH calculado en el backend (projection_engine); si no responde, se calcula aquí
+            let proj: ProjectionDay[];
+            try {
+                const serverProjection = await api.getSkuProjection(skuId, horizon, warehouseFilter);
+                proj = serverProjection.projection;
+            } catch (serverError) {
+                console.warn('Proyección del backend no disponible, calculando en el navegador:', serverError);
+                proj = await calculateClientProjection(skuId, warehouseFilter);
+            }
 
             console.log('DEBUG: Projection array length:', proj.length);
             if (proj.length > 0) {
@@ -1,5 +1,7 @@
 import { supabase } from './supabase';
 
+const BACKEND_URL = 'http://localhost:8000';
+
 export const api = {
     checkHealth: async (): Promise<boolean> => {
         // Simple check to see if we can reach Supabase
@@ -91,8 +93,9 @@ export const api = {
      */
     getExplodedDemand: async (monthStr: string) => {
         const { data, error } = await supabase
-            .from('view_exploded_demand')
+            .from('sap_demanda_explosionada')
             .select('*')
+            .eq('origen', 'demanda_proyectada')
             .eq('mes', monthStr);
 
         if (error) {
@@ -112,9 +115,11 @@ export const api = {
         let hasMore = true;
 
         while (hasMore) {
+            // Tabla materializada por agents/demand_explosion.py (antes view_exploded_demand)
             const { data, error } = await supabase
-                .from('view_exploded_demand')
+                .from('sap_demanda_explosionada')
                 .select('sku_id, mes, cantidad_exploded') // OPT: solo columnas necesarias
+                .eq('origen', 'demanda_proyectada')
                 .gte('mes', startMonth)
                 .range(page * pageSize, (page + 1) * pageSize - 1);
 
@@ -398,6 +403,59 @@ export const api = {
         return allData;
     },
 
+    /**
+     * Pronóstico agregado pre-calculado por el motor (sap_pronostico_rollup).
+     * periodo: 'semana' | 'mes'; dimension: 'jerarquia_nivel_1' | 'grupo_articulos' | 'pais'.
+     */
+    getForecastRollup: async (periodo: 'semana' | 'mes', dimension: 'jerarquia_nivel_1' | 'grupo_articulos' | 'pais', valor?: string) => {
+        let query = supabase
+            .from('sap_pronostico_rollup')
+            .select('periodo_inicio, valor, tipo, cantidad_pronosticada, skus')
+            .eq('periodo', periodo)
+            .eq('dimension', dimension)
+            .order('periodo_inicio', { ascending: true });
+
+        if (valor && valor !== 'All') {
+            query = query.eq('valor', valor);
+        }
+
+        const { data, error } = await query;
+        if (error) {
+            console.error('Error fetching forecast rollup:', error);
+            throw error;
+        }
+        return data || [];
+    },
+
+    /**
+     * PSoH del catálogo calculado por el backend (modules/projection_engine.py, GET /projection/summary).
+     * Una fila por SKU con estado_hoy, peor_estado, primer_warning, primer_critical, dias_a_quiebre y psoh_min.
+     */
+    getProjectionSummary: async (status?: string[], limit?: number) => {
+        const params = new URLSearchParams();
+        (status || []).forEach(s => params.append('status', s));
+        if (limit) params.set('limit', String(limit));
+        const response = await fetch(`${BACKEND_URL}/projection/summary?${params.toString()}`);
+        if (!response.ok) {
+            throw new Error(`Error fetching projection summary: ${response.status}`);
+        }
+        return response.json();
+    },
+
+    /**
+     * Proyección día a día de un SKU calculada por el backend (GET /projection/{sku_id}).
+     * Mismo formato ProjectionDay que calculateProjection; almacenes limita el stock inicial.
+     */
+    getSkuProjection: async (skuId: string, horizon: number, almacenes?: string[] | null) => {
+        const params = new URLSearchParams({ horizon: String(horizon) });
+        (almacenes || []).forEach(a => params.append('almacenes', a));
+        const response = await fetch(`${BACKEND_URL}/projection/${encodeURIComponent(skuId)}?${params.toString()}`);
+        if (!response.ok) {
+            throw new Error(`Error fetching projection for ${skuId}: ${response.status}`);
+        }
+        return response.json();
+    },
+
     getConsumoHistory: async () => {
         // Deprecated but kept for backward compatibility if needed
         // Just calls the new one with smaller window or direct query